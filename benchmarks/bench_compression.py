@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Compares compression of file and dict fields: throughput of record writes and uncached reads of whole content,
+and size on disk. Compression trades CPU time for I/O, so results depend on compressibility of data and on speed
+of disk (use --path to test on real disk instead of temp directory, which may be in memory).
+
+    python benchmarks/bench_compression.py --records 200 --file-size 65536
+"""
+
+import os
+import sys
+import time
+import shutil
+import random
+import argparse
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import fsdb
+from fsdb.compression import COMPRESSIONS
+
+WORDS = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit', 'sed', 'do', 'eiusmod']
+
+
+def get_values(i, file_size):
+    rnd = random.Random(i)
+    text = ' '.join(rnd.choice(WORDS) for _ in range(file_size // 5)).encode('utf-8')[:file_size]
+    return {
+        'attrs': {'key{}'.format(j): rnd.choice(WORDS) for j in range(100)},
+        'file': {'name': 'file{}.txt'.format(i), 'data': text},
+    }
+
+
+def run(root_path, compression, records, file_size):
+    db_name = compression or 'none'
+    manager = fsdb.Manager(root_path)
+    manager.create_database(db_name)
+    manager.open_database(db_name)
+    table = manager.create_table('bench_table', [
+        {'name': 'id', 'type': 'int'},
+        {'name': 'attrs', 'type': 'dict', 'compression': compression},
+        {'name': 'file', 'type': 'file', 'compression': compression},
+    ])
+    values_list = [get_values(i, file_size) for i in range(records)]
+
+    start = time.perf_counter()
+    record_list = [manager.create_record('bench_table', values) for values in values_list]
+    write_time = time.perf_counter() - start
+
+    table.cache.clear()
+    start = time.perf_counter()
+    for record in record_list:
+        values = record.read(file_handles=True)
+        with values['file']['handle'] as handle:
+            for _ in handle.iter_chunks():
+                pass
+    read_time = time.perf_counter() - start
+
+    size = 0
+    for record in record_list:
+        size += os.path.getsize(record.data_path) + os.path.getsize(record.read()['file']['stored_path'])
+    manager.close_database()
+    return write_time, read_time, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=200)
+    parser.add_argument('--file-size', type=int, default=64 * 1024)
+    parser.add_argument('--path', default=None, help='directory for test database (default is temp directory)')
+    args = parser.parse_args()
+
+    root_path = tempfile.mkdtemp(prefix='fsdb_bench_', dir=args.path)
+    try:
+        print('records: {}, file size: {} B'.format(args.records, args.file_size))
+        print('{:>12} {:>10} {:>10} {:>10} {:>10} {:>12}'.format(
+            'compression', 'write [s]', 'write/s', 'read [s]', 'read/s', 'avg size [B]'))
+        for compression in [None] + COMPRESSIONS:
+            write_time, read_time, size = run(root_path, compression, args.records, args.file_size)
+            print('{:>12} {:>10.3f} {:>10.0f} {:>10.3f} {:>10.0f} {:>12.0f}'.format(
+                compression or 'none', write_time, args.records / write_time, read_time, args.records / read_time,
+                size / args.records))
+    finally:
+        shutil.rmtree(root_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Compares speed of record create/write with different durability modes.
+
+    python benchmarks/bench_durability.py --records 2000
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import fsdb
+from fsdb.tools import DURABILITY_MODES
+
+
+def run(root_path, durability, records):
+    manager = fsdb.Manager(root_path)
+    manager.create_database(durability)
+    manager.open_database(durability)
+    manager.set_durability(durability)
+    manager.create_table('bench_table', [
+        {'name': 'id', 'type': 'int'},
+        {'name': 'num', 'type': 'int'},
+    ])
+
+    start = time.perf_counter()
+    ids = manager.create_records('bench_table', [{'num': i} for i in range(records)], return_ids=True)
+    create_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for record in manager.browse_records('bench_table', ids):
+        record.write({'num': 0})
+    write_time = time.perf_counter() - start
+
+    manager.close_database()
+    return create_time, write_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=1000)
+    parser.add_argument('--modes', nargs='+', default=DURABILITY_MODES, choices=DURABILITY_MODES)
+    parser.add_argument('--path', default=None, help='directory for test database (default is temp directory)')
+    args = parser.parse_args()
+
+    root_path = tempfile.mkdtemp(prefix='fsdb_bench_', dir=args.path)
+    try:
+        print('records: {}'.format(args.records))
+        print('{:>10} {:>12} {:>12} {:>12} {:>12}'.format('mode', 'create [s]', 'create/s', 'write [s]', 'write/s'))
+        for durability in args.modes:
+            create_time, write_time = run(root_path, durability, args.records)
+            print('{:>10} {:>12.3f} {:>12.0f} {:>12.3f} {:>12.0f}'.format(
+                durability, create_time, args.records / create_time, write_time, args.records / write_time))
+    finally:
+        shutil.rmtree(root_path)
+
+
+if __name__ == '__main__':
+    main()
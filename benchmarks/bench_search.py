@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Compares serial and parallel full table scans of Table.search_records.
+
+    python benchmarks/bench_search.py --records 20000 --workers 1 4 8 16
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import fsdb
+
+
+def create_table(manager, records):
+    manager.create_database('bench_db')
+    manager.open_database('bench_db')
+    table = manager.create_table('bench_table', [
+        {'name': 'id', 'type': 'int'},
+        {'name': 'num', 'type': 'int'},
+        {'name': 'text', 'type': 'str'},
+    ])
+    for i in range(records):
+        manager.create_record('bench_table', {'num': i % 100, 'text': 'text {}'.format(i)})
+    return table
+
+
+def run_search(table, domain, workers, chunk_size, limit=None):
+    table.cache.clear()  # measure reads from disk, not from cache
+    start = time.perf_counter()
+    records = table.search_records(domain, limit=limit, workers=workers, chunk_size=chunk_size)
+    return time.perf_counter() - start, len(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=10000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--chunk-size', type=int, default=None)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--path', default=None, help='directory for test database (default is temp directory)')
+    args = parser.parse_args()
+
+    root_path = tempfile.mkdtemp(prefix='fsdb_bench_', dir=args.path)
+    try:
+        manager = fsdb.Manager(root_path)
+        table = create_table(manager, args.records)
+        domain = [('num', '=', 7)]
+
+        print('records: {}, domain: {}'.format(args.records, domain))
+        print('{:>8} {:>12} {:>14} {:>12} {:>14}'.format(
+            'workers', 'scan [s]', 'records/s', 'limit 10 [s]', 'speedup'))
+        serial_time = None
+        for workers in args.workers:
+            scan_time = min(run_search(table, domain, workers, args.chunk_size)[0] for _ in range(args.repeat))
+            limit_time = min(run_search(table, domain, workers, args.chunk_size, 10)[0] for _ in range(args.repeat))
+            serial_time = serial_time or scan_time
+            print('{:>8} {:>12.3f} {:>14.0f} {:>12.4f} {:>13.2f}x'.format(
+                workers, scan_time, args.records / scan_time, limit_time, serial_time / scan_time))
+
+        manager.close_database()
+    finally:
+        shutil.rmtree(root_path)
+
+
+if __name__ == '__main__':
+    main()
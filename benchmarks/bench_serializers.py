@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Compares serializers of record data files: throughput of record writes and uncached reads, and size on disk.
+
+    python benchmarks/bench_serializers.py --records 2000
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import datetime
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import fsdb
+from fsdb.serializers import SERIALIZERS
+
+
+def get_values(i):
+    return {
+        'name': 'record name {}'.format(i),
+        'num': i,
+        'price': i * 1.25,
+        'active': i % 2 == 0,
+        'tags': ['tag{}'.format(j) for j in range(i % 5)],
+        'attrs': {'color': 'red', 'size': i % 10, 'weight': 2.5},
+        'date': datetime.datetime(2020, 1, 1) + datetime.timedelta(minutes=i),
+    }
+
+
+def run(root_path, serializer, records):
+    manager = fsdb.Manager(root_path)
+    manager.create_database(serializer)
+    manager.open_database(serializer)
+    table = manager.create_table('bench_table', [
+        {'name': 'id', 'type': 'int'},
+        {'name': 'name', 'type': 'str'},
+        {'name': 'num', 'type': 'int'},
+        {'name': 'price', 'type': 'float'},
+        {'name': 'active', 'type': 'bool'},
+        {'name': 'tags', 'type': 'list'},
+        {'name': 'attrs', 'type': 'dict'},
+        {'name': 'date', 'type': 'datetime'},
+    ], serializer=serializer)
+    ids = manager.create_records('bench_table', [get_values(i) for i in range(records)], return_ids=True)
+    record_list = manager.browse_records('bench_table', ids)
+
+    start = time.perf_counter()
+    for record in record_list:
+        record.write({'num': 0})
+    write_time = time.perf_counter() - start
+
+    table.cache.clear()
+    start = time.perf_counter()
+    for record in record_list:
+        record.read()
+    read_time = time.perf_counter() - start
+
+    size = sum(os.path.getsize(record.data_path) for record in record_list)
+    manager.close_database()
+    return write_time, read_time, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=1000)
+    parser.add_argument('--serializers', nargs='+', default=sorted(SERIALIZERS.keys()), choices=sorted(SERIALIZERS))
+    parser.add_argument('--path', default=None, help='directory for test database (default is temp directory)')
+    args = parser.parse_args()
+
+    root_path = tempfile.mkdtemp(prefix='fsdb_bench_', dir=args.path)
+    try:
+        print('records: {}'.format(args.records))
+        print('{:>14} {:>10} {:>10} {:>10} {:>10} {:>12}'.format(
+            'serializer', 'write [s]', 'write/s', 'read [s]', 'read/s', 'avg size [B]'))
+        for serializer in args.serializers:
+            write_time, read_time, size = run(root_path, serializer, args.records)
+            print('{:>14} {:>10.3f} {:>10.0f} {:>10.3f} {:>10.0f} {:>12.0f}'.format(
+                serializer, write_time, args.records / write_time, read_time, args.records / read_time,
+                size / args.records))
+    finally:
+        shutil.rmtree(root_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,9 @@
 # classes
 from .manager import Manager
+from .async_manager import AsyncManager
 from .database import Database
 from .cache import Cache
 from .table import Table
 from .field import Field
 from .record import Record
+from .file_handle import FileHandle
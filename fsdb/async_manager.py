@@ -0,0 +1,282 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from .manager import Manager
+
+import asyncio
+import logging
+import functools
+import contextlib
+import concurrent.futures
+
+_logger = logging.getLogger(__name__)
+
+
+class ReadWriteLock(object):
+    """
+    asyncio lock that can be held by many readers or by one writer. Waiting writers have priority over new readers.
+    """
+
+    def __init__(self):
+        self.condition = asyncio.Condition()
+        self.readers = 0
+        self.writer = False
+        self.writers_waiting = 0
+
+    @contextlib.asynccontextmanager
+    async def read(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: not self.writer and self.writers_waiting == 0)
+            self.readers += 1
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.readers -= 1
+                self.condition.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def write(self):
+        async with self.condition:
+            self.writers_waiting += 1
+            try:
+                await self.condition.wait_for(lambda: not self.writer and self.readers == 0)
+            finally:
+                self.writers_waiting -= 1
+            self.writer = True
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.writer = False
+                self.condition.notify_all()
+
+
+class AsyncManager(object):
+    """
+    asyncio version of Manager. All filesystem work is done by Manager in thread pool, so that event loop is never
+    blocked. Operations on different tables and reads of the same table run concurrently, writes to table wait for
+    other operations on the same table and operations with database (open/close/create table/...) are exclusive.
+    """
+
+    def __init__(self, root_path, max_workers=4):
+        self.manager = Manager(root_path)
+        self.max_workers = max_workers
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
+        self._semaphore = None
+        self._database_lock = None
+        self._table_locks = {}  # table name -> ReadWriteLock
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    @property
+    def root_path(self):
+        return self.manager.root_path
+
+    @property
+    def database(self):
+        return self.manager.database
+
+    async def close(self):
+        """
+        Closes opened database and stops thread pool.
+        """
+        if self.manager.database:
+            await self.close_database()
+        await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown)
+
+    # running of functions in thread pool
+
+    def _get_database_lock(self):
+        if self._database_lock is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+            self._database_lock = ReadWriteLock()
+        return self._database_lock
+
+    @contextlib.asynccontextmanager
+    async def _lock(self, table_name=None, write=False):
+        """
+        :param table_name: name of table, None for operations with database
+        :param write: if True, lock is exclusive
+        """
+        database_lock = self._get_database_lock()
+
+        if table_name is None:
+            database_lock_ctx = database_lock.write() if write else database_lock.read()
+            async with database_lock_ctx:
+                yield
+            return
+
+        async with database_lock.read():
+            if table_name not in self._table_locks:
+                self._table_locks[table_name] = ReadWriteLock()
+            table_lock = self._table_locks[table_name]
+            async with (table_lock.write() if write else table_lock.read()):
+                yield
+
+    async def _run(self, func, *args, **kwargs):
+        """
+        Runs function in thread pool. If task is cancelled before function started, function is cancelled too. If
+        it's already running, task waits for function to finish (so that locks are not released while function is
+        still running) and then re-raises CancelledError.
+        """
+        async with self._semaphore:
+            future = self.executor.submit(functools.partial(func, *args, **kwargs))
+            try:
+                return await asyncio.wrap_future(future)
+            except asyncio.CancelledError:
+                future.cancel()  # fails if function is already running
+                while not future.done():
+                    try:
+                        await asyncio.shield(asyncio.wrap_future(future))
+                    except asyncio.CancelledError:
+                        continue
+                    except Exception:
+                        break
+                raise
+
+    async def _call(self, func, *args, table_name=None, write=False, **kwargs):
+        async with self._lock(table_name, write):
+            return await self._run(func, *args, **kwargs)
+
+    # Config
+
+    async def init_from_config(self, config):
+        return await self._call(self.manager.init_from_config, config, write=True)
+
+    # Database
+
+    async def is_database(self, name):
+        return await self._call(self.manager.is_database, name)
+
+    async def create_database(self, name):
+        return await self._call(self.manager.create_database, name, write=True)
+
+    async def open_database(self, name, warm_up=None):
+        return await self._call(self.manager.open_database, name, warm_up=warm_up, write=True)
+
+    async def close_database(self):
+        return await self._call(self.manager.close_database, write=True)
+
+    async def delete_database(self, name):
+        return await self._call(self.manager.delete_database, name, write=True)
+
+    async def flush(self):
+        return await self._call(self.manager.flush, write=True)
+
+    async def set_durability(self, durability, table_name=None):
+        return await self._call(self.manager.set_durability, durability, table_name, write=True)
+
+    async def set_serializer(self, serializer, table_name=None):
+        return await self._call(self.manager.set_serializer, serializer, table_name, write=True)
+
+    async def set_blob_store(self, enabled=True):
+        return await self._call(self.manager.set_blob_store, enabled, write=True)
+
+    async def gc_blobs(self, limit=None):
+        return await self._call(self.manager.gc_blobs, limit)
+
+    async def get_cache_stats(self):
+        return await self._call(self.manager.get_cache_stats)
+
+    async def reset_cache_stats(self):
+        return await self._call(self.manager.reset_cache_stats)
+
+    # Table
+
+    async def is_table(self, name):
+        return await self._call(self.manager.is_table, name)
+
+    async def get_table(self, name):
+        return await self._call(self.manager.get_table, name)
+
+    async def create_table(self, name, fields, cache_size=None, cache_size_limit=None, durability=None,
+                           serializer=None):
+        return await self._call(self.manager.create_table, name, fields, cache_size=cache_size,
+                                cache_size_limit=cache_size_limit, durability=durability, serializer=serializer,
+                                write=True)
+
+    async def set_write_behind(self, table_name, enabled=True, max_records=1000, max_delay=1.0):
+        return await self._call(self.manager.set_write_behind, table_name, enabled=enabled, max_records=max_records,
+                                max_delay=max_delay, table_name=table_name, write=True)
+
+    async def delete_table(self, name):
+        return await self._call(self.manager.delete_table, name, write=True)
+
+    # IDs
+
+    async def ids2str(self, table_name, ids):
+        return await self._call(self.manager.ids2str, table_name, ids, table_name=table_name)
+
+    async def str2ids(self, table_name, ids_str):
+        return await self._call(self.manager.str2ids, table_name, ids_str, table_name=table_name)
+
+    # Record
+
+    async def create_record(self, table_name, values):
+        return await self._call(self.manager.create_record, table_name, values, table_name=table_name, write=True)
+
+    async def create_records(self, table_name, values_list, return_ids=False, workers=None):
+        return await self._call(self.manager.create_records, table_name, values_list, return_ids=return_ids,
+                                workers=workers, table_name=table_name, write=True)
+
+    async def write_records(self, table_name, values, domain=None, workers=None):
+        return await self._call(self.manager.write_records, table_name, values, domain=domain, workers=workers,
+                                table_name=table_name, write=True)
+
+    async def browse_records(self, table_name, ids):
+        return await self._call(self.manager.browse_records, table_name, ids, table_name=table_name)
+
+    async def search_records(self, table_name, domain=None, order=None, limit=None, offset=0, cursor=None,
+                             workers=None, chunk_size=None):
+        return await self._call(self.manager.search_records, table_name, domain=domain, order=order, limit=limit,
+                                offset=offset, cursor=cursor, workers=workers, chunk_size=chunk_size,
+                                table_name=table_name)
+
+    async def iter_records(self, table_name, domain=None, order=None, limit=None, offset=0, cursor=None,
+                           workers=None, chunk_size=None, batch_size=100):
+        """
+        Async generator of records. Records are read in thread pool in batches of batch_size records, table is
+        locked only while batch is being read. Workers and chunk_size are passed to Manager.iter_records.
+        """
+        records = await self._call(self.manager.iter_records, table_name, domain=domain, order=order, limit=limit,
+                                   offset=offset, cursor=cursor, workers=workers, chunk_size=chunk_size,
+                                   table_name=table_name)
+
+        def next_batch():
+            batch = []
+            for record in records:
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    break
+            return batch
+
+        try:
+            while True:
+                batch = await self._call(next_batch, table_name=table_name)
+                if not batch:
+                    break
+                for record in batch:
+                    yield record
+        finally:
+            await self._run(records.close)
+
+    async def get_cursor(self, table_name, record, order=None):
+        return await self._call(self.manager.get_cursor, table_name, record, order=order, table_name=table_name)
+
+    async def delete_records(self, table_name, domain=None, workers=None):
+        return await self._call(self.manager.delete_records, table_name, domain=domain, workers=workers,
+                                table_name=table_name, write=True)
+
+    async def read_record(self, record, field_names=None, file_handles=False):
+        return await self._call(record.read, field_names, file_handles=file_handles, table_name=record.table.name)
+
+    async def write_record(self, record, values):
+        return await self._call(record.write, values, table_name=record.table.name, write=True)
+
+    async def delete_record(self, record):
+        return await self._call(record.delete, table_name=record.table.name, write=True)
@@ -0,0 +1,192 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from .tools import iter_chunks, file_digest, fsync_dir, get_tmp_path, DURABILITY_NONE, DURABILITY_FSYNC_DIR
+from .file_handle import FileHandle
+
+import os
+import stat
+import shutil
+import hashlib
+import logging
+import threading
+
+_logger = logging.getLogger(__name__)
+
+
+class BlobStore(object):
+    """
+    Content-addressed store of files of file/file_list fields, shared by all tables of database. Every distinct content
+    is stored once, as ".blobs/<first 2 chars of sha256>/<sha256>" file in database directory, and record files are
+    hardlinks to it (or copies, if hardlinks are not supported), so they are still normal files for readers.
+
+    Number of references to blob is its number of hardlinks minus one, so it's updated by filesystem when record files
+    are removed. Blobs without references are removed by release() (when records are deleted or files replaced) or
+    by incremental gc() (e.g. after table is deleted).
+
+    Blobs are read-only, record files that are hardlinks must never be modified in place.
+    """
+
+    dir_name = '.blobs'
+
+    def __init__(self, database):
+        self.database = database
+        self.blobs_path = os.path.join(database.db_path, self.dir_name)
+        self.tmp_path = os.path.join(self.blobs_path, 'tmp')
+
+        self.lock = threading.RLock()  # blob can't be removed by gc while it's being linked
+        self.gc_cursor = None  # (shard name, blob name) where previous gc() ended
+
+    def get_path(self, digest):
+        return os.path.join(self.blobs_path, digest[:2], digest)
+
+    def get_shards(self):
+        if not os.path.exists(self.blobs_path):
+            return []
+        with os.scandir(self.blobs_path) as entries:
+            return sorted(entry.name for entry in entries if entry.is_dir() and entry.name != 'tmp')
+
+    # write
+
+    @staticmethod
+    def get_digest(data):
+        """
+        :return: sha256 hex digest of data that can be hashed without being consumed, else None
+        """
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            return hashlib.sha256(data).hexdigest()
+        elif isinstance(data, FileHandle) and data.compression is None:
+            return file_digest(data.path).hex()
+        return None
+
+    def write_tmp(self, data, durability):
+        """
+        Writes data to temporary file in blob store.
+        :return: (sha256 hex digest, temporary file path)
+        """
+        os.makedirs(self.tmp_path, exist_ok=True)
+        tmp_path = os.path.join(self.tmp_path, '{}-{}.tmp'.format(os.getpid(), threading.get_ident()))
+        h = hashlib.sha256()
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in iter_chunks(data):
+                    h.update(chunk)
+                    f.write(chunk)
+                if durability != DURABILITY_NONE:
+                    f.flush()
+                    os.fsync(f.fileno())
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return h.hexdigest(), tmp_path
+
+    def write(self, path, data, durability=DURABILITY_NONE):
+        """
+        Stores data in blob store and replaces file at path with hardlink to blob. Data that can be hashed without
+        being consumed (bytes, FileHandle) are not written at all if blob with same content already exists.
+        :param path: path of record file
+        :param data: any data accepted by tools.iter_chunks
+        :return: sha256 hex digest of blob
+        """
+        digest = self.get_digest(data)
+        tmp_path = None
+        if digest is None or not os.path.exists(self.get_path(digest)):
+            digest, tmp_path = self.write_tmp(data, durability)
+
+        with self.lock:
+            blob_path = self.get_path(digest)
+            if os.path.exists(blob_path):
+                if tmp_path is not None:
+                    os.remove(tmp_path)
+            else:
+                if tmp_path is None:  # blob was removed by gc since it was checked
+                    digest, tmp_path = self.write_tmp(data, durability)
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                os.chmod(tmp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+                os.replace(tmp_path, blob_path)
+                if durability == DURABILITY_FSYNC_DIR:
+                    fsync_dir(os.path.dirname(blob_path))
+            self.link(blob_path, path, durability)
+        return digest
+
+    @staticmethod
+    def link(blob_path, path, durability=DURABILITY_NONE):
+        """
+        Atomically replaces file at path with hardlink to blob, or with its copy if hardlink can't be created.
+        """
+        dir_path = os.path.dirname(path)
+        tmp_path = get_tmp_path(path)
+        try:
+            try:
+                os.link(blob_path, tmp_path)
+            except OSError:
+                # different filesystem, too many links, hardlinks not supported...
+                _logger.debug('Can\'t create hardlink to blob "{}", copying it.'.format(blob_path))
+                shutil.copyfile(blob_path, tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if durability == DURABILITY_FSYNC_DIR:
+            fsync_dir(dir_path or '.')
+
+    # garbage collection
+
+    def get_ref_count(self, digest):
+        """
+        :return: number of record files that are hardlinks to blob, None if blob doesn't exist
+        """
+        try:
+            return os.stat(self.get_path(digest)).st_nlink - 1
+        except FileNotFoundError:
+            return None
+
+    def release(self, digests):
+        """
+        Removes blobs that are no longer referenced, called after record files linked to them were removed.
+        :param digests: sha256 hex digests of blobs
+        :return: number of removed blobs
+        """
+        removed = 0
+        with self.lock:
+            for digest in set(digests):
+                if self.get_ref_count(digest) == 0:
+                    os.remove(self.get_path(digest))
+                    removed += 1
+        return removed
+
+    def gc(self, limit=None):
+        """
+        Removes blobs that are not referenced. Collection is incremental, every call checks at most limit blobs,
+        continuing where previous call ended.
+        :param limit: max number of checked blobs, None for all blobs
+        :return: number of removed blobs
+        """
+        _logger.info('GC BLOBS OF DATABASE "{}" (limit={})'.format(self.database.name, limit))
+        checked = removed = 0
+        start_shard, start_name = self.gc_cursor or (None, None)
+        self.gc_cursor = None
+
+        for shard in self.get_shards():
+            if start_shard is not None and shard < start_shard:
+                continue
+            shard_path = os.path.join(self.blobs_path, shard)
+            for name in sorted(os.listdir(shard_path)):
+                if shard == start_shard and start_name is not None and name <= start_name:
+                    continue
+                if limit is not None and checked >= limit:
+                    return removed
+                checked += 1
+                self.gc_cursor = (shard, name)
+                with self.lock:
+                    path = os.path.join(shard_path, name)
+                    try:
+                        if os.stat(path).st_nlink <= 1:
+                            os.remove(path)
+                            removed += 1
+                    except FileNotFoundError:
+                        pass
+
+        self.gc_cursor = None  # whole store was checked, next gc() starts from beginning
+        return removed
@@ -3,59 +3,216 @@
 
 import sys
 import logging
+import threading
+from collections import OrderedDict
 
 _logger = logging.getLogger(__name__)
 
 
+def get_deep_size(value, seen=None):
+    """
+    Estimates memory used by value, including all objects it contains.
+    :param value: object to measure
+    :param seen: set of ids of already measured objects (shared objects are counted once)
+    :return: size in bytes
+    """
+    if seen is None:
+        seen = set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for k, v in value.items():
+            size += get_deep_size(k, seen) + get_deep_size(v, seen)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for v in value:
+            size += get_deep_size(v, seen)
+    return size
+
+
 class Cache(object):
+    """
+    LRU cache with size limits. Cache can be split into named partitions (Database cache has one for every table),
+    each partition with its own size limits. Size limits of parent cache are used as global ceiling for cache and
+    all its partitions. Cache can be used from multiple threads, all partitions share lock of parent cache.
+    """
+
+    STATS_COUNTERS = ['hits', 'misses', 'evictions']
 
-    def __init__(self, cache_size=None):
-        self.cache = {}
-        self.access_list = []
+    def __init__(self, cache_size=None, cache_size_limit=None, name=None, parent=None):
+        self.name = name
+        self.parent = parent
+        self.partitions = {}  # name -> Cache
+        self.lock = self.parent.lock if self.parent is not None else threading.RLock()
+
+        self.cache = OrderedDict()  # key -> value, ordered from least to most recently used
+        self.sizes = {}  # key -> size of cached value
+        self.size = 0  # sum of sizes of values in this cache
+        self.total_size = 0  # size of this cache and all its partitions
+
+        # statistics
+        self.stats = {name: 0 for name in self.STATS_COUNTERS}
 
         self.cache_size = 0
         self.cache_size_limit = 0  # when to trigger clean
-        self.set_cache_size(cache_size if cache_size else 100*(1024**2))
+        if self.parent is None:
+            cache_size = cache_size if cache_size else 100*(1024**2)
+        self.set_cache_size(cache_size, cache_size_limit)
 
     def set_cache_size(self, cache_size, cache_size_limit=None):
-        self.cache_size = cache_size
-        self.cache_size_limit = max(cache_size, cache_size_limit) if cache_size_limit else int(self.cache_size*1.5)
+        """
+        Partitions without cache size are limited only by cache size of parent.
+        """
+        with self.lock:
+            if cache_size is None and self.parent is not None:
+                self.cache_size = self.cache_size_limit = None
+            else:
+                self.cache_size = cache_size
+                self.cache_size_limit = max(cache_size, cache_size_limit) if cache_size_limit \
+                    else int(self.cache_size*1.5)
+            self.clean()
 
     def get_cache_size(self):
+        if self.cache_size is None:
+            return self.parent.get_cache_size()
         return self.cache_size, self.cache_size_limit
 
+    # partitions
+
+    def get_partition(self, name, cache_size=None, cache_size_limit=None):
+        with self.lock:
+            if name not in self.partitions:
+                self.partitions[name] = Cache(cache_size, cache_size_limit, name=name, parent=self)
+            return self.partitions[name]
+
+    def del_partition(self, name):
+        with self.lock:
+            if name in self.partitions:
+                self.partitions[name].clear()
+                del(self.partitions[name])
+
+    def _update_total_size(self, size_diff):
+        self.total_size += size_diff
+        if self.parent is not None:
+            self.parent._update_total_size(size_diff)
+
+    # statistics
+
+    def reset_stats(self):
+        """
+        Resets hit/miss/eviction counters. Size and number of entries are kept, since they describe current state.
+        """
+        with self.lock:
+            for name in self.STATS_COUNTERS:
+                self.stats[name] = 0
+            for partition in self.partitions.values():
+                partition.reset_stats()
+
+    def get_stats(self):
+        """
+        :return: {
+            'total': {'hits': int, 'misses': int, 'evictions': int, 'size': int, 'entries': int,
+                      'avg_entry_size': float, 'cache_size': int, 'cache_size_limit': int},
+            'groups': {partition_name: {'hits': int, ...}, ...}
+        }
+        """
+        with self.lock:
+            groups = {name: partition.get_stats()['total'] for name, partition in self.partitions.items()}
+
+            total = dict(self.stats, size=self.size, entries=len(self.cache))
+            for group_stats in groups.values():
+                for name in total:
+                    total[name] += group_stats[name]
+            total['avg_entry_size'] = (total['size'] / total['entries']) if total['entries'] else 0.0
+            total['cache_size'] = self.cache_size
+            total['cache_size_limit'] = self.cache_size_limit
+
+            return {'total': total, 'groups': groups}
+
+    # get/set/delete
+
     def to_cache(self, key, value):
-        # don't cache objects larger then min cache size
-        if sys.getsizeof(value) > self.cache_size:
-            return
-        # set cache value
-        self.cache[key] = value
-        # update access "time"
-        if key in self.access_list:
-            self.access_list.remove(key)
-        self.access_list.append(key)
-        # remove old items if over cache size limit
-        if sys.getsizeof(self.cache) > self.cache_size_limit:
-            while sys.getsizeof(self.cache) > self.cache_size and len(self.access_list) > 0:
-                self.del_cache(self.access_list[0])
+        size = get_deep_size(value)
+        with self.lock:
+            # don't cache objects larger then min cache size
+            if size > self.get_cache_size()[0]:
+                self.del_cache(key)
+                return
+
+            # set cache value and update access "time"
+            if key in self.cache:
+                self._remove(key)
+            self.cache[key] = value
+            self.sizes[key] = size
+            self.size += size
+            self._update_total_size(size)
+
+            # remove old items if over cache size limit of this cache or any of its parents
+            cache = self
+            while cache is not None:
+                if cache.cache_size is not None and cache.total_size > cache.cache_size_limit:
+                    cache.clean()
+                cache = cache.parent
 
     def from_cache(self, key):
-        if key in self.cache:
-            # update access "time"
-            if key in self.access_list:
-                self.access_list.remove(key)
-            self.access_list.append(key)
-            # return cache value
-            return self.cache[key]
-        else:
-            return None
+        with self.lock:
+            if key in self.cache:
+                self.stats['hits'] += 1
+                # update access "time"
+                self.cache.move_to_end(key)
+                # return cache value
+                return self.cache[key]
+            else:
+                self.stats['misses'] += 1
+                return None
 
     def del_cache(self, key):
-        if key in self.cache:
-            if key in self.access_list:
-                self.access_list.remove(key)
-            del(self.cache[key])
+        with self.lock:
+            if key in self.cache:
+                self._remove(key)
+
+    def del_cache_many(self, keys):
+        with self.lock:
+            for key in keys:
+                if key in self.cache:
+                    self._remove(key)
+
+    def _remove(self, key):
+        del(self.cache[key])
+        size = self.sizes.pop(key)
+        self.size -= size
+        self._update_total_size(-size)
+
+    def _evict(self):
+        """
+        Removes least recently used item of this cache or, if empty, of its largest partition.
+        :return: False if there was nothing to remove
+        """
+        if len(self.cache) > 0:
+            self.stats['evictions'] += 1
+            self._remove(next(iter(self.cache)))
+            return True
+
+        partitions = [p for p in self.partitions.values() if p.total_size > 0]
+        if len(partitions) == 0:
+            return False
+        return max(partitions, key=lambda p: p.total_size)._evict()
+
+    def clean(self):
+        # remove least recently used items until cache fits into cache size
+        if self.cache_size is None:
+            return
+        while self.total_size > self.cache_size:
+            if not self._evict():
+                break
 
     def clear(self):
-        self.cache = {}
-        self.access_list = []
+        with self.lock:
+            for partition in self.partitions.values():
+                partition.clear()
+            self._update_total_size(-self.size)
+            self.cache = OrderedDict()
+            self.sizes = {}
+            self.size = 0
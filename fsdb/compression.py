@@ -0,0 +1,169 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from .exceptions import FsdbError
+from .tools import iter_chunks, FILE_CHUNK_SIZE
+
+import json
+import gzip
+import lzma
+import zlib
+import base64
+import hashlib
+import logging
+import itertools
+
+_logger = logging.getLogger(__name__)
+
+# Files are compressed to gzip (zlib) or xz (lzma) format, so they can be streamed and served with Content-Encoding.
+# Values saved in data file of record are compressed JSON, saved as base64 string in dict with COMPRESSED_VALUE_KEY.
+# Dict values that contain COMPRESSED_VALUE_KEY are escaped, they are saved in such dict with compression None.
+COMPRESSION_ZLIB = 'zlib'
+COMPRESSION_LZMA = 'lzma'
+COMPRESSIONS = [COMPRESSION_ZLIB, COMPRESSION_LZMA]
+DEFAULT_COMPRESSION_THRESHOLD = 1024  # smaller data are not compressed
+COMPRESSED_VALUE_KEY = '__fsdb_compressed__'
+
+GZIP_MAGIC = b'\x1f\x8b'
+XZ_MAGIC = b'\xfd7zXZ\x00'
+
+
+def validate_compression(compression):
+    if compression not in COMPRESSIONS:
+        raise FsdbError('Invalid compression "{}", valid values are: {}'.format(compression, COMPRESSIONS))
+
+
+# values in data file
+
+def compress_value(value, compression, threshold=DEFAULT_COMPRESSION_THRESHOLD):
+    """
+    :param value: JSON compatible value
+    :return: value or its compressed version, if its JSON is at least threshold bytes long
+    """
+    if value is None:
+        return None
+    data = json.dumps(value, separators=(',', ':')).encode('utf-8')
+    if len(data) < threshold:
+        return escape_value(value)
+    if compression == COMPRESSION_ZLIB:
+        data = zlib.compress(data)
+    else:
+        data = lzma.compress(data)
+    return {COMPRESSED_VALUE_KEY: compression, 'data': base64.b64encode(data).decode('ascii')}
+
+
+def escape_value(value):
+    """
+    :return: value, dict that contains COMPRESSED_VALUE_KEY is wrapped, so that it isn't taken as compressed value
+    """
+    if isinstance(value, dict) and COMPRESSED_VALUE_KEY in value:
+        return {COMPRESSED_VALUE_KEY: None, 'data': value}
+    return value
+
+
+def decompress_value(value):
+    """
+    :return: original value of value returned by compress_value() or escape_value()
+    """
+    if not isinstance(value, dict) or COMPRESSED_VALUE_KEY not in value:
+        return value
+    if value[COMPRESSED_VALUE_KEY] is None:
+        return value['data']
+    data = base64.b64decode(value['data'])
+    if value[COMPRESSED_VALUE_KEY] == COMPRESSION_ZLIB:
+        data = zlib.decompress(data)
+    elif value[COMPRESSED_VALUE_KEY] == COMPRESSION_LZMA:
+        data = lzma.decompress(data)
+    else:
+        raise FsdbError('Invalid compression "{}" of value!'.format(value[COMPRESSED_VALUE_KEY]))
+    return json.loads(data)
+
+
+# files
+
+class CompressedData(object):
+    """
+    Iterable of chunks of file data, that are compressed if size of data reaches threshold. Attributes compressed
+    and size (of original data) are known after data are iterated.
+    """
+
+    def __init__(self, data, compression, threshold=DEFAULT_COMPRESSION_THRESHOLD):
+        """
+        :param data: any data accepted by tools.iter_chunks
+        """
+        self.data = data
+        self.compression = compression
+        self.threshold = threshold
+
+        self.compressed = None
+        self.size = None
+
+    def __iter__(self):
+        chunks = iter_chunks(self.data)
+
+        # read data up to threshold, to decide if they should be compressed
+        head = []
+        size = 0
+        for chunk in chunks:
+            head.append(chunk)
+            size += len(chunk)
+            if size >= self.threshold:
+                break
+        if size < self.threshold:
+            self.compressed, self.size = False, size
+            yield from head
+            return
+
+        if self.compression == COMPRESSION_ZLIB:
+            compressor = zlib.compressobj(wbits=31)  # gzip format
+        else:
+            compressor = lzma.LZMACompressor(format=lzma.FORMAT_XZ)
+        size = 0
+        for chunk in itertools.chain(head, chunks):
+            size += len(chunk)
+            chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+        yield compressor.flush()
+        self.compressed, self.size = True, size
+
+
+def open_file(path, compression=None):
+    """
+    :return: binary file object that reads original (decompressed) content of file
+    """
+    if compression is None:
+        return open(path, 'rb')
+    elif compression == COMPRESSION_ZLIB:
+        return gzip.open(path, 'rb')
+    elif compression == COMPRESSION_LZMA:
+        return lzma.open(path, 'rb', format=lzma.FORMAT_XZ)
+    raise FsdbError('Invalid compression "{}" of file!'.format(compression))
+
+
+def detect_file_compression(path):
+    """
+    :return: compression of file detected by magic bytes of gzip/xz format, or None
+    """
+    with open(path, 'rb') as f:
+        head = f.read(len(XZ_MAGIC))
+    if head.startswith(GZIP_MAGIC):
+        return COMPRESSION_ZLIB
+    elif head.startswith(XZ_MAGIC):
+        return COMPRESSION_LZMA
+    return None
+
+
+def file_content_digest(path, compression=None):
+    """
+    :return: (sha256 digest, size) of original content of file
+    """
+    h = hashlib.sha256()
+    size = 0
+    with open_file(path, compression) as f:
+        while True:
+            chunk = f.read(FILE_CHUNK_SIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+            size += len(chunk)
+    return h.digest(), size
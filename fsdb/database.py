@@ -1,24 +1,74 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 from .exceptions import FsdbError, FsdbObjectDeleted, FsdbDatabaseClosed, FsdbObjectNotFound
-from .tools import sanitize_filename
+from .tools import sanitize_filename, write_file, validate_durability, mark_deleted, mark_closed, DURABILITY_NONE
 from .table import Table
 from .cache import Cache
+from .serializers import validate_serializer, DEFAULT_SERIALIZER
+from .blob_store import BlobStore
 
 import os
 import json
 import copy
 import shutil
 import logging
+import threading
 
 _logger = logging.getLogger(__name__)
 
 
+class TableDict(dict):
+    """
+    Dict of database tables (name -> Table). Tables are only registered by name when database is opened, Table
+    object is created (fields, record ids and indexes are loaded) on first access.
+    """
+
+    def __init__(self, database):
+        super().__init__()
+        self.database = database
+        self.lock = threading.RLock()
+        self.closed = False  # set under lock, tables can't be loaded after database is closed
+
+    def register(self, name):
+        if name not in self:
+            super().__setitem__(name, None)
+
+    def is_loaded(self, name):
+        return super().get(name) is not None
+
+    def __getitem__(self, name):
+        table = super().__getitem__(name)
+        if table is None:
+            with self.lock:
+                table = super().__getitem__(name)
+                if table is None:
+                    if self.closed:
+                        raise FsdbDatabaseClosed()
+                    table = Table(name, self.database)
+                    super().__setitem__(name, table)
+        return table
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    def values(self):
+        return [self[name] for name in self]
+
+    def items(self):
+        return [(name, self[name]) for name in self]
+
+    def close(self):
+        """
+        Stops loading of tables. Waits for table that is being loaded (by warm-up thread), so that it's included in
+        loaded tables.
+        """
+        with self.lock:
+            self.closed = True
+
+
 class Database(object):
 
     data_fname = sanitize_filename('data.json')
-    _closed = False
-    _deleted = False
 
     def __init__(self, name, root_path):
         self.name = sanitize_filename(name)
@@ -27,23 +77,17 @@ class Database(object):
         self.db_path = os.path.join(self.root_path, self.name)
         self.data_path = os.path.join(self.db_path, self.data_fname)
 
-        self.tables = {}
+        self.tables = TableDict(self)
         self.cache = Cache()
+        self.durability = DURABILITY_NONE
+        self.serializer = DEFAULT_SERIALIZER
+        self.blob_store = None  # BlobStore, if files are deduplicated
+        self.blob_collector = None  # BlobStore of disabled blob store, blobs of deduplicated files are still collected
 
         if os.path.exists(self.data_path):
             self.load_data()
             self.load_tables()
 
-    def __getattribute__(self, name):
-        # check if database is deleted
-        if object.__getattribute__(self, '_deleted'):
-            raise FsdbObjectDeleted('Can\'t access deleted database objects!')
-        # check if database is closed
-        if object.__getattribute__(self, '_closed'):
-            raise FsdbDatabaseClosed
-        # return attribute
-        return object.__getattribute__(self, name)
-
     def save_data(self):
         cache_size, cache_size_limit = self.cache.get_cache_size()
 
@@ -52,11 +96,13 @@ class Database(object):
             'name': self.name,
             'cache_size': cache_size,
             'cache_size_limit': cache_size_limit,
+            'durability': self.durability,
+            'serializer': self.serializer,
+            'blob_store': self.blob_store is not None,
         })
 
         # write to file
-        with open(self.data_path, 'w') as f:
-            f.write(json.dumps(data, sort_keys=True, indent=2))
+        write_file(self.data_path, json.dumps(data, sort_keys=True, indent=2), self.durability)
 
     def load_data(self):
         # load from file
@@ -68,16 +114,144 @@ class Database(object):
         cache_size_limit = data.get('cache_size_limit')
         if cache_size:
             self.cache.set_cache_size(cache_size, cache_size_limit)
+        self.durability = data.get('durability', DURABILITY_NONE)
+        self.serializer = data.get('serializer', DEFAULT_SERIALIZER)
+        self.blob_store = BlobStore(self) if data.get('blob_store') else None
+        self.blob_collector = None
+        if self.blob_store is None and os.path.isdir(os.path.join(self.db_path, BlobStore.dir_name)):
+            self.blob_collector = BlobStore(self)
+
+    def set_durability(self, durability):
+        """
+        Sets durability of writes to database files, tables can override it.
+        :param durability: "none" (atomic replace of files), "fsync" (+ files are synced to disk) or
+            "fsync_dir" (+ directories are synced to disk)
+        """
+        validate_durability(durability)
+        self.durability = durability
+        self.save_data()
+
+    def set_serializer(self, serializer):
+        """
+        Sets format of record data files, tables can override it. Format of existing files is detected on read.
+        :param serializer: "json" (pretty JSON), "compact_json" or "binary"
+        """
+        validate_serializer(serializer)
+        self.serializer = serializer
+        self.save_data()
+
+    def set_blob_store(self, enabled=True):
+        """
+        Enables deduplication of files written to file/file_list fields, existing files are not changed. When disabled,
+        files that are already deduplicated stay hardlinks to blob store, their blobs are still released and collected.
+        """
+        if enabled and self.blob_store is None:
+            self.blob_store = self.blob_collector or BlobStore(self)
+            self.blob_collector = None
+        elif not enabled and self.blob_store is not None:
+            self.blob_collector = self.blob_store
+            self.blob_store = None
+        self.save_data()
+
+    def get_blob_store(self):
+        """
+        :return: BlobStore that releases and collects blobs, also if deduplication of new files is disabled, None if
+            database has no blobs
+        """
+        return self.blob_store if self.blob_store is not None else self.blob_collector
+
+    def gc_blobs(self, limit=None):
+        """
+        Removes unreferenced blobs, see BlobStore.gc()
+        :return: number of removed blobs
+        """
+        blob_store = self.get_blob_store()
+        if blob_store is None:
+            return 0
+        return blob_store.gc(limit)
 
     def load_tables(self):
-        self.tables = {}
-        for name in os.listdir(self.db_path):
-            table_path = os.path.join(self.db_path, name)
-            if not os.path.isdir(table_path):
-                continue
-            self.tables[name] = Table(name, self)
+        """
+        Registers names of tables, tables are loaded on first access. Hidden directories (blob store) are skipped.
+        """
+        self.tables = TableDict(self)
+        with os.scandir(self.db_path) as entries:
+            for entry in entries:
+                if entry.is_dir() and not entry.name.startswith('.'):
+                    self.tables.register(entry.name)
         return self.tables
 
+    def warm_up(self, table_names=None):
+        """
+        Loads tables in background thread.
+        :param table_names: names of tables to load, None for all tables
+        :return: started thread
+        """
+        table_names = list(self.tables.keys()) if table_names is None else list(table_names)
+        thread = threading.Thread(target=self._warm_up, args=(table_names, ), daemon=True,
+                                  name='fsdb-warm-up-{}'.format(self.name))
+        thread.start()
+        return thread
+
+    def _warm_up(self, table_names):
+        for name in table_names:
+            try:
+                self.tables.get(name)
+            except (FsdbDatabaseClosed, FsdbObjectDeleted):
+                return
+            except Exception:
+                _logger.exception('Warm-up of table "{}" in database "{}" failed!'.format(name, self.name))
+
+    def delete_table(self, name):
+        """
+        Deletes table. Table that is not loaded is deleted without loading its record ids and indexes. Blobs that were
+        used only by files of deleted table are removed.
+        """
+        with self.tables.lock:  # table can't be loaded by warm-up thread meanwhile
+            if self.tables.is_loaded(name):
+                table = self.tables[name]
+                has_files = any(field.type in ['file', 'file_list'] for field in table.fields.values())
+                table.delete()
+            else:
+                _logger.info('DELETE TABLE "{}"'.format(name))
+                has_files = True  # fields of table are not known
+                self.tables.pop(name, None)
+                self.cache.del_partition(name)
+                table_path = os.path.join(self.db_path, sanitize_filename(name))
+                if os.path.exists(table_path):
+                    shutil.rmtree(table_path)
+
+        # references of blobs were removed with record files, digests are not collected from all data files of table
+        if has_files:
+            self.gc_blobs()
+
+    def get_loaded_tables(self):
+        return [self.tables[name] for name in self.tables if self.tables.is_loaded(name)]
+
+    def flush(self):
+        """
+        Writes changes buffered by tables in write-behind mode.
+        :return: number of written records
+        """
+        return sum(table.flush() for table in self.get_loaded_tables())
+
+    # cache
+
+    def get_cache_stats(self):
+        """
+        :return: {
+            'total': {'hits': int, 'misses': int, 'evictions': int, 'size': int, 'entries': int,
+                      'avg_entry_size': float, 'cache_size': int, 'cache_size_limit': int},
+            'tables': {table_name: {'hits': int, 'misses': int, 'evictions': int, 'size': int, 'entries': int,
+                                    'avg_entry_size': float}, ...}
+        }
+        """
+        stats = self.cache.get_stats()
+        return {'total': stats['total'], 'tables': stats['groups']}
+
+    def reset_cache_stats(self):
+        self.cache.reset_stats()
+
     # create/delete/open/close
 
     @classmethod
@@ -108,16 +282,26 @@ class Database(object):
 
     def delete(self):
         _logger.info('DELETE DATABASE "{}"'.format(self.name))
-        # delete cached records
+        self.tables.close()
+        # delete cached and buffered records
         self.cache.clear()
+        tables = self.get_loaded_tables()
+        for table in tables:
+            if table.write_buffer is not None:
+                table.write_buffer.clear()
         # delete data
         if os.path.exists(self.db_path):
             shutil.rmtree(self.db_path)
-        # mark object as deleted
-        self._deleted = True
+        # mark database and all its objects as deleted
+        for table in tables:
+            table.invalidate(mark_deleted)
+        mark_deleted(self)
 
     @classmethod
-    def open(cls, root_path, name):
+    def open(cls, root_path, name, warm_up=None):
+        """
+        :param warm_up: list of names of tables that should be loaded in background, True for all tables
+        """
         _logger.info('OPEN DATABASE "{}"'.format(name))
 
         # test if DB exists
@@ -126,10 +310,16 @@ class Database(object):
 
         # open db
         obj = cls(name, root_path)
-        obj._closed = False
+        if warm_up:
+            obj.warm_up(None if warm_up is True else warm_up)
 
         return obj
 
     def close(self):
         _logger.info('CLOSE DATABASE "{}"'.format(self.name))
-        self._closed = True
+        self.tables.close()
+        self.flush()
+        # mark database and all its objects as closed
+        for table in self.get_loaded_tables():
+            table.close()
+        mark_closed(self)
@@ -1,10 +1,14 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
-from .exceptions import FsdbError, FsdbDatabaseClosed
-from .tools import sanitize_filename, guess_mimetype
+from .exceptions import FsdbError
+from .tools import sanitize_filename, guess_mimetype, is_file_data, write_file, file_digest, get_tmp_path, \
+    is_tmp_filename, HashedData
+from .file_handle import FileHandle
+from .compression import validate_compression, compress_value, decompress_value, escape_value, CompressedData, \
+    detect_file_compression, file_content_digest, DEFAULT_COMPRESSION_THRESHOLD
 
 import os
-import shutil
+import hashlib
 import datetime
 import logging
 
@@ -26,13 +30,24 @@ class Field(object):
     # format used to save and load datetime fields from/to json
     DATETIME_FORMAT = '%Y-%m-%dT%H-%M-%S.%f'  # MUST BE filename compatible!!!!! (Could be used as folder name)
 
-    def __init__(self, name, type, table, default=None, required=False, unique=False):
+    # field types that can be indexed or unique
+    INDEX_TYPES = ['bool', 'str', 'int', 'float', 'datetime']
+
+    # field types that can be compressed
+    COMPRESSION_TYPES = ['str', 'list', 'tuple', 'dict', 'file', 'file_list']
+
+    def __init__(self, name, type, table, default=None, required=False, unique=False, index=False, compression=None,
+                 compression_threshold=DEFAULT_COMPRESSION_THRESHOLD, verify_files=False):
         # field data
         self.name = name.strip().lower()
         self.type = type.strip().lower()
         self.default = default
-        self.required = required  # TODO: implement
-        self.unique = unique  # TODO: implement
+        self.required = required
+        self.unique = unique
+        self.index = index
+        self.compression = compression  # None, "zlib" or "lzma"
+        self.compression_threshold = compression_threshold  # smaller values/files (in bytes) aren't compressed
+        self.verify_files = verify_files  # file_list files modified in place are detected on read
 
         # run variables
         self.table = table
@@ -41,14 +56,6 @@ class Field(object):
         # validate
         self.validate()
 
-    def __getattribute__(self, name):
-        # check if database is closed
-        database = object.__getattribute__(self, 'database')
-        if database and object.__getattribute__(database, '_closed'):
-            raise FsdbDatabaseClosed
-        # return attribute
-        return object.__getattribute__(self, name)
-
     def to_dict(self):
         data = {
             'name': self.name,
@@ -60,6 +67,13 @@ class Field(object):
             data['required'] = self.required
         if self.unique:
             data['unique'] = self.unique
+        if self.index:
+            data['index'] = self.index
+        if self.compression:
+            data['compression'] = self.compression
+            data['compression_threshold'] = self.compression_threshold
+        if self.verify_files:
+            data['verify_files'] = self.verify_files
         return data
 
     @classmethod
@@ -68,11 +82,27 @@ class Field(object):
         obj.default = data.get('default')
         obj.required = data.get('required', False)
         obj.unique = data.get('unique', False)
+        obj.index = data.get('index', False)
+        obj.compression = data.get('compression')
+        obj.compression_threshold = data.get('compression_threshold', DEFAULT_COMPRESSION_THRESHOLD)
+        obj.verify_files = data.get('verify_files', False)
+        obj.validate()
         return obj
 
     def validate(self):
         if self.type not in self.FIELD_TYPES:
             raise FsdbError('Field "{}" of table "{}" has invalid type "{}"!'.format(self.name, self.table.name, self.type))
+        if self.index and self.type not in self.INDEX_TYPES:
+            raise FsdbError('Field "{}" of table "{}" with type "{}" can\'t be indexed!'.format(
+                self.name, self.table.name, self.type))
+        if self.compression:
+            validate_compression(self.compression)
+            if self.type not in self.COMPRESSION_TYPES:
+                raise FsdbError('Field "{}" of table "{}" with type "{}" can\'t be compressed!'.format(
+                    self.name, self.table.name, self.type))
+        if self.verify_files and self.type != 'file_list':
+            raise FsdbError('Field "{}" of table "{}" with type "{}" can\'t verify files!'.format(
+                self.name, self.table.name, self.type))
 
     # read/write
 
@@ -83,59 +113,46 @@ class Field(object):
         :return: value
         """
         if self.type == 'file':
-            filename = data_values.get(self.name)
-            if filename is None:
+            metadata = data_values.get(self.name)
+            if metadata is None:
                 data_values[self.name] = None
                 return None
-
-            # get file path
-            file_path = os.path.join(record.record_path, data_values[self.name])
-            if not os.path.exists(file_path):
+            if not isinstance(metadata, dict):
+                metadata = {'name': metadata}  # written by older version, without metadata
+
+            # get file path, metadata are read again only if file was changed outside of database
+            file_path = os.path.join(record.record_path, metadata['name'])
+            try:
+                st = os.stat(file_path)
+            except FileNotFoundError:
                 data_values[self.name] = None
                 return None
+            if not self.is_file_metadata_current(metadata, st):
+                metadata = self.scan_file_metadata(file_path, st, metadata)
 
-            # get size
-            size = os.path.getsize(file_path)
-
-            # get mime
-            mime = guess_mimetype(file_path)
-
-            return {'name': filename, 'data': None, 'path': file_path, 'mime': mime, 'size': size, }
+            return self.get_file_value(file_path, metadata)
 
         elif self.type == 'file_list':
             # get file dir path
             file_dir_path = os.path.join(record.record_path, self.name)
-            if not os.path.exists(file_dir_path):
-                return []
-
-            # read files
-            file_list = []
-            for filename in os.listdir(file_dir_path):
-                # get file path
-                file_path = os.path.join(file_dir_path, filename)
-                if not os.path.isfile(file_path):
-                    continue
-
-                # get size
-                size = os.path.getsize(file_path)
 
-                # get mime
-                mime = guess_mimetype(file_path)
-
-                # save file data
-                file_list.append({
-                    'name': filename, 'data': None, 'path': file_path, 'mime': mime, 'size': size, })
-
-            return file_list
+            # read files (saved metadata are used if directory wasn't changed outside of database)
+            files = self.load_file_list_metadata(file_dir_path, data_values.get(self.name))
+            if files is None:
+                return []
+            return [self.get_file_value(os.path.join(file_dir_path, name), files[name]) for name in sorted(files)]
 
         elif self.type == 'datetime':
             value = data_values.get(self.name)
             return self.str2val(value) if value is not None else None
 
         elif self.type == 'tuple':
-            value = data_values.get(self.name)
+            value = decompress_value(data_values.get(self.name))
             return tuple(value) if value is not None else None
 
+        elif self.type in self.COMPRESSION_TYPES:
+            return decompress_value(data_values.get(self.name))
+
         else:
             return data_values.get(self.name)
 
@@ -147,22 +164,24 @@ class Field(object):
         :return:
         """
         if self.type == 'file':
-            # remove old file
-            if data_values.get(self.name) is not None:
-                old_file_path = os.path.join(record.record_path, data_values[self.name])
-                if os.path.exists(old_file_path):
-                    os.remove(old_file_path)
+            old_metadata = data_values.get(self.name)
+            old_file_path = None
+            if old_metadata is not None:
+                old_file_path = os.path.join(record.record_path, self.get_filename(old_metadata))
 
-            # return if new value is None
+            # remove old file and return if new value is None
             if value is None:
+                if old_file_path is not None and os.path.exists(old_file_path):
+                    os.remove(old_file_path)
+                    self.release_blobs(self.get_blob_digests(old_metadata))
                 data_values[self.name] = value
                 return
 
             # validate new value
             if not isinstance(value, dict) or not value.get('name') or value.get('data') is None:
                 raise FsdbError('Invalid file field value!')
-            if not isinstance(value['data'], bytes):
-                raise FsdbError('File data must be bytes type!')
+            if not is_file_data(value['data']):
+                raise FsdbError('File data must be bytes, binary file-like object or iterable of bytes chunks!')
             if value['name'] in ['data.json', ] + list(record.fields.keys()):
                 raise FsdbError('Filename is reserved name!')
             if value['name'] != sanitize_filename(value['name']):
@@ -170,54 +189,412 @@ class Field(object):
             for name in record.fields:
                 if self.name == name:
                     continue
-                if record.fields[name].type == 'file' and data_values.get(name) == value['name']:
+                if record.fields[name].type == 'file' and self.get_filename(data_values.get(name)) == value['name']:
                     raise FsdbError('Filename is in conflict with value of field "{}"!'.format(name))
 
-            # save new file
+            # save new file, old file is removed only after new file is written (data can be streamed from source
+            # that fails)
             file_path = os.path.join(record.record_path, value['name'])
-            with open(file_path, 'wb') as f:
-                f.write(value['data'])
-            data_values[self.name] = value['name']
+            data_values[self.name] = self.write_file_data(file_path, value['data'])
+            if old_file_path is not None and old_file_path != file_path and os.path.exists(old_file_path):
+                os.remove(old_file_path)
+            self.release_blobs(self.get_blob_digests(old_metadata))
 
         elif self.type == 'file_list':
-            file_list = value if isinstance(value, list) else []
-            data_values[self.name] = None
-
-            # get file dir path
             file_dir_path = os.path.join(record.record_path, self.name)
+            files = self.load_file_list_metadata(file_dir_path, data_values.get(self.name)) or {}
+            old_filenames = set(files)
 
-            # remove old values
-            if os.path.exists(file_dir_path):
-                shutil.rmtree(file_dir_path)
-            os.makedirs(file_dir_path)
-
-            # validate new value
-            processed_filenames = []
-            for file in file_list:
-                if not isinstance(file, dict) or not file.get('name') or not file.get('data'):
-                    raise FsdbError('Invalid file field value!')
-                if not isinstance(file['data'], bytes):
-                    raise FsdbError('File data must be bytes type!')
-                if file['name'] != sanitize_filename(file['name']):
-                    raise FsdbError('Filename is not equal to sanitized filename!')
-                if file['name'] in processed_filenames:
-                    raise FsdbError('Conflicting filename values in file_list field!')
-                processed_filenames.append(file['name'])
+            # get changes (filename -> new data or None for removed file, and list of renames)
+            if isinstance(value, list) and any(isinstance(item, tuple) for item in value):
+                writes, renames = self.parse_file_list_commands(value, old_filenames)
+            else:
+                writes, renames = self.parse_file_list(value, old_filenames)
 
-            # write files
-            for file in file_list:
-                file_path = os.path.join(file_dir_path, file['name'])
-                with open(file_path, 'wb') as f:
-                    f.write(file['data'])
+            # apply changes, files with unchanged content are not written
+            if not os.path.exists(file_dir_path):
+                os.makedirs(file_dir_path)
+            self.rename_files(file_dir_path, renames)
+            renamed = {new_name: files.pop(old_name) for old_name, new_name in renames}
+            released = [files.pop(new_name) for new_name in renamed if new_name in files]  # + removed and replaced
+            for new_name, metadata in renamed.items():
+                files[new_name] = dict(metadata, name=new_name, mime=guess_mimetype(new_name))
+            for filename, data in writes.items():
+                file_path = os.path.join(file_dir_path, filename)
+                if data is None:
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
+                    if filename in files:
+                        released.append(files.pop(filename))
+                elif filename not in files or not self.is_file_unchanged(file_path, data, files[filename]):
+                    if filename in files:
+                        released.append(files[filename])
+                    files[filename] = self.write_file_data(file_path, data)
+            self.release_blobs(self.get_blob_digests({'files': released}))
+
+            # save metadata together with mtime of directory, that is changed by any later change of list of files
+            data_values[self.name] = {
+                'mtime': os.stat(file_dir_path).st_mtime_ns,
+                'files': [files[name] for name in sorted(files)],
+            }
 
         elif self.type == 'datetime':
             data_values[self.name] = self.val2str(value) if value is not None else None
 
         elif self.type == 'tuple':
-            data_values[self.name] = list(value) if value is not None else None
+            data_values[self.name] = self.compress_value(list(value) if value is not None else None)
+
+        else:
+            data_values[self.name] = self.compress_value(value)
+
+    def compress_value(self, value):
+        """
+        :return: value or its compressed version, if field is compressed and value is large enough
+        """
+        if not self.compression:
+            return escape_value(value) if self.type in self.COMPRESSION_TYPES else value
+        return compress_value(value, self.compression, self.compression_threshold)
+
+    # file data
+
+    def write_file_data(self, file_path, data):
+        """
+        Writes file of file/file_list field, through blob store if database has it.
+        :return: metadata of written file, with sha256 hex digest of original content
+        """
+        # hash of original content, digest of blob is the same if file isn't compressed
+        sha256 = hashed_data = None
+        if self.database.blob_store is None or self.compression:
+            if isinstance(data, (bytes, bytearray, memoryview)):
+                sha256 = hashlib.sha256(data).hexdigest()
+            else:
+                data = hashed_data = HashedData(data)
+        if self.compression:
+            data = CompressedData(data, self.compression, self.compression_threshold)
+
+        if self.database.blob_store is None:
+            write_file(file_path, data, self.table.get_durability())
+            metadata = self.get_file_metadata(file_path)
+        else:
+            digest = self.database.blob_store.write(file_path, data, self.table.get_durability())
+            metadata = dict(self.get_file_metadata(file_path), blob=digest)
+        if sha256 is None:
+            sha256 = hashed_data.hexdigest() if hashed_data is not None else metadata['blob']
+        metadata['sha256'] = sha256
+
+        if self.compression and data.compressed:
+            metadata.update(size=data.size, stored_size=metadata['size'], compression=self.compression)
+        return metadata
+
+    def get_blob_digests(self, data_value):
+        """
+        :param data_value: value of file or file_list field in data file
+        :return: digests of blobs that files of value are linked to
+        """
+        if self.type == 'file':
+            metadata_list = [data_value]
+        elif self.type == 'file_list':
+            metadata_list = data_value['files'] if isinstance(data_value, dict) else []
+        else:
+            return []
+        return [metadata['blob'] for metadata in metadata_list if isinstance(metadata, dict) and metadata.get('blob')]
+
+    def release_blobs(self, digests):
+        """
+        Removes blobs that are no longer referenced, must be called after files linked to them are removed.
+        """
+        blob_store = self.database.get_blob_store()
+        if digests and blob_store is not None:
+            blob_store.release(digests)
 
+    # file metadata
+
+    @staticmethod
+    def get_filename(data_value):
+        """
+        :param data_value: value of file field in data file, metadata dict or just filename (older versions)
+        """
+        return data_value['name'] if isinstance(data_value, dict) else data_value
+
+    @staticmethod
+    def get_file_metadata(file_path, st=None):
+        """
+        :param st: os.stat_result of file, if already known
+        :return: metadata of file that are saved in data file of record
+        """
+        st = st if st is not None else os.stat(file_path)
+        return {
+            'name': os.path.basename(file_path),
+            'size': st.st_size,
+            'mime': guess_mimetype(file_path),
+            'mtime': st.st_mtime_ns,
+        }
+
+    @staticmethod
+    def is_file_metadata_current(metadata, st):
+        """
+        :param st: os.stat_result of file
+        :return: True if file wasn't changed since metadata were saved
+        """
+        stored_size = metadata.get('stored_size', metadata.get('size'))
+        return st.st_mtime_ns == metadata.get('mtime') and st.st_size == stored_size
+
+    def scan_file_metadata(self, file_path, st=None, saved_metadata=None):
+        """
+        Gets metadata of file that was changed outside of database (or written by older version). Compression is
+        kept from saved metadata of file, so that raw .gz/.xz file stored below threshold isn't taken as compressed,
+        and it's detected only for new files of compressed fields.
+        :param saved_metadata: metadata of file with the same name saved in data file, if any
+        """
+        metadata = self.get_file_metadata(file_path, st)
+        if saved_metadata is not None and 'mtime' in saved_metadata:  # older versions saved only filename
+            compression = saved_metadata.get('compression')
+        else:
+            compression = detect_file_compression(file_path) if self.compression else None
+        if compression is not None:
+            _, size = file_content_digest(file_path, compression)
+            metadata.update(size=size, stored_size=metadata['size'], compression=compression)
+        return metadata
+
+    @staticmethod
+    def get_file_value(file_path, metadata):
+        """
+        :return: value of file returned by read(), size is size of original content of compressed files. Path of
+            compressed file is None (its content must be read with FileHandle), stored_path is path of stored file.
+        """
+        compression = metadata.get('compression')
+        return {'name': metadata['name'], 'data': None, 'path': file_path if compression is None else None,
+                'stored_path': file_path, 'mime': metadata['mime'], 'size': metadata['size'],
+                'compression': compression, }
+
+    def load_file_list_metadata(self, file_dir_path, data_value):
+        """
+        Saved metadata are used without listing directory or stat of files if mtime of directory wasn't changed since
+        they were saved. Files modified in place don't change mtime of directory, so their stale metadata are returned,
+        unless field has verify_files, which checks mtime and size of every file (one stat per file on every read).
+        :param data_value: value of file_list field in data file, {'mtime': directory mtime, 'files': [metadata]}
+        :return: dict filename -> metadata, None if directory doesn't exist
+        """
+        try:
+            dir_mtime = os.stat(file_dir_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+        # saved list of files is valid if directory wasn't changed since it was saved
+        if isinstance(data_value, dict) and data_value.get('mtime') == dir_mtime:
+            if not self.verify_files:
+                return {metadata['name']: metadata for metadata in data_value['files']}
+            try:
+                files = {}
+                for metadata in data_value['files']:
+                    file_path = os.path.join(file_dir_path, metadata['name'])
+                    st = os.stat(file_path)
+                    if not self.is_file_metadata_current(metadata, st):
+                        metadata = self.scan_file_metadata(file_path, st, metadata)
+                    files[metadata['name']] = metadata
+                return files
+            except FileNotFoundError:
+                pass  # directory was changed in the same mtime tick, it's scanned
+
+        # scan directory (files changed outside of database or written by older version), temporary files of
+        # unfinished writes and renames are skipped, saved metadata of unchanged files are kept
+        saved_files = {metadata['name']: metadata for metadata in data_value['files']} \
+            if isinstance(data_value, dict) else {}
+        files = {}
+        with os.scandir(file_dir_path) as entries:
+            for entry in entries:
+                if entry.is_file() and not is_tmp_filename(entry.name):
+                    st = entry.stat()
+                    metadata = saved_files.get(entry.name)
+                    if metadata is None or not self.is_file_metadata_current(metadata, st):
+                        metadata = self.scan_file_metadata(entry.path, st, metadata)
+                    files[entry.name] = metadata
+        return files
+
+    def has_stream_data(self, value):
+        """
+        :param value: value of file or file_list field that is going to be written
+        :return: True if value contains file data that can be read only once (file-like object, iterator, FileHandle)
+        """
+        if self.type == 'file':
+            files = [value]
+        elif self.type == 'file_list' and isinstance(value, list):
+            files = [item[1] if isinstance(item, tuple) and len(item) == 2 else item for item in value]
+        else:
+            return False
+        return any(isinstance(file, dict) and file.get('data') is not None and
+                   not isinstance(file['data'], (bytes, bytearray, memoryview, list, tuple)) for file in files)
+
+    # file_list
+
+    @staticmethod
+    def validate_file(file):
+        if not isinstance(file, dict) or not file.get('name') or not file.get('data'):
+            raise FsdbError('Invalid file field value!')
+        if not is_file_data(file['data']):
+            raise FsdbError('File data must be bytes, binary file-like object or iterable of bytes chunks!')
+        if file['name'] != sanitize_filename(file['name']):
+            raise FsdbError('Filename is not equal to sanitized filename!')
+
+    def parse_file_list(self, value, old_filenames):
+        """
+        Full write of file_list value, list of files or None. Files that are not in value are removed.
+        :return: (writes, renames)
+        """
+        file_list = value if isinstance(value, list) else []
+        writes = {}
+        for file in file_list:
+            self.validate_file(file)
+            if file['name'] in writes:
+                raise FsdbError('Conflicting filename values in file_list field!')
+            writes[file['name']] = file['data']
+        for filename in old_filenames - set(writes):
+            writes[filename] = None
+        return writes, []
+
+    def parse_file_list_commands(self, value, old_filenames):
+        """
+        Incremental write of file_list value, list of commands that are applied in order:
+            ('add', file) - adds new file
+            ('replace', file) - replaces content of existing file
+            ('remove', filename) - removes file
+            ('rename', filename, new_filename) - renames file
+        All commands are validated before any file is changed.
+        :return: (writes, renames), renames are applied before writes
+        """
+        filenames = set(old_filenames)
+        sources = {name: name for name in old_filenames}  # current filename -> old filename, for renames
+        writes = {}
+        for command in value:
+            if not isinstance(command, tuple) or len(command) == 0:
+                raise FsdbError('Invalid file_list command {}!'.format(command))
+
+            if command[0] in ('add', 'replace') and len(command) == 2:
+                file = command[1]
+                self.validate_file(file)
+                if command[0] == 'add' and file['name'] in filenames:
+                    raise FsdbError('File "{}" already exists in file_list field!'.format(file['name']))
+                if command[0] == 'replace' and file['name'] not in filenames:
+                    raise FsdbError('File "{}" does not exist in file_list field!'.format(file['name']))
+                filenames.add(file['name'])
+                writes[file['name']] = file['data']
+
+            elif command[0] == 'remove' and len(command) == 2:
+                if command[1] not in filenames:
+                    raise FsdbError('File "{}" does not exist in file_list field!'.format(command[1]))
+                filenames.remove(command[1])
+                sources.pop(command[1], None)
+                writes[command[1]] = None
+
+            elif command[0] == 'rename' and len(command) == 3:
+                old_name, new_name = command[1], command[2]
+                if old_name not in filenames:
+                    raise FsdbError('File "{}" does not exist in file_list field!'.format(old_name))
+                if not new_name or new_name != sanitize_filename(new_name):
+                    raise FsdbError('Filename is not equal to sanitized filename!')
+                if new_name in filenames:
+                    raise FsdbError('File "{}" already exists in file_list field!'.format(new_name))
+                filenames.remove(old_name)
+                filenames.add(new_name)
+                if old_name in writes:
+                    # file written by previous command, just write it with new name
+                    writes[new_name] = writes.pop(old_name)
+                else:
+                    sources[new_name] = sources.pop(old_name)
+                writes.setdefault(old_name, None)
+
+            else:
+                raise FsdbError('Invalid file_list command {}!'.format(command))
+
+        # files that exist after all commands must not be removed (e.g. rename destinations, files renamed back)
+        for name in list(writes.keys()):
+            if writes[name] is None and name in filenames:
+                del(writes[name])
+        renames = [(old_name, name) for name, old_name in sources.items() if name != old_name]
+        return writes, renames
+
+    @staticmethod
+    def rename_files(file_dir_path, renames):
+        """
+        :param renames: list of (old filename, new filename), files are renamed through temporary names, so that
+            they can be swapped
+        """
+        tmp_paths = [get_tmp_path(os.path.join(file_dir_path, old_name), 'rename') for old_name, _ in renames]
+        for (old_name, _), tmp_path in zip(renames, tmp_paths):
+            os.rename(os.path.join(file_dir_path, old_name), tmp_path)
+        for (_, new_name), tmp_path in zip(renames, tmp_paths):
+            os.rename(tmp_path, os.path.join(file_dir_path, new_name))
+
+    @staticmethod
+    def is_file_unchanged(file_path, data, metadata):
+        """
+        Compares original content of file with new data by size and sha256 hash. Only bytes-like data and FileHandle
+        can be compared without being consumed, other data are always considered to be changed. Hash saved in
+        metadata is used if file wasn't modified since it was written.
+        :param metadata: metadata of file
+        """
+        if not os.path.isfile(file_path):
+            return False
+        st = os.stat(file_path)
+        if isinstance(data, FileHandle):
+            if os.path.abspath(data.path) == os.path.abspath(file_path):
+                return True
+            if data.size is not None and data.size != metadata['size']:
+                return False
+            if data.compression is None:
+                new_digest = file_digest(data.path)
+            else:
+                new_digest, _ = file_content_digest(data.path, data.compression)
+        elif isinstance(data, (bytes, bytearray, memoryview)):
+            if memoryview(data).nbytes != metadata['size']:
+                return False
+            new_digest = hashlib.sha256(data).digest()
         else:
-            data_values[self.name] = value
+            return False
+        if metadata.get('sha256') and st.st_mtime_ns == metadata.get('mtime') and \
+                st.st_size == metadata.get('stored_size', metadata['size']):
+            return metadata['sha256'] == new_digest.hex()
+        digest, size = file_content_digest(file_path, metadata.get('compression'))
+        if size != metadata['size'] or digest != new_digest:
+            return False
+        metadata['sha256'] = digest.hex()  # e.g. metadata of scanned file, next comparison doesn't read file
+        return True
+
+    def add_file_handles(self, value):
+        """
+        :param value: value of file or file_list field returned by read()
+        :return: copy of value, with FileHandle of every file in "handle" key
+        """
+        if self.type == 'file':
+            return self._add_file_handle(value) if value is not None else None
+        elif self.type == 'file_list':
+            return [self._add_file_handle(file) for file in value]
+        return value
+
+    @staticmethod
+    def _add_file_handle(file):
+        return dict(file, handle=FileHandle(file['stored_path'], file['name'], file['mime'], file['size'],
+                                            file.get('compression')))
+
+    # to json / from json (simple values in format used in data.json)
+
+    def val2json(self, val):
+        if val is None:
+            return None
+        elif self.type == 'datetime':
+            return self.val2str(val)
+        elif self.type == 'tuple':
+            return list(val)
+        return val
+
+    def json2val(self, val):
+        if val is None:
+            return None
+        elif self.type == 'datetime':
+            return self.str2val(val)
+        elif self.type == 'tuple':
+            return tuple(val)
+        return val
 
     # to string / from string
 
@@ -0,0 +1,162 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from .tools import FILE_CHUNK_SIZE
+from .compression import open_file
+
+import os
+import mmap
+import errno
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class FileHandle(object):
+    """
+    Lazy read-only access to file of file/file_list field. File is opened on first use, so creating handles is cheap.
+    Open handle keeps reading the content it was opened with, even if record file is replaced by write.
+
+    Handle can be used as data of file field, to copy file between records without loading it into memory.
+
+    Content of compressed files is decompressed by read(), seek() and iter_chunks(), while fileno(), memoryview() and
+    sendfile() give stored gzip/xz data (e.g. to be served with Content-Encoding: gzip).
+    """
+
+    def __init__(self, path, name=None, mime=None, size=None, compression=None):
+        """
+        :param size: size of original content
+        :param compression: compression of stored file, None if it's not compressed
+        """
+        self.path = path
+        self.name = name if name is not None else os.path.basename(path)
+        self.mime = mime
+        self.size = size
+        self.compression = compression
+
+        self.file = None
+        self.raw_file = None
+        self.mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __iter__(self):
+        return self.iter_chunks()
+
+    def __repr__(self):
+        return '<FileHandle {}>'.format(self.path)
+
+    def open(self):
+        """
+        :return: file object with original content of file
+        """
+        if self.file is None:
+            self.file = open_file(self.path, self.compression)
+        return self.file
+
+    def open_raw(self):
+        """
+        :return: file object with stored content of file
+        """
+        if self.compression is None:
+            return self.open()
+        if self.raw_file is None:
+            self.raw_file = open(self.path, 'rb')
+        return self.raw_file
+
+    def close(self):
+        if self.mmap is not None:
+            try:
+                self.mmap.close()
+            except BufferError:
+                # memoryview returned by memoryview() is still used, mmap will be closed when it's released
+                _logger.debug('Memory map of "{}" is still exported, not closing.'.format(self.path))
+            self.mmap = None
+        for f in (self.file, self.raw_file):
+            if f is not None:
+                f.close()
+        self.file = self.raw_file = None
+
+    # file-like interface
+
+    def fileno(self):
+        """
+        :return: file descriptor, for use with os.sendfile, socket.sendfile, select etc.
+        """
+        return self.open_raw().fileno()
+
+    def read(self, size=-1):
+        return self.open().read(size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.open().seek(offset, whence)
+
+    def tell(self):
+        return self.open().tell()
+
+    # zero-copy access
+
+    def iter_chunks(self, chunk_size=FILE_CHUNK_SIZE):
+        """
+        Yields content of file in chunks, from start of file.
+        """
+        f = self.open()
+        f.seek(0)
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def memoryview(self):
+        """
+        :return: read-only memoryview of whole file, backed by mmap (pages are loaded by OS on access)
+        """
+        if self.mmap is None:
+            if os.fstat(self.fileno()).st_size == 0:
+                return memoryview(b'')  # empty files can't be mapped
+            self.mmap = mmap.mmap(self.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self.mmap)
+
+    def sendfile(self, out, offset=0, count=None):
+        """
+        Copies file content to socket or file, in kernel if os.sendfile is available.
+        :param out: file descriptor or object with fileno()
+        :param offset: position in file
+        :param count: max number of bytes, None for rest of file
+        :return: number of sent bytes
+        """
+        out_fd = out if isinstance(out, int) else out.fileno()
+        in_fd = self.fileno()
+        if count is None:
+            count = max(os.fstat(in_fd).st_size - offset, 0)
+
+        sent = 0
+        if hasattr(os, 'sendfile'):
+            try:
+                while sent < count:
+                    n = os.sendfile(out_fd, in_fd, offset + sent, count - sent)
+                    if n == 0:
+                        break
+                    sent += n
+                return sent
+            except OSError as e:
+                if sent > 0 or e.errno not in (errno.EINVAL, errno.ENOTSOCK, errno.ENOSYS):
+                    raise
+                # output doesn't support sendfile (e.g. non-socket on macOS), fallback to copy
+
+        f = self.open_raw()
+        f.seek(offset)
+        while sent < count:
+            chunk = f.read(min(FILE_CHUNK_SIZE, count - sent))
+            if not chunk:
+                break
+            view = memoryview(chunk)
+            while view:
+                n = os.write(out_fd, view)
+                view = view[n:]
+                sent += n
+        return sent
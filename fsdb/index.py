@@ -0,0 +1,366 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from .exceptions import FsdbError
+from .tools import sanitize_filename, write_file, append_file
+
+import os
+import abc
+import json
+import bisect
+import logging
+import datetime
+
+_logger = logging.getLogger(__name__)
+
+
+class BaseIndex(abc.ABC):
+    """
+    Index of values of one table field. Saved as json file in table folder, changes are appended to journal file
+    (one json line per change) that is merged into index file when it grows larger than index, or when index is
+    loaded. Journal starts with generation of index file it belongs to, so that journal that was already merged
+    is ignored.
+    """
+
+    fname_format = '{}.index.json'
+    journal_fname_format = '{}.index.journal'
+    MIN_COMPACT_SIZE = 1000  # journal with fewer changes is never merged while table is open
+
+    # types of values that can be indexed, by field type (values must be comparable with each other)
+    VALUE_TYPES = {
+        'bool': (bool, ),
+        'str': (str, ),
+        'int': (int, ),
+        'float': (int, float),
+        'datetime': (datetime.datetime, ),
+    }
+
+    def __init__(self, table, field_name):
+        self.table = table
+        self.field = self.table.fields[field_name]
+        if self.field.type not in self.field.INDEX_TYPES:
+            raise FsdbError('Field "{}" of type "{}" can\'t be indexed!'.format(self.field.name, self.field.type))
+
+        self.index_path = os.path.join(self.table.table_path, sanitize_filename(self.fname_format.format(field_name)))
+        self.journal_path = os.path.join(self.table.table_path,
+                                         sanitize_filename(self.journal_fname_format.format(field_name)))
+        self.id_values = {}  # record id -> indexed value
+
+        self.generation = 0  # incremented every time index file is written
+        self.journal_size = 0  # number of changes in journal file
+        self.changes = []  # changes that were not appended to journal yet, [id_str, value] or [id_str] for removal
+
+    # load/save
+
+    @abc.abstractmethod
+    def to_dict(self):
+        pass
+
+    @abc.abstractmethod
+    def from_dict(self, data):
+        pass
+
+    def save(self):
+        """
+        Writes whole index to index file and removes journal.
+        """
+        self.generation += 1
+        data = self.to_dict()
+        data['field'] = self.field.name  # just for info
+        data['generation'] = self.generation
+        write_file(self.index_path, json.dumps(data, sort_keys=True), self.table.get_durability())
+
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.journal_size = 0
+        self.changes = []
+
+    def save_changes(self):
+        """
+        Appends logged changes to journal, or saves whole index if journal would be larger than index.
+        :return: True if files in table folder were created, replaced or removed
+        """
+        if not self.changes:
+            return False
+        if self.journal_size + len(self.changes) > max(self.MIN_COMPACT_SIZE, len(self.id_values)):
+            self.save()
+            return True
+
+        created = not os.path.exists(self.journal_path)
+        lines = [json.dumps({'generation': self.generation})] if created else []
+        lines.extend(json.dumps(change) for change in self.changes)
+        append_file(self.journal_path, ''.join(line + '\n' for line in lines), self.table.get_durability())
+        self.journal_size += len(self.changes)
+        self.changes = []
+        return created
+
+    def load(self):
+        """
+        Loads index from file and its journal. Index is rebuilt if it's missing or if it doesn't match table record
+        ids.
+        :return: True if files in table folder were created, replaced or removed
+        """
+        self.clear()
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                data = json.loads(f.read())
+            self.from_dict(data)
+            self.generation = data.get('generation', 0)
+            if os.path.exists(self.journal_path):
+                self.load_journal()
+
+        if not os.path.exists(self.index_path) or len(self.id_values) != len(self.table.record_ids) or \
+                any(rid not in self.id_values for rid in self.table.record_ids):
+            self.rebuild()
+            return True
+        elif os.path.exists(self.journal_path):
+            self.save()
+            return True
+        return False
+
+    def load_journal(self):
+        """
+        Applies changes from journal to index loaded from index file.
+        """
+        with open(self.journal_path, 'r') as f:
+            lines = f.read().split('\n')
+        lines.pop()  # last line is empty or incomplete (if process crashed while appending to journal)
+        if not lines or json.loads(lines[0]).get('generation') != self.generation:
+            return  # journal was already merged into index file
+
+        for line in lines[1:]:
+            change = json.loads(line)
+            rid = self.table.str2ids(change[0])
+            if len(change) > 1:
+                self.add(rid, self.field.json2val(change[1]))
+            else:
+                self.remove(rid)
+
+    def rebuild(self):
+        _logger.info('REBUILD INDEX OF FIELD "{}" IN TABLE "{}"'.format(self.field.name, self.table.name))
+        self.clear()
+        for record in self.table.browse_records(list(self.table.record_ids)):
+            value = record.read([self.field.name, ])[self.field.name]
+            try:
+                self.check_value(value)
+            except FsdbError:
+                # indexed as None, so that index is complete and isn't rebuilt again on next load
+                _logger.warning('Value "{}" of field "{}" in record "{}" of table "{}" can\'t be indexed!'.format(
+                    value, self.field.name, record.id_str, self.table.name))
+                value = None
+            self.add(record.id, value)
+        self.save()
+
+    def clear(self):
+        self.id_values = {}
+        self.changes = []
+
+    # add/remove
+
+    def check_value(self, value):
+        """
+        Raises FsdbError if value can't be indexed.
+        """
+        if value is not None and not isinstance(value, self.VALUE_TYPES[self.field.type]):
+            raise FsdbError('Value "{}" of field "{}" can\'t be indexed!'.format(value, self.field.name))
+
+    @abc.abstractmethod
+    def add(self, rid, value):
+        pass
+
+    @abc.abstractmethod
+    def remove(self, rid):
+        pass
+
+    def update(self, rid, value):
+        """
+        Sets value of record and logs the change, so that it's saved by save_changes().
+        :return: True if value was changed
+        """
+        if rid in self.id_values and self.id_values[rid] == value:
+            return False
+        self.add(rid, value)
+        self.changes.append([self.table.ids2str(rid), self.field.val2json(value)])
+        return True
+
+    def delete(self, rid):
+        """
+        Removes record and logs the change, so that it's saved by save_changes().
+        :return: True if record was in index
+        """
+        if rid not in self.id_values:
+            return False
+        self.remove(rid)
+        self.changes.append([self.table.ids2str(rid)])
+        return True
+
+
+class Index(BaseIndex):
+    """
+    Sorted index, used to speed up search of records.
+    """
+
+    def __init__(self, table, field_name):
+        self.values = []  # sorted values
+        self.ids = []  # record ids in the same order as values (ids with same value are sorted)
+        self.null_ids = set()  # ids of records with None value
+        super().__init__(table, field_name)
+
+    # load/save
+
+    def to_dict(self):
+        return {
+            'values': [self.field.val2json(val) for val in self.values],
+            'ids': self.table.ids2str(self.ids),
+            'null_ids': self.table.ids2str(sorted(self.null_ids)),
+        }
+
+    def from_dict(self, data):
+        self.values = [self.field.json2val(val) for val in data['values']]
+        self.ids = self.table.str2ids(data['ids'])
+        self.null_ids = set(self.table.str2ids(data['null_ids']))
+        self.id_values = dict(zip(self.ids, self.values))
+        self.id_values.update({rid: None for rid in self.null_ids})
+
+    def clear(self):
+        super().clear()
+        self.values = []
+        self.ids = []
+        self.null_ids = set()
+
+    # add/remove
+
+    def add(self, rid, value):
+        if rid in self.id_values:
+            self.remove(rid)
+
+        if value is None:
+            self.id_values[rid] = value
+            self.null_ids.add(rid)
+            return
+
+        try:
+            lo = bisect.bisect_left(self.values, value)
+            hi = bisect.bisect_right(self.values, value, lo)
+        except TypeError:
+            raise FsdbError('Value "{}" of field "{}" can\'t be indexed!'.format(value, self.field.name))
+        pos = bisect.bisect_left(self.ids, rid, lo, hi)
+        self.id_values[rid] = value
+        self.values.insert(pos, value)
+        self.ids.insert(pos, rid)
+
+    def remove(self, rid):
+        if rid not in self.id_values:
+            return
+
+        value = self.id_values.pop(rid)
+        if value is None:
+            self.null_ids.discard(rid)
+            return
+
+        lo = bisect.bisect_left(self.values, value)
+        hi = bisect.bisect_right(self.values, value, lo)
+        pos = bisect.bisect_left(self.ids, rid, lo, hi)
+        del(self.values[pos])
+        del(self.ids[pos])
+
+    # search
+
+    def _search_eq(self, value):
+        if value is None:
+            return set(self.null_ids)
+        lo = bisect.bisect_left(self.values, value)
+        hi = bisect.bisect_right(self.values, value, lo)
+        return set(self.ids[lo:hi])
+
+    def search(self, operator, value):
+        """
+        :param operator: domain operator
+        :param value: domain value
+        :return: set of ids of records that match (field, operator, value) domain, or None if index can't be used
+        """
+        try:
+            if operator == '=':
+                return self._search_eq(value)
+            elif operator == '!=':
+                return set(self.id_values.keys()) - self._search_eq(value)
+            elif operator == 'in':
+                return set().union(*[self._search_eq(val) for val in value])
+            elif operator == 'not in':
+                return set(self.id_values.keys()).difference(*[self._search_eq(val) for val in value])
+            elif value is None:
+                return None  # None can't be compared
+            elif operator == '>':
+                return set(self.ids[bisect.bisect_right(self.values, value):])
+            elif operator == '>=':
+                return set(self.ids[bisect.bisect_left(self.values, value):])
+            elif operator == '<':
+                return set(self.ids[:bisect.bisect_left(self.values, value)])
+            elif operator == '<=':
+                return set(self.ids[:bisect.bisect_right(self.values, value)])
+        except TypeError:
+            pass  # value is not comparable with indexed values
+        return None
+
+
+class UniqueIndex(BaseIndex):
+    """
+    Hash index of values of unique field, used to check uniqueness in constant time. None values are not indexed.
+    """
+
+    fname_format = '{}.unique.json'
+    journal_fname_format = '{}.unique.journal'
+
+    def __init__(self, table, field_name):
+        self.value_ids = {}  # value -> record id
+        super().__init__(table, field_name)
+
+    # load/save
+
+    def to_dict(self):
+        ids = [rid for rid in self.id_values if self.id_values[rid] is not None]
+        return {
+            'values': [self.field.val2json(self.id_values[rid]) for rid in ids],
+            'ids': self.table.ids2str(ids),
+            'null_ids': self.table.ids2str([rid for rid in self.id_values if self.id_values[rid] is None]),
+        }
+
+    def from_dict(self, data):
+        values = [self.field.json2val(val) for val in data['values']]
+        ids = self.table.str2ids(data['ids'])
+        self.value_ids = dict(zip(values, ids))
+        self.id_values = dict(zip(ids, values))
+        self.id_values.update({rid: None for rid in self.table.str2ids(data['null_ids'])})
+
+    def clear(self):
+        super().clear()
+        self.value_ids = {}
+
+    # add/remove
+
+    def add(self, rid, value):
+        if rid in self.id_values:
+            self.remove(rid)
+
+        self.id_values[rid] = value
+        if value is None:
+            return
+        if value in self.value_ids:
+            _logger.warning('Value "{}" of unique field "{}" in table "{}" is not unique!'.format(
+                value, self.field.name, self.table.name))
+        self.value_ids[value] = rid
+
+    def remove(self, rid):
+        if rid not in self.id_values:
+            return
+
+        value = self.id_values.pop(rid)
+        if value is not None and self.value_ids.get(value) == rid:
+            del(self.value_ids[value])
+
+    # search
+
+    def get_id(self, value):
+        """
+        :return: id of record with given value or None
+        """
+        return self.value_ids.get(value) if value is not None else None
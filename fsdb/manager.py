@@ -33,9 +33,16 @@ class Manager(object):
         :param config: [
             {
                 'name': database_name,
+                'durability': 'none' | 'fsync' | 'fsync_dir',  (optional)
+                'serializer': 'json' | 'compact_json' | 'binary',  (optional)
+                'blob_store': True,  (optional, deduplicate files of file/file_list fields)
                 'tables': [
                     {
                         'name': table_name,
+                        'cache_size': cache_size_in_bytes,  (optional)
+                        'cache_size_limit': cache_size_limit_in_bytes,  (optional)
+                        'durability': 'none' | 'fsync' | 'fsync_dir',  (optional, default is durability of db)
+                        'serializer': 'json' | 'compact_json' | 'binary',  (optional, default is serializer of db)
                         'fields': [
                             {
                                 'name': field_name,
@@ -43,6 +50,10 @@ class Manager(object):
                                 'default': default_value,  (optional)
                                 'required': False, (optional)
                                 'unique': False,  (optional)
+                                'index': False,  (optional, only for bool/str/int/float/datetime fields)
+                                'compression': 'zlib' | 'lzma',  (optional, only for str/list/tuple/dict/file/file_list)
+                                'compression_threshold': size_in_bytes,  (optional, default is 1024)
+                                'verify_files': False,  (optional, only for file_list, detect files modified in place)
                             },
                             ...
                         ],
@@ -66,16 +77,26 @@ class Manager(object):
             if not self.is_database(db_config['name']):
                 self.create_database(db_config['name'])
             self.open_database(db_config['name'])
+            if db_config.get('durability'):
+                self.set_durability(db_config['durability'])
+            if db_config.get('serializer'):
+                self.set_serializer(db_config['serializer'])
+            if db_config.get('blob_store') and self.database.blob_store is None:
+                self.set_blob_store(True)
 
             for table_config in db_config.get('tables', []):
                 if not self.is_table(table_config['name']):
-                    self.create_table(table_config['name'], table_config['fields'])
-
-                for record_values in table_config.get('records', []):
-                    rid = record_values['id']
-                    found = self.browse_records(table_config['name'], rid)
-                    if not found:
-                        self.create_record(table_config['name'], record_values)
+                    self.create_table(table_config['name'], table_config['fields'],
+                                      cache_size=table_config.get('cache_size'),
+                                      cache_size_limit=table_config.get('cache_size_limit'),
+                                      durability=table_config.get('durability'),
+                                      serializer=table_config.get('serializer'))
+
+                table = self.get_table(table_config['name'])
+                new_records = [record_values for record_values in table_config.get('records', [])
+                               if record_values['id'] not in table.record_ids]
+                if new_records:
+                    self.create_records(table_config['name'], new_records, return_ids=True)
 
             self.close_database()
 
@@ -90,10 +111,14 @@ class Manager(object):
     def create_database(self, name):
         Database.create(self.root_path, name)
 
-    def open_database(self, name):
+    def open_database(self, name, warm_up=None):
+        """
+        Tables of database are loaded on first access.
+        :param warm_up: list of names of tables that should be loaded in background, True for all tables
+        """
         if self.database:
             self.database.close()
-        self.database = Database.open(self.root_path, name)
+        self.database = Database.open(self.root_path, name, warm_up=warm_up)
 
     def close_database(self):
         if self.database:
@@ -109,6 +134,65 @@ class Manager(object):
             self.close_database()
         Database(name, self.root_path).delete()
 
+    @dec_check_database_opened
+    def flush(self):
+        """
+        Writes changes buffered by tables in write-behind mode.
+        :return: number of written records
+        """
+        return self.database.flush()
+
+    @dec_check_database_opened
+    def set_durability(self, durability, table_name=None):
+        """
+        Sets durability of writes to database or table files.
+        :param durability: "none" (files are replaced atomically), "fsync" (+ files are synced to disk) or
+            "fsync_dir" (+ directories are synced to disk), None resets table to durability of database
+        :param table_name: name of table, None for database
+        """
+        if table_name is None:
+            self.database.set_durability(durability)
+        else:
+            self.get_table(table_name).set_durability(durability)
+
+    @dec_check_database_opened
+    def set_serializer(self, serializer, table_name=None):
+        """
+        Sets format of record data files of database or table. Format of existing files is detected on read.
+        :param serializer: "json" (pretty JSON), "compact_json" or "binary", None resets table to serializer of
+            database
+        :param table_name: name of table, None for database
+        """
+        if table_name is None:
+            self.database.set_serializer(serializer)
+        else:
+            self.get_table(table_name).set_serializer(serializer)
+
+    @dec_check_database_opened
+    def set_blob_store(self, enabled=True):
+        """
+        Enables/disables deduplication of files written to file/file_list fields of database (content-addressed store
+        with hardlinks).
+        """
+        self.database.set_blob_store(enabled)
+
+    @dec_check_database_opened
+    def gc_blobs(self, limit=None):
+        """
+        Removes blobs that are no longer used by any record. Every call checks at most limit blobs, continuing where
+        previous call ended.
+        :return: number of removed blobs
+        """
+        return self.database.gc_blobs(limit)
+
+    @dec_check_database_opened
+    def get_cache_stats(self):
+        return self.database.get_cache_stats()
+
+    @dec_check_database_opened
+    def reset_cache_stats(self):
+        self.database.reset_cache_stats()
+
     # Table
 
     @dec_check_database_opened
@@ -122,14 +206,19 @@ class Manager(object):
         return self.database.tables[name]
 
     @dec_check_database_opened
-    def create_table(self, name, fields):
-        return Table.create(self.database, name, fields)
+    def create_table(self, name, fields, cache_size=None, cache_size_limit=None, durability=None, serializer=None):
+        return Table.create(self.database, name, fields, cache_size=cache_size, cache_size_limit=cache_size_limit,
+                            durability=durability, serializer=serializer)
+
+    @dec_check_database_opened
+    def set_write_behind(self, table_name, enabled=True, max_records=1000, max_delay=1.0):
+        table = self.get_table(table_name)
+        table.set_write_behind(enabled=enabled, max_records=max_records, max_delay=max_delay)
 
     @dec_check_database_opened
     def delete_table(self, name):
         if self.is_table(name):
-            self.database.tables[name].delete()
-            del(self.database.tables[name])
+            self.database.delete_table(name)
 
     # IDs
 
@@ -151,10 +240,17 @@ class Manager(object):
         return Record.create(table, values)
 
     @dec_check_database_opened
-    def write_records(self, table_name, values, domain=None):
-        records = self.search_records(table_name, domain)
-        map(lambda rec: rec.write(values), records)
-        return records
+    def create_records(self, table_name, values_list, return_ids=False, workers=None):
+        table = self.get_table(table_name)
+        return table.create_records(values_list, return_ids=return_ids, workers=workers)
+
+    @dec_check_database_opened
+    def write_records(self, table_name, values, domain=None, workers=None):
+        """
+        :return: number of written records
+        """
+        table = self.get_table(table_name)
+        return table.write_records(values, domain=domain, workers=workers)
 
     @dec_check_database_opened
     def browse_records(self, table_name, ids):
@@ -162,11 +258,28 @@ class Manager(object):
         return table.browse_records(ids)
 
     @dec_check_database_opened
-    def search_records(self, table_name, domain=None, order=None, limit=None):
+    def search_records(self, table_name, domain=None, order=None, limit=None, offset=0, cursor=None, workers=None,
+                       chunk_size=None):
+        table = self.get_table(table_name)
+        return table.search_records(domain=domain, order=order, limit=limit, offset=offset, cursor=cursor,
+                                    workers=workers, chunk_size=chunk_size)
+
+    @dec_check_database_opened
+    def iter_records(self, table_name, domain=None, order=None, limit=None, offset=0, cursor=None, workers=None,
+                     chunk_size=None):
         table = self.get_table(table_name)
-        return table.search_records(domain=domain, order=order, limit=limit)
+        return table.iter_records(domain=domain, order=order, limit=limit, offset=offset, cursor=cursor,
+                                  workers=workers, chunk_size=chunk_size)
 
     @dec_check_database_opened
-    def delete_records(self, table_name, domain=None):
-        records = self.search_records(table_name, domain)
-        map(lambda x: x.delete(), records)
+    def get_cursor(self, table_name, record, order=None):
+        table = self.get_table(table_name)
+        return table.get_cursor(record, order=order)
+
+    @dec_check_database_opened
+    def delete_records(self, table_name, domain=None, workers=None):
+        """
+        :return: number of deleted records
+        """
+        table = self.get_table(table_name)
+        return table.delete_records(domain=domain, workers=workers)
@@ -0,0 +1,211 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from .tools import sanitize_filename
+from .record_ids import RecordIds
+
+import os
+import sys
+import array
+import struct
+import logging
+import datetime
+
+_logger = logging.getLogger(__name__)
+
+
+class IdManifest(object):
+    """
+    Binary file with ids of all table records, so that table doesn't have to list and check all record folders when
+    it's opened. File has header (magic, mtime of table folder, number of entries, highest id ever used) followed by
+    entries packed as little-endian 64-bit integers (datetime ids are stored as microseconds since epoch).
+
+    Entries are ids of added records. Removed records are appended as TOMBSTONE followed by their id, manifest is
+    rewritten without them when it has more tombstones than ids, or when it's loaded. TOMBSTONE is not valid int id
+    (see RecordIds.MIN_INT_ID), table with ids that can't be stored (created by older versions) has no manifest.
+
+    Manifest is valid only if mtime saved in it equals current mtime of table folder. Every change of table folder
+    done by table must be followed by update of manifest (add, remove, save or touch).
+    """
+
+    fname = sanitize_filename('ids.manifest')
+    MAGIC = b'FSDBIDS3'
+    HEADER = struct.Struct('<8sqQq')  # magic, table folder mtime [ns], number of entries, last id
+
+    EPOCH = datetime.datetime(1970, 1, 1)
+    MICROSECOND = datetime.timedelta(microseconds=1)
+
+    NONE_ID = RecordIds.MIN_INT_ID - 1  # stored as last id, if table never had any records
+    TOMBSTONE = RecordIds.MIN_INT_ID - 1  # entry followed by id of removed record
+    MIN_COMPACT_SIZE = 1000  # manifest with fewer tombstones is never compacted while table is open
+
+    def __init__(self, table):
+        self.table = table
+        self.manifest_path = os.path.join(self.table.table_path, self.fname)
+        self.id_type = self.table.fields['id'].type
+        self.count = 0  # number of entries in file
+        self.removed = 0  # number of tombstones in file
+
+    # id conversion
+
+    def id2int(self, rid):
+        if self.id_type == 'datetime':
+            return (rid - self.EPOCH) // self.MICROSECOND
+        return rid
+
+    def int2id(self, value):
+        if self.id_type == 'datetime':
+            return self.EPOCH + datetime.timedelta(microseconds=value)
+        return value
+
+    def ids2array(self, ids):
+        if self.id_type == 'datetime':
+            ids = [self.id2int(rid) for rid in ids]
+        return array.array('q', ids)
+
+    def array2ids(self, arr):
+        if self.id_type == 'datetime':
+            return [self.int2id(value) for value in arr]
+        return arr.tolist()
+
+    @classmethod
+    def apply_tombstones(cls, arr):
+        """
+        :return: array of ids that were not removed by tombstones following them
+        """
+        ids = {}  # ordered set
+        values = iter(arr)
+        for value in values:
+            if value == cls.TOMBSTONE:
+                ids.pop(next(values), None)
+            else:
+                ids[value] = None
+        return array.array('q', ids)
+
+    @staticmethod
+    def to_bytes(arr):
+        if sys.byteorder != 'little':
+            arr.byteswap()
+        return arr.tobytes()
+
+    def pack_header(self):
+        last_id = self.table.record_ids.last_id
+        last_id = self.id2int(last_id) if last_id is not None else self.NONE_ID
+        return self.HEADER.pack(self.MAGIC, self.get_mtime(), self.count, last_id)
+
+    # load/save
+
+    def get_mtime(self):
+        return os.stat(self.table.table_path).st_mtime_ns
+
+    def load(self):
+        """
+        :return: RecordIds or None if manifest is missing, corrupted or stale
+        """
+        try:
+            with open(self.manifest_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        if len(data) < self.HEADER.size:
+            return None
+        magic, mtime, count, last_id = self.HEADER.unpack_from(data)
+        if magic != self.MAGIC or mtime != self.get_mtime() or len(data) != self.HEADER.size + count*8:
+            return None
+
+        arr = array.array('q')
+        arr.frombytes(data[self.HEADER.size:])
+        if sys.byteorder != 'little':
+            arr.byteswap()
+        self.count = count
+        self.removed = arr.count(self.TOMBSTONE)
+        if self.removed:
+            arr = self.apply_tombstones(arr)
+        last_id = self.int2id(last_id) if last_id != self.NONE_ID else None
+        return RecordIds(self.array2ids(arr), self.id_type, last_id)
+
+    def load_last_id(self):
+        """
+        :return: highest id ever used by table saved in manifest header, also if manifest is stale, None if unknown
+        """
+        try:
+            with open(self.manifest_path, 'rb') as f:
+                data = f.read(self.HEADER.size)
+        except FileNotFoundError:
+            return None
+
+        if len(data) < self.HEADER.size:
+            return None
+        magic, _, _, last_id = self.HEADER.unpack(data)
+        if magic != self.MAGIC or last_id == self.NONE_ID:
+            return None
+        return self.int2id(last_id)
+
+    def is_supported(self):
+        """
+        :return: False if table has int ids out of range of manifest entries
+        """
+        return self.id_type != 'int' or self.table.record_ids.packed
+
+    def save(self):
+        """
+        Rewrites manifest with current record ids of table. Manifest is removed if ids can't be stored in it, table
+        is then scanned on every load.
+        """
+        if not self.is_supported():
+            if os.path.exists(self.manifest_path):
+                os.remove(self.manifest_path)
+            return
+        # file is created before mtime of folder is read, rewriting existing file doesn't change the mtime
+        if not os.path.exists(self.manifest_path):
+            open(self.manifest_path, 'wb').close()
+        self.count = len(self.table.record_ids)
+        self.removed = 0
+        with open(self.manifest_path, 'wb') as f:
+            f.write(self.pack_header())
+            f.write(self.to_bytes(self.ids2array(self.table.record_ids)))
+
+    def add(self, rid):
+        """
+        Appends id of new record to manifest.
+        """
+        self.extend([rid])
+
+    def extend(self, ids):
+        """
+        Appends ids of new records to manifest.
+        """
+        self.append(self.ids2array(ids))
+
+    def append(self, arr):
+        """
+        Appends entries to manifest and updates its header.
+        """
+        if not os.path.exists(self.manifest_path):
+            return self.save()
+        with open(self.manifest_path, 'r+b') as f:
+            f.seek(self.HEADER.size + self.count*8)
+            f.write(self.to_bytes(arr))
+            f.truncate()
+            self.count += len(arr)
+            f.seek(0)
+            f.write(self.pack_header())
+
+    def remove(self, rid):
+        """
+        Appends tombstone of removed record to manifest.
+        """
+        if not os.path.exists(self.manifest_path) or \
+                self.removed + 1 > max(self.MIN_COMPACT_SIZE, len(self.table.record_ids)):
+            return self.save()
+        self.append(array.array('q', [self.TOMBSTONE, self.id2int(rid)]))
+        self.removed += 1
+
+    def touch(self):
+        """
+        Marks manifest as valid for current state of table folder, used after table changed files in its folder.
+        """
+        if not os.path.exists(self.manifest_path):
+            return self.save()
+        with open(self.manifest_path, 'r+b') as f:
+            f.write(self.pack_header())
@@ -1,11 +1,11 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
-from .exceptions import FsdbError, FsdbObjectDeleted, FsdbDatabaseClosed
-from .tools import sanitize_filename
+from .exceptions import FsdbError
+from .tools import sanitize_filename, write_file
+from . import serializers
 
 import os
 import shutil
-import json
 import copy
 import datetime
 import logging
@@ -14,16 +14,19 @@ _logger = logging.getLogger(__name__)
 
 
 class Record(object):
+    """
+    Deleted records and records of closed database raise exception on any attribute access (see tools.invalidate).
+    """
+    __slots__ = ['id', 'table', 'database', 'cache', 'fields', 'table_path', 'id_str', 'record_path', 'data_path',
+                 'cache_key', '__weakref__']
 
     data_fname = sanitize_filename('data.json')
-    database = None
-    _deleted = False
 
     def __init__(self, id, table):
         self.id = id
         self.table = table
         self.database = self.table.database
-        self.cache = self.database.cache
+        self.cache = self.table.cache
         self.fields = self.table.fields
         self.table_path = self.table.table_path
 
@@ -33,16 +36,8 @@ class Record(object):
 
         self.cache_key = self.generate_cache_key()
 
-    def __getattribute__(self, name):
-        # check if record is deleted
-        if object.__getattribute__(self, '_deleted'):
-            raise FsdbObjectDeleted('Can\'t access deleted record objects!')
-        # check if database is closed
-        database = object.__getattribute__(self, 'database')
-        if database and object.__getattribute__(database, '_closed'):
-            raise FsdbDatabaseClosed
-        # return attribute
-        return object.__getattribute__(self, name)
+        # track live record objects, so that they can be invalidated when record is deleted or database closed
+        self.table.add_live_record(self)
 
     def generate_cache_key(self):
         return "{}-{}".format(self.table.name, self.id_str)
@@ -54,13 +49,40 @@ class Record(object):
         _logger.info('CREATE RECORD IN TABLE "{}" SET values={}'.format(table.name, values))
 
         # get/generate record id
-        values['id'] = values['id'] if values.get('id') else table.get_new_id()
+        values['id'] = values['id'] if values.get('id') is not None else table.get_new_id()
 
-        # init values of system fields
-        values['create_datetime'] = datetime.datetime.utcnow()
+        # init values of system fields and default values, remove bad field names
+        cls.init_values(table, values)
+
+        # convert id to string (will be used as folder name) - check if record folder already exists
+        id_str = table.fields['id'].val2str(values['id'])
+        if os.path.exists(os.path.join(table.table_path, id_str)):
+            raise FsdbError('ID must be unique!')
+
+        # check required and unique fields
+        table.check_values(values)
+
+        # create record object, directory and save all values
+        obj = cls(values['id'], table)
+        obj.save_new(values)
+
+        # add record to table record ids and indexes
+        if table.record_ids.add(obj.id):
+            table.id_manifest.add(obj.id)
+        else:
+            table.id_manifest.touch()
+        table.index_record(obj.id, values)
+
+        return obj
+
+    @classmethod
+    def init_values(cls, table, values, create_datetime=None):
+        """
+        Sets values of system fields and default values of missing fields, removes invalid field names.
+        """
+        values['create_datetime'] = create_datetime or datetime.datetime.utcnow()
         values['modify_datetime'] = values['create_datetime']
 
-        # init default values, remove bad field names
         for name in table.fields:
             if name not in values:
                 values[name] = copy.deepcopy(table.fields[name].default)
@@ -68,34 +90,53 @@ class Record(object):
             if name not in table.fields.keys():
                 _logger.warning('Write to invalid field name "{}" in table "{}"'.format(name, table.name))
                 del(values[name])
+        return values
+
+    def save_new(self, values):
+        """
+        Creates record directory and saves all values of new record. Directory is removed if saving fails.
+        """
+        os.makedirs(self.record_path)
+        self.table.sync_table_dir()
+        data_values = {}
+        try:
+            for name in values:
+                self.fields[name].write(self, values[name], data_values)
+            self.write_data_file({k: data_values.get(k) for k in self.fields})
+        except Exception:
+            blob_digests = self.get_blob_digests(data_values)  # files that were already written
+            shutil.rmtree(self.record_path)
+            if blob_digests:
+                self.database.get_blob_store().release(blob_digests)
+            raise
 
-        # convert id to string (will be used as folder name) - check if record folder already exists
-        id_str = table.fields['id'].val2str(values['id'])
-        if os.path.exists(os.path.join(table.table_path, id_str)):
-            raise FsdbError('ID must be unique!')
+    def write(self, values):
+        _logger.info('UPDATE RECORD "{}" IN TABLE "{}" SET values={}'.format(self.id_str, self.table.name, values))
+        self.filter_write_values(self.table, values)
 
-        # create record object
-        obj = cls(values['id'], table)
+        # check required and unique fields
+        self.table.check_values(values, self.id)
 
-        # init record directory
-        os.makedirs(obj.record_path)
+        # delete cached value
+        self.cache.del_cache(self.cache_key)
 
-        # save all values
-        data_values = {}
-        for name in values:
-            table.fields[name].write(obj, values[name], data_values)
-        with open(obj.data_path, 'w') as f:
-            data_values = {k: data_values.get(k) for k in table.fields}
-            f.write(json.dumps(copy.deepcopy(data_values), sort_keys=True, indent=2))
+        # change modify_datetime value
+        values['modify_datetime'] = datetime.datetime.utcnow()
 
-        # add record to table record ids
-        if obj.id not in table.record_ids:
-            table.record_ids.append(obj.id)
+        # save values, indexes are marked as dirty until they are updated
+        indexes_dirty = self.table.begin_index_update(values)
+        self.save_values(values)
 
-        return obj
+        # update table indexes
+        self.table.index_record(self.id, values)
+        if indexes_dirty:
+            self.table.end_index_update()
 
-    def write(self, values):
-        _logger.info('UPDATE RECORD "{}" IN TABLE "{}" SET values={}'.format(self.id_str, self.table.name, values))
+    @classmethod
+    def filter_write_values(cls, table, values):
+        """
+        Removes values that can't be written to existing record.
+        """
         # changing Index value is forbidden
         if 'id' in values:
             _logger.warning('Attempted to change record ID. ignoring.')
@@ -104,24 +145,19 @@ class Record(object):
             del(values['id_str'])
 
         # detect invalid field names
-        for name in values:
-            if name not in self.fields.keys():
-                _logger.warning('Write to invalid field name "{}" in table "{}"'.format(name, self.table.name))
+        for name in list(values.keys()):
+            if name not in table.fields.keys():
+                _logger.warning('Write to invalid field name "{}" in table "{}"'.format(name, table.name))
                 del(values[name])
+        return values
 
-        # delete cached value
-        self.cache.del_cache(self.cache_key)
-
-        # change modify_datetime value
-        values['modify_datetime'] = datetime.datetime.utcnow()
-
+    def save_values(self, values):
+        """
+        Saves values to record files. Doesn't check values, update cache or indexes.
+        """
         # load old values and update them with defaults
-        with open(self.data_path, 'r') as f:
-            data_values = json.loads(f.read())
-        for name in self.table.fields:
-            if name not in data_values:
-                data_values[name] = copy.deepcopy(self.table.fields[name].default)
-        for name in data_values:
+        data_values = self.load_data_values()
+        for name in list(data_values.keys()):
             if name not in self.fields.keys():
                 _logger.info('Removing old field "{}" from record data."'.format(name))
                 del(data_values[name])
@@ -129,11 +165,58 @@ class Record(object):
         # save all values
         for name in values:
             self.fields[name].write(self, values[name], data_values)
-        with open(self.data_path, 'w') as f:
-            data_values = {k: data_values.get(k) for k in self.fields}
-            f.write(json.dumps(copy.deepcopy(data_values), sort_keys=True, indent=2))
-
-    def read(self, field_names=None):
+        self.save_data_values({k: data_values.get(k) for k in self.fields})
+
+    def load_data_values(self):
+        """
+        :return: content of data file (or its buffered version in write-behind mode) updated with default values
+        """
+        data_values = self.table.write_buffer.get(self.id) if self.table.write_buffer is not None else None
+        if data_values is None:
+            data_values = self.read_data_file()
+        for name in self.table.fields:
+            if name not in data_values:
+                data_values[name] = copy.deepcopy(self.table.fields[name].default)
+        return data_values
+
+    def save_data_values(self, data_values):
+        """
+        Writes data file, or just buffers data values in write-behind mode.
+        """
+        if self.table.write_buffer is not None:
+            self.table.write_buffer.put(self, data_values)
+        else:
+            self.write_data_file(data_values)
+
+    def get_blob_digests(self, data_values=None):
+        """
+        :param data_values: values of data file, None to load them
+        :return: digests of blobs that files of record are linked to
+        """
+        if data_values is None:
+            try:
+                data_values = self.load_data_values()  # buffered data values in write-behind mode
+            except FileNotFoundError:
+                return []
+        digests = []
+        for name, field in self.fields.items():
+            digests.extend(field.get_blob_digests(data_values.get(name)))
+        return digests
+
+    def read_data_file(self):
+        with open(self.data_path, 'rb') as f:
+            return serializers.loads(f.read())
+
+    def write_data_file(self, data_values):
+        serializer = serializers.get_serializer(self.table.get_serializer())
+        write_file(self.data_path, serializer.dumps(data_values), self.table.get_durability())
+
+    def read(self, field_names=None, file_handles=False):
+        """
+        :param field_names: list of field names, None for all fields
+        :param file_handles: add lazy FileHandle ("handle" key) to values of file and file_list fields
+        :return: dict with values
+        """
         _logger.info('READ RECORD "{}" IN TABLE "{}" GET {}'.format(self.id_str, self.table.name, field_names or 'ALL'))
         if field_names is None:
             field_names = list(self.fields.keys())
@@ -144,8 +227,8 @@ class Record(object):
                 _logger.warning('Read from invalid field name "{}" in table "{}"'.format(name, self.table.name))
                 field_names.remove(name)
 
-        # get cached data
-        values = self.cache.from_cache(self.cache_key) or {}
+        # get cached data (copy, so that cached value and its size stay unchanged until it's cached again)
+        values = dict(self.cache.from_cache(self.cache_key) or {})
 
         # add id
         if 'id' in field_names:
@@ -157,14 +240,10 @@ class Record(object):
         read_field_names = [name for name in field_names if name not in values]
         if len(read_field_names) == 0:
             # return what was requested
-            return {k: values[k] for k in field_names}
+            return self._get_read_result(values, field_names, file_handles)
 
         # read values
-        with open(self.data_path, 'r') as f:
-            data_values = json.loads(f.read())
-        for name in self.table.fields:
-            if name not in data_values:
-                data_values[name] = copy.deepcopy(self.table.fields[name].default)
+        data_values = self.load_data_values()
         for name in read_field_names:
             values[name] = self.fields[name].read(self, data_values)
 
@@ -172,17 +251,31 @@ class Record(object):
         self.cache.to_cache(self.cache_key, values)
 
         # return what was requested
-        return {k: values[k] for k in field_names}
+        return self._get_read_result(values, field_names, file_handles)
+
+    def _get_read_result(self, values, field_names, file_handles):
+        if not file_handles:
+            return {k: values[k] for k in field_names}
+        return {k: (self.fields[k].add_file_handles(values[k]) if k in self.fields else values[k])
+                for k in field_names}
 
     def delete(self):
         _logger.info('DELETE RECORD "{}" IN TABLE "{}"'.format(self.id_str, self.table.name))
-        # delete cached version
+        # delete cached and buffered version, blobs are collected first, so that buffered files are included
         self.cache.del_cache(self.cache_key)
-        # remove from table list of ids
-        if self.id in self.table.record_ids:
-            self.table.record_ids.remove(self.id)
-        # delete data
+        blob_store = self.database.get_blob_store()
+        blob_digests = self.get_blob_digests() if blob_store is not None else []
+        if self.table.write_buffer is not None:
+            self.table.write_buffer.discard([self.id, ])
+        # remove from table list of ids and indexes
+        self.table.record_ids.remove(self.id)
+        self.table.unindex_record(self.id)
+        # delete data, blobs that were used only by this record are removed
         if os.path.exists(self.record_path):
             shutil.rmtree(self.record_path)
-        # mark object as deleted
-        self._deleted = True
+            self.table.sync_table_dir()
+        self.table.id_manifest.remove(self.id)
+        if blob_digests:
+            blob_store.release(blob_digests)
+        # mark all objects of record as deleted
+        self.table.mark_records_deleted([self.id, ])
@@ -0,0 +1,134 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import array
+import bisect
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class RecordIds(object):
+    """
+    Sorted set of record ids of table. Ids are kept in sorted sequence (compact array of 64-bit integers for int
+    ids) for bisecting and ordered iteration, and in set for constant time membership tests. Highest id that was
+    ever added is tracked, so that new ids can be generated in constant time.
+
+    New int ids must be in range MIN_INT_ID..MAX_INT_ID (lowest 64-bit integer is reserved for id manifest), ids
+    out of range (created by older versions) are kept in list.
+    """
+
+    MIN_INT_ID = -2**63 + 1
+    MAX_INT_ID = 2**63 - 1
+
+    def __init__(self, ids=(), id_type='int', last_id=None):
+        """
+        :param ids: iterable of record ids, doesn't have to be sorted
+        :param id_type: type of id field
+        :param last_id: highest id that was used by table, default is highest of ids
+        """
+        self.id_type = id_type
+        ids = sorted(set(ids))
+        self.packed = id_type == 'int' and all(self.is_valid_int_id(rid) for rid in ids[:1] + ids[-1:])
+        self.ids = self._new_sequence(ids)
+        self.id_set = set(self.ids)
+        self.last_id = None
+        self._update_last_id(last_id)
+        if len(self.ids) > 0:
+            self._update_last_id(self.ids[-1])
+
+    @classmethod
+    def is_valid_int_id(cls, rid):
+        return cls.MIN_INT_ID <= rid <= cls.MAX_INT_ID
+
+    def _new_sequence(self, ids):
+        return array.array('q', ids) if self.packed else list(ids)
+
+    def _update_last_id(self, rid):
+        if rid is not None and (self.last_id is None or rid > self.last_id):
+            self.last_id = rid
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __contains__(self, rid):
+        return rid in self.id_set
+
+    def __getitem__(self, key):
+        """
+        :return: id or list of ids if key is slice
+        """
+        if isinstance(key, slice):
+            return list(self.ids[key])
+        return self.ids[key]
+
+    def __repr__(self):
+        return 'RecordIds({})'.format(list(self.ids))
+
+    def tolist(self):
+        return list(self.ids)
+
+    # search
+
+    def bisect_left(self, rid):
+        return bisect.bisect_left(self.ids, rid)
+
+    def bisect_right(self, rid):
+        return bisect.bisect_right(self.ids, rid)
+
+    # add/remove
+
+    def add(self, rid):
+        """
+        :return: False if id was already in ids
+        """
+        if rid in self.id_set:
+            return False
+        if len(self.ids) == 0 or rid > self.ids[-1]:
+            self.ids.append(rid)  # new ids are usually highest
+        else:
+            self.ids.insert(bisect.bisect_left(self.ids, rid), rid)
+        self.id_set.add(rid)
+        self._update_last_id(rid)
+        return True
+
+    def update(self, ids):
+        """
+        Adds multiple ids at once.
+        :return: list of ids that were added
+        """
+        new_ids = sorted({rid for rid in ids if rid not in self.id_set})
+        if len(new_ids) == 0:
+            return new_ids
+        if len(self.ids) == 0 or new_ids[0] > self.ids[-1]:
+            self.ids.extend(new_ids)
+        else:
+            self.ids = self._new_sequence(sorted(list(self.ids) + new_ids))
+        self.id_set.update(new_ids)
+        self._update_last_id(new_ids[-1])
+        return new_ids
+
+    def remove(self, rid):
+        """
+        :return: False if id wasn't in ids
+        """
+        if rid not in self.id_set:
+            return False
+        self.id_set.discard(rid)
+        del(self.ids[bisect.bisect_left(self.ids, rid)])
+        return True
+
+    def difference_update(self, ids):
+        """
+        Removes multiple ids at once.
+        :return: list of ids that were removed
+        """
+        removed_ids = [rid for rid in set(ids) if rid in self.id_set]
+        if len(removed_ids) == 0:
+            return removed_ids
+        self.id_set.difference_update(removed_ids)
+        self.ids = self._new_sequence([rid for rid in self.ids if rid in self.id_set])
+        return removed_ids
@@ -0,0 +1,187 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from .exceptions import FsdbError
+
+import json
+import struct
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class JsonSerializer(object):
+    """
+    Human-readable JSON with sorted keys and indentation (original format of data files).
+    """
+
+    name = 'json'
+
+    def dumps(self, data):
+        return json.dumps(data, sort_keys=True, indent=2).encode('utf-8')
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class CompactJsonSerializer(JsonSerializer):
+    """
+    JSON without indentation, whitespace and sorting of keys.
+    """
+
+    name = 'compact_json'
+
+    def dumps(self, data):
+        return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+class BinarySerializer(object):
+    """
+    Binary encoding of JSON compatible values. Every value starts with one byte tag, followed by:
+        N, T, F - nothing (None, True, False)
+        b, h, i, q - 8, 16, 32 or 64-bit signed integer
+        B - decimal digits of integer that doesn't fit into 64 bits, encoded as string
+        f - 64-bit float
+        s, S - 8 or 32-bit length and UTF-8 bytes of string
+        l, L - 8 or 32-bit number of items and items of list (or tuple)
+        d, D - 8 or 32-bit number of items and (key string, value) pairs of dict, keys are encoded as strings
+    Everything is little-endian. Like in JSON, non-string dict keys are converted to strings.
+    """
+
+    name = 'binary'
+    MAGIC = b'\x89FSDB\x01'  # can't be start of JSON document
+
+    INTS = [(b'b', struct.Struct('<b')), (b'h', struct.Struct('<h')), (b'i', struct.Struct('<i')),
+            (b'q', struct.Struct('<q'))]
+    DOUBLE = struct.Struct('<d')
+    SHORT_LENGTH = struct.Struct('<B')
+    LENGTH = struct.Struct('<I')
+
+    def __init__(self):
+        self.int_ranges = [(tag, st, -2**(st.size*8 - 1), 2**(st.size*8 - 1)) for tag, st in self.INTS]
+        self.int_structs = {tag[0]: st for tag, st in self.INTS}
+
+    def dumps(self, data):
+        out = bytearray(self.MAGIC)
+        self._encode(data, out)
+        return bytes(out)
+
+    def loads(self, data):
+        if not data.startswith(self.MAGIC):
+            raise FsdbError('Data are not in binary format!')
+        value, offset = self._decode(memoryview(data), len(self.MAGIC))
+        if offset != len(data):
+            raise FsdbError('Unexpected data after end of binary document!')
+        return value
+
+    def _encode_length(self, short_tag, long_tag, length, out):
+        if length < 256:
+            out += short_tag
+            out += self.SHORT_LENGTH.pack(length)
+        else:
+            out += long_tag
+            out += self.LENGTH.pack(length)
+
+    def _encode_str(self, value, out):
+        value = value.encode('utf-8')
+        self._encode_length(b's', b'S', len(value), out)
+        out += value
+
+    def _encode(self, value, out):
+        if value is None:
+            out += b'N'
+        elif value is True:
+            out += b'T'
+        elif value is False:
+            out += b'F'
+        elif isinstance(value, int):
+            for tag, st, min_value, max_value in self.int_ranges:
+                if min_value <= value < max_value:
+                    out += tag
+                    out += st.pack(value)
+                    break
+            else:
+                out += b'B'
+                self._encode_str(str(value), out)
+        elif isinstance(value, float):
+            out += b'f'
+            out += self.DOUBLE.pack(value)
+        elif isinstance(value, str):
+            self._encode_str(value, out)
+        elif isinstance(value, (list, tuple)):
+            self._encode_length(b'l', b'L', len(value), out)
+            for item in value:
+                self._encode(item, out)
+        elif isinstance(value, dict):
+            self._encode_length(b'd', b'D', len(value), out)
+            for key, item in value.items():
+                self._encode_str(key if isinstance(key, str) else json.dumps(key), out)
+                self._encode(item, out)
+        else:
+            raise TypeError('Object of type {} is not serializable'.format(type(value).__name__))
+
+    def _decode_length(self, tag, data, offset):
+        if tag in b'sld':
+            return data[offset], offset + 1
+        return self.LENGTH.unpack_from(data, offset)[0], offset + self.LENGTH.size
+
+    def _decode(self, data, offset):
+        tag = data[offset]
+        offset += 1
+        if tag == 0x4e:  # N
+            return None, offset
+        elif tag == 0x54:  # T
+            return True, offset
+        elif tag == 0x46:  # F
+            return False, offset
+        elif tag in self.int_structs:  # b, h, i, q
+            st = self.int_structs[tag]
+            return st.unpack_from(data, offset)[0], offset + st.size
+        elif tag == 0x66:  # f
+            return self.DOUBLE.unpack_from(data, offset)[0], offset + self.DOUBLE.size
+        elif tag == 0x73 or tag == 0x53:  # s, S
+            length, offset = self._decode_length(tag, data, offset)
+            return str(data[offset:offset + length], 'utf-8'), offset + length
+        elif tag == 0x42:  # B
+            value, offset = self._decode(data, offset)
+            return int(value), offset
+        elif tag == 0x6c or tag == 0x4c:  # l, L
+            count, offset = self._decode_length(tag, data, offset)
+            value = []
+            for _ in range(count):
+                item, offset = self._decode(data, offset)
+                value.append(item)
+            return value, offset
+        elif tag == 0x64 or tag == 0x44:  # d, D
+            count, offset = self._decode_length(tag, data, offset)
+            value = {}
+            for _ in range(count):
+                key, offset = self._decode(data, offset)
+                value[key], offset = self._decode(data, offset)
+            return value, offset
+        raise FsdbError('Invalid tag "{}" in binary document!'.format(chr(tag)))
+
+
+SERIALIZERS = {serializer.name: serializer for serializer in [
+    JsonSerializer(), CompactJsonSerializer(), BinarySerializer(),
+]}
+DEFAULT_SERIALIZER = JsonSerializer.name
+
+
+def validate_serializer(name):
+    if name not in SERIALIZERS:
+        raise FsdbError('Invalid serializer "{}", valid values are: {}'.format(name, sorted(SERIALIZERS.keys())))
+
+
+def get_serializer(name):
+    validate_serializer(name)
+    return SERIALIZERS[name]
+
+
+def loads(data):
+    """
+    Deserializes data written by any of serializers, format is detected automatically.
+    :param data: bytes
+    """
+    if data.startswith(BinarySerializer.MAGIC):
+        return SERIALIZERS[BinarySerializer.name].loads(data)
+    return json.loads(data)
@@ -1,54 +1,91 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
-from .exceptions import FsdbError, FsdbObjectDeleted, FsdbDatabaseClosed, FsdbOrderError, FsdbDomainError
-from .tools import sanitize_filename, validate_order, validate_domain, evaluate_domain
+from .exceptions import FsdbError, FsdbOrderError
+from .tools import sanitize_filename, validate_order, validate_domain, parse_domain, is_domain_leaf, \
+    compile_domain_tree, iter_parallel, write_file, fsync_dir, validate_durability, is_invalidated, mark_deleted, \
+    mark_closed, DURABILITY_FSYNC_DIR
 from .field import Field
 from .record import Record
+from .index import Index, UniqueIndex
+from .manifest import IdManifest
+from .record_ids import RecordIds
+from .write_buffer import WriteBuffer
+from .serializers import validate_serializer
 
 import os
 import json
 import copy
+import base64
 import shutil
+import heapq
+import bisect
+import weakref
 import datetime
 import logging
+import threading
 
 _logger = logging.getLogger(__name__)
 
 
+class OrderKey(object):
+    """
+    Sort key for orders with mixed directions of fields. Keys must also compare equal, because heapq breaks ties by
+    comparing (key, index) tuples.
+    """
+    __slots__ = ['key', 'reverses']
+
+    def __init__(self, key, reverses):
+        self.key = key
+        self.reverses = reverses
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+    def __lt__(self, other):
+        for value, other_value, reverse in zip(self.key, other.key, self.reverses):
+            if value == other_value:
+                continue
+            return value > other_value if reverse else value < other_value
+        return False
+
+
 class Table(object):
 
     data_fname = sanitize_filename('data.json')
-    database = None
-    _deleted = False
+    dirty_indexes_fname = sanitize_filename('indexes.dirty')  # exists while indexes can be behind record data files
 
     RESERVED_FIELD_NAMES = [data_fname, 'id', 'id_str', 'create_datetime', 'modify_datetime']
+    MIN_RECORDS_PRUNE_SIZE = 1000
+    MIN_PARALLEL_SCAN_SIZE = 1000  # smaller scans are always serial, threads would only add overhead
 
     def __init__(self, name, database):
         self.name = sanitize_filename(name)
         self.database = database
-        self.cache = self.database.cache
+        self.cache = self.database.cache.get_partition(self.name)
         self.db_path = self.database.db_path
 
         self.table_path = os.path.join(self.db_path, self.name)
         self.data_path = os.path.join(self.table_path, self.data_fname)
+        self.dirty_indexes_path = os.path.join(self.table_path, self.dirty_indexes_fname)
 
         self.fields = {}
-        self.record_ids = []  # sorted unless record with custom id vas created
+        self.records = {}  # record id -> WeakSet of live Record objects
+        self.records_lock = threading.Lock()
+        self.records_prune_size = self.MIN_RECORDS_PRUNE_SIZE  # ids without live records are pruned at this size
+        self.record_ids = RecordIds()
+        self.id_manifest = None
+        self.write_buffer = None  # WriteBuffer in write-behind mode
+        self.durability = None  # None = durability of database
+        self.serializer = None  # serializer of record data files, None = serializer of database
+        self.indexes = {}  # field name -> Index
+        self.unique_indexes = {}  # field name -> UniqueIndex (id field uniqueness is given by record folders)
+        self.index_lock = threading.RLock()  # indexes can be saved by flush of write buffer in timer thread
+        self.index_updates = 0  # number of running writes that marked indexes as dirty
 
         if os.path.exists(self.data_path):
             self.load_data()
             self.load_record_ids()
-
-    def __getattribute__(self, name):
-        # check if table is deleted
-        if object.__getattribute__(self, '_deleted'):
-            raise FsdbObjectDeleted('Can\'t access deleted table objects!')
-        # check if database is closed
-        database = object.__getattribute__(self, 'database')
-        if database and object.__getattribute__(database, '_closed'):
-            raise FsdbDatabaseClosed
-        # return attribute
-        return object.__getattribute__(self, name)
+            self.load_indexes()
 
     def save_data(self):
         # validate
@@ -59,10 +96,17 @@ class Table(object):
             'name': self.name,  # just for info
             'fields': [self.fields[name].to_dict() for name in sorted(self.fields.keys())],
         })
+        if self.cache.cache_size is not None:
+            data['cache_size'], data['cache_size_limit'] = self.cache.get_cache_size()
+        if self.durability is not None:
+            data['durability'] = self.durability
+        if self.serializer is not None:
+            data['serializer'] = self.serializer
 
         # write to file
-        with open(self.data_path, 'w') as f:
-            f.write(json.dumps(data, sort_keys=True, indent=2))
+        write_file(self.data_path, json.dumps(data, sort_keys=True, indent=2), self.get_durability())
+        if self.id_manifest is not None:
+            self.id_manifest.touch()
 
     def load_data(self):
         # load from file
@@ -73,6 +117,9 @@ class Table(object):
         self.fields = {}
         for field_data in data['fields']:
             self.fields[field_data['name']] = Field.from_dict(self, field_data)
+        self.cache.set_cache_size(data.get('cache_size'), data.get('cache_size_limit'))
+        self.durability = data.get('durability')
+        self.serializer = data.get('serializer')
 
         # validate
         self.validate()
@@ -87,28 +134,343 @@ class Table(object):
         if 'modify_datetime' not in self.fields:
             raise FsdbError('Table "{}" is missing "modify_datetime" field!')
 
+    def set_cache_size(self, cache_size, cache_size_limit=None):
+        """
+        Sets size limits of table cache partition. If cache_size is None, table records are limited only by
+        cache size of database.
+        """
+        self.cache.set_cache_size(cache_size, cache_size_limit)
+        self.save_data()
+
+    def set_durability(self, durability):
+        """
+        Sets durability of writes to table files (see DURABILITY_MODES in tools), None for durability of database.
+        """
+        if durability is not None:
+            validate_durability(durability)
+        self.durability = durability
+        self.save_data()
+
+    def get_durability(self):
+        return self.durability if self.durability is not None else self.database.durability
+
+    def sync_table_dir(self):
+        """
+        Syncs table folder to disk in fsync_dir durability mode, used after record folders are created or removed.
+        """
+        if self.get_durability() == DURABILITY_FSYNC_DIR:
+            fsync_dir(self.table_path)
+
+    def set_serializer(self, serializer):
+        """
+        Sets format of record data files (see SERIALIZERS in serializers), None for serializer of database. Existing
+        records are converted when they are written.
+        """
+        if serializer is not None:
+            validate_serializer(serializer)
+        self.serializer = serializer
+        self.save_data()
+
+    def get_serializer(self):
+        return self.serializer if self.serializer is not None else self.database.serializer
+
+    def set_write_behind(self, enabled=True, max_records=1000, max_delay=1.0):
+        """
+        Enables/disables write-behind mode, in which changes of record data files are buffered in memory and
+        written in groups. Buffered data are written when there is max_records records in buffer, max_delay
+        seconds after first buffered change, on flush() or when database is closed.
+        """
+        if self.write_buffer is not None:
+            self.write_buffer.flush()
+        self.write_buffer = WriteBuffer(self, max_records=max_records, max_delay=max_delay) if enabled else None
+
+    def flush(self):
+        """
+        Writes changes buffered in write-behind mode.
+        :return: number of written records
+        """
+        return self.write_buffer.flush() if self.write_buffer is not None else 0
+
     def load_record_ids(self):
-        self.record_ids = []
-        for id_str in os.listdir(self.table_path):
-            # check if folder is valid record, if not delete it
-            record_path = os.path.join(self.table_path, id_str)
-            data_path = os.path.join(self.table_path, id_str, Record.data_fname)
-            if not os.path.isdir(record_path):
-                continue
-            if not os.path.isfile(data_path) or not os.path.exists(data_path):
-                shutil.rmtree(record_path)
-                continue
-            # parse id and add to list of ids
-            id = self.fields['id'].str2val(id_str)
-            self.record_ids.append(id)
-        self.record_ids.sort()
+        """
+        Loads record ids from id manifest. If manifest is stale, ids are loaded from record folders and highest id
+        ever used is kept from header of stale manifest, so that ids of deleted records are not reused.
+        """
+        self.id_manifest = IdManifest(self)
+        self.record_ids = self.id_manifest.load()
+        if self.record_ids is None:
+            self.record_ids = RecordIds(self.scan_record_ids(), self.fields['id'].type,
+                                        self.id_manifest.load_last_id())
+            self.id_manifest.save()
+        elif self.id_manifest.removed:
+            self.id_manifest.save()  # compact tombstones of removed records
 
         return self.record_ids
 
+    def scan_record_ids(self):
+        _logger.info('SCAN RECORD IDS OF TABLE "{}"'.format(self.name))
+        record_ids = []
+        id_field = self.fields['id']
+        with os.scandir(self.table_path) as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    continue
+                # check if folder is valid record, if not delete it
+                if not os.path.isfile(os.path.join(entry.path, Record.data_fname)):
+                    shutil.rmtree(entry.path)
+                    continue
+                # parse id and add to list of ids
+                record_ids.append(id_field.str2val(entry.name))
+        return record_ids
+
+    # indexes
+
+    def load_indexes(self):
+        """
+        Loads indexes, they are rebuilt if process crashed while write buffer was being flushed.
+        """
+        self.indexes = {}
+        self.unique_indexes = {}
+        for name, field in self.fields.items():
+            if field.index:
+                self.indexes[name] = Index(self, name)
+            if field.unique and name != 'id':
+                if field.type not in Field.INDEX_TYPES:  # field created by older version
+                    _logger.warning('Unique field "{}" of table "{}" with type "{}" can\'t be indexed, its '
+                                    'uniqueness is not checked!'.format(name, self.name, field.type))
+                    continue
+                self.unique_indexes[name] = UniqueIndex(self, name)
+
+        dirty = os.path.exists(self.dirty_indexes_path)
+        replaced = dirty
+        for index in self.get_indexes():
+            if dirty:
+                index.rebuild()
+            else:
+                replaced = index.load() or replaced
+        if dirty:
+            os.remove(self.dirty_indexes_path)
+        if replaced:
+            self.id_manifest.touch()
+        return self.indexes
+
+    def get_indexes(self):
+        """
+        :return: list of all indexes and unique indexes
+        """
+        return list(self.indexes.values()) + list(self.unique_indexes.values())
+
+    def index_record(self, rid, values):
+        """
+        Updates indexes of fields that are in values.
+        :param rid: record id
+        :param values: {field_name: value, ...}
+        """
+        self.index_records([(rid, values), ])
+
+    def index_records(self, ids_values):
+        """
+        Updates indexes of multiple records, changes of every index are appended to its journal at once.
+        :param ids_values: list of (record id, {field_name: value, ...})
+        """
+        with self.index_lock:
+            for index in self.get_indexes():
+                for rid, values in ids_values:
+                    if index.field.name in values:
+                        index.update(rid, values[index.field.name])
+        self.save_indexes()
+
+    def unindex_record(self, rid):
+        self.unindex_records([rid, ])
+
+    def unindex_records(self, ids):
+        with self.index_lock:
+            for index in self.get_indexes():
+                for rid in ids:
+                    index.delete(rid)
+        self.save_indexes()
+
+    def save_indexes(self):
+        """
+        Saves logged changes of indexes. In write-behind mode, changes are saved when write buffer is flushed, after
+        buffered data files, so that index files are never ahead of record data files.
+        """
+        write_buffer = self.write_buffer
+        if write_buffer is None:
+            return self.flush_indexes()
+        with write_buffer.lock:
+            if len(write_buffer) == 0:
+                self.flush_indexes()
+
+    def flush_indexes(self):
+        """
+        Saves logged changes of indexes immediately.
+        """
+        with self.index_lock:
+            replaced = False
+            for index in self.get_indexes():
+                replaced = index.save_changes() or replaced
+            if replaced:
+                self.id_manifest.touch()
+
+    def has_index_changes(self):
+        return any(index.changes for index in self.get_indexes())
+
+    def set_indexes_dirty(self, dirty):
+        """
+        Creates or removes file that marks indexes as possibly not matching record data files. Indexes are rebuilt
+        on load if the file exists.
+        """
+        if dirty:
+            open(self.dirty_indexes_path, 'w').close()
+        elif os.path.exists(self.dirty_indexes_path):
+            os.remove(self.dirty_indexes_path)
+        self.id_manifest.touch()
+
+    def begin_index_update(self, field_names):
+        """
+        Marks indexes as dirty before record data files with values of indexed fields are written, so that indexes are
+        rebuilt on load if process crashes before their changes are saved. In write-behind mode, indexes are marked by
+        flush of write buffer.
+        :param field_names: names of written fields
+        :return: True if indexes were marked, end_index_update() must be called after indexes are updated
+        """
+        if self.write_buffer is not None or not any(index.field.name in field_names for index in self.get_indexes()):
+            return False
+        with self.index_lock:
+            if self.index_updates == 0:
+                self.set_indexes_dirty(True)
+            self.index_updates += 1
+        return True
+
+    def end_index_update(self):
+        """
+        Removes dirty mark of indexes when all writes that marked them updated indexes. Writes that failed before
+        indexes were updated don't call it, so indexes stay marked and are rebuilt on next load.
+        """
+        with self.index_lock:
+            self.index_updates -= 1
+            if self.index_updates == 0:
+                self.set_indexes_dirty(False)
+
+    def check_values(self, values, rid=None):
+        """
+        Checks that id of new record is in valid range, that values don't break required and unique constraints of
+        fields and that they can be indexed.
+        :param values: {field_name: value, ...} - all values of new record or changed values of existing record
+        :param rid: id of record that is being changed, None if values are for new record
+        """
+        if rid is None and self.fields['id'].type == 'int' and isinstance(values.get('id'), int) and \
+                not RecordIds.is_valid_int_id(values['id']):
+            raise FsdbError('ID "{}" in table "{}" is out of range of 64-bit integers!'.format(values['id'], self.name))
+
+        for name, field in self.fields.items():
+            if field.required and name in values and values[name] is None:
+                raise FsdbError('Field "{}" in table "{}" is required!'.format(name, self.name))
+
+        for name, index in list(self.indexes.items()) + list(self.unique_indexes.items()):
+            if name in values:
+                index.check_value(values[name])
+
+        for name, index in self.unique_indexes.items():
+            if name not in values:
+                continue
+            found_id = index.get_id(values[name])
+            if found_id is not None and found_id != rid:
+                raise FsdbError('Value "{}" of field "{}" in table "{}" must be unique!'.format(
+                    values[name], name, self.name))
+
+    def search_indexes(self, domain_tree):
+        """
+        :param domain_tree: parsed domain
+        :return: (ids, exact) - ids is set of ids that contains all records matching domain or None if index can't
+            be used to narrow down the search, exact is True if ids contain only records matching domain
+        """
+        if is_domain_leaf(domain_tree):
+            dom_field, dom_eq, dom_value = domain_tree
+            if dom_field == 'id':
+                ids = self.search_ids(dom_eq, dom_value)
+            elif dom_field in self.indexes:
+                ids = self.indexes[dom_field].search(dom_eq, dom_value)
+            else:
+                ids = None
+            return ids, ids is not None
+
+        op, left, right = domain_tree
+        left_ids, left_exact = self.search_indexes(left)
+        right_ids, right_exact = self.search_indexes(right)
+        exact = left_exact and right_exact
+
+        if op == '&':
+            if left_ids is None:
+                return right_ids, exact
+            if right_ids is None:
+                return left_ids, exact
+            return left_ids & right_ids, exact
+        else:
+            if left_ids is None or right_ids is None:
+                return None, False
+            return left_ids | right_ids, exact
+
+    def search_ids(self, operator, value):
+        """
+        Evaluates domain on record ids, without reading records.
+        :param operator: domain operator
+        :param value: domain value
+        :return: set of ids that match ('id', operator, value) domain or None if ids can't be searched
+        """
+        try:
+            if operator == '=':
+                return {value} if self.has_id(value) else set()
+            elif operator == '!=':
+                return set(self.record_ids) - {value}
+            elif operator == 'in':
+                return {rid for rid in value if self.has_id(rid)}
+            elif operator == 'not in':
+                return set(self.record_ids).difference(value)
+            elif operator == '>':
+                return set(self.record_ids[self.record_ids.bisect_right(value):])
+            elif operator == '>=':
+                return set(self.record_ids[self.record_ids.bisect_left(value):])
+            elif operator == '<':
+                return set(self.record_ids[:self.record_ids.bisect_left(value)])
+            elif operator == '<=':
+                return set(self.record_ids[:self.record_ids.bisect_right(value)])
+        except TypeError:
+            pass  # value is not comparable with ids
+        return None
+
+    def has_id(self, rid):
+        return rid in self.record_ids
+
+    def get_new_ids(self, count, used_ids=()):
+        """
+        Allocates range of new ids at once.
+        :param count: number of ids
+        :param used_ids: ids that are going to be used, but are not in table yet
+        """
+        if self.fields['id'].type == 'int':
+            last_value = max([self.record_ids.last_id or 0] + list(used_ids))
+            return list(range(last_value + 1, last_value + 1 + count))
+
+        elif self.fields['id'].type == 'datetime':
+            # datetime ids must be unique even if they are generated in the same microsecond
+            used_ids = set(used_ids)
+            new_ids = []
+            new_id = datetime.datetime.utcnow()
+            while len(new_ids) < count:
+                if new_id not in used_ids and new_id not in self.record_ids:
+                    new_ids.append(new_id)
+                new_id += datetime.timedelta(microseconds=1)
+            return new_ids
+
+        else:
+            raise FsdbError('Unable to generate new ID for table "{}"!'.format(self.name))
+
     def get_new_id(self):
 
         if self.fields['id'].type == 'int':
-            last_value = max(self.record_ids) if len(self.record_ids) > 0 else 0
+            last_value = self.record_ids.last_id if self.record_ids.last_id is not None else 0
             next_value = last_value + 1
             return int(next_value)
 
@@ -134,6 +496,187 @@ class Table(object):
         else:
             return id_field.str2val(ids_str)
 
+    # records - create
+
+    def create_records(self, values_list, return_ids=False, workers=None):
+        """
+        Creates multiple records at once. All values are validated before anything is written, record ids and
+        indexes are updated once at the end. If writing of any record fails, all new records are removed.
+        :param values_list: list of values of new records
+        :param return_ids: if True, ids of records are returned instead of Record objects
+        :param workers: number of threads used to write records, None or 1 for serial write
+        :return: list of records or ids, in order of values_list
+        """
+        _logger.info('CREATE {} RECORDS IN TABLE "{}"'.format(len(values_list), self.name))
+        values_list = [dict(values) for values in values_list]
+
+        # get/generate record ids
+        used_ids = [values['id'] for values in values_list if values.get('id') is not None]
+        new_ids = iter(self.get_new_ids(len(values_list) - len(used_ids), used_ids))
+        for values in values_list:
+            if values.get('id') is None:
+                values['id'] = next(new_ids)
+
+        # init values of system fields and default values
+        create_datetime = datetime.datetime.utcnow()
+        for values in values_list:
+            Record.init_values(self, values, create_datetime)
+
+        # check ids, required and unique fields (also between new records)
+        batch_values = {name: set() for name in ['id', ] + list(self.unique_indexes.keys())}
+        for values in values_list:
+            if values['id'] in self.record_ids or values['id'] in batch_values['id']:
+                raise FsdbError('ID must be unique!')
+            self.check_values(values)
+            for name, batch_name_values in batch_values.items():
+                if values[name] is None:
+                    continue
+                if values[name] in batch_name_values:
+                    raise FsdbError('Value "{}" of field "{}" in table "{}" must be unique!'.format(
+                        values[name], name, self.name))
+                batch_name_values.add(values[name])
+
+        # create record directories and save values
+        records = [Record(values['id'], self) for values in values_list]
+        saved_records = []
+
+        def save_record(record_values):
+            record_values[0].save_new(record_values[1])
+            saved_records.append(record_values[0])
+
+        try:
+            if workers and workers > 1:
+                for _ in iter_parallel(save_record, zip(records, values_list), workers):
+                    pass
+            else:
+                for record_values in zip(records, values_list):
+                    save_record(record_values)
+        except Exception:
+            blob_store = self.database.get_blob_store()
+            blob_digests = []
+            for record in saved_records:
+                if blob_store is not None:
+                    blob_digests.extend(record.get_blob_digests())
+                shutil.rmtree(record.record_path)
+            if blob_digests:
+                blob_store.release(blob_digests)
+            raise
+
+        # add records to table record ids and indexes
+        self.id_manifest.extend(self.record_ids.update([record.id for record in records]))
+        self.index_records([(values['id'], values) for values in values_list])
+
+        if return_ids:
+            return [record.id for record in records]
+        return records
+
+    # records - write/delete
+
+    def write_records(self, values, domain=None, workers=None):
+        """
+        Writes the same values to all records that match domain. Values are checked once, cache entries of records
+        are invalidated and indexes are updated once for all records.
+        :param values: {field_name: value, ...}
+        :param domain: search domain
+        :param workers: number of threads used to write records, None or 1 for serial write
+        :return: number of written records
+        """
+        _logger.info('UPDATE RECORDS IN TABLE "{}" WHERE {} SET values={}'.format(self.name, domain, values))
+        values = Record.filter_write_values(self, dict(values))
+        records = self.search_records(domain)
+        if len(records) == 0:
+            return 0
+
+        # check required and unique fields, unique values and file data that can be read only once can't be written
+        # to multiple records
+        if len(records) > 1:
+            for name in self.unique_indexes:
+                if values.get(name) is not None:
+                    raise FsdbError('Value "{}" of field "{}" in table "{}" must be unique!'.format(
+                        values[name], name, self.name))
+            for name, value in values.items():
+                if self.fields[name].has_stream_data(value):
+                    raise FsdbError('File data of field "{}" in table "{}" can be read only once, it can\'t be '
+                                    'written to multiple records!'.format(name, self.name))
+        self.check_values(values, records[0].id if len(records) == 1 else None)
+
+        # save values, indexes are marked as dirty until they are updated
+        values['modify_datetime'] = datetime.datetime.utcnow()
+        saved_records = []
+        indexes_dirty = self.begin_index_update(values)
+
+        def save_record(record):
+            record.save_values(values)
+            saved_records.append(record)
+
+        try:
+            if workers and workers > 1:
+                for _ in iter_parallel(save_record, records, workers):
+                    pass
+            else:
+                for record in records:
+                    save_record(record)
+        finally:
+            self.cache.del_cache_many([record.cache_key for record in records])
+            # update table indexes, also if writing of some records failed
+            self.index_records([(record.id, values) for record in saved_records])
+            if indexes_dirty:
+                self.end_index_update()
+
+        return len(records)
+
+    def delete_records(self, domain=None, workers=None):
+        """
+        Deletes all records that match domain. Record ids, cache and indexes are updated once for all records.
+        :param domain: search domain
+        :param workers: number of threads used to delete record folders, None or 1 for serial delete
+        :return: number of deleted records
+        """
+        _logger.info('DELETE RECORDS IN TABLE "{}" WHERE {}'.format(self.name, domain))
+        records = self.search_records(domain)
+        if len(records) == 0:
+            return 0
+
+        # remove from cache and write buffer, blobs are collected first, so that buffered files are included
+        self.cache.del_cache_many([record.cache_key for record in records])
+        blob_store = self.database.get_blob_store()
+        blob_digests = {}
+        if blob_store is not None:
+            for record in records:
+                blob_digests[record.id] = record.get_blob_digests()
+        if self.write_buffer is not None:
+            self.write_buffer.discard([record.id for record in records])
+
+        # delete data, table list of ids and indexes are updated only for records whose folders were removed
+        deleted_ids = []
+
+        def delete_record(record):
+            if os.path.exists(record.record_path):
+                shutil.rmtree(record.record_path)
+            deleted_ids.append(record.id)
+
+        try:
+            if workers and workers > 1:
+                for _ in iter_parallel(delete_record, records, workers):
+                    pass
+            else:
+                for record in records:
+                    delete_record(record)
+        finally:
+            if deleted_ids:
+                self.sync_table_dir()
+                self.record_ids.difference_update(deleted_ids)
+                self.unindex_records(deleted_ids)
+                self.id_manifest.save()
+                # blobs that were used only by deleted records are removed
+                digests = [digest for rid in deleted_ids for digest in blob_digests.get(rid, [])]
+                if digests:
+                    blob_store.release(digests)
+                # mark objects as deleted
+                self.mark_records_deleted(deleted_ids)
+
+        return len(deleted_ids)
+
     # records - browse/search
 
     def browse_records(self, ids):
@@ -142,92 +685,219 @@ class Table(object):
         else:
             return Record(ids, self) if ids in self.record_ids else None
 
-    def search_records(self, domain=None, order=None, limit=None):
+    def search_records(self, domain=None, order=None, limit=None, offset=0, cursor=None, workers=None,
+                       chunk_size=None):
+        return list(self.iter_records(domain=domain, order=order, limit=limit, offset=offset, cursor=cursor,
+                                      workers=workers, chunk_size=chunk_size))
+
+    def iter_records(self, domain=None, order=None, limit=None, offset=0, cursor=None, workers=None,
+                     chunk_size=None):
+        """
+        Yields records that match domain. Without order, records are read lazily in order of ids.
+        :param domain: search domain
+        :param order: order string, e.g. "name asc, create_datetime desc"
+        :param limit: max number of returned records
+        :param offset: number of matching records to skip
+        :param cursor: token returned by get_cursor(), only records after record of cursor are returned
+        :param workers: number of threads used to read and filter records, None or 1 for serial scan. Threads help
+            only I/O-bound scans (cold cache, network filesystem), parsing of data files holds GIL, so scan of files
+            in page cache is slower with threads. Scans of less than MIN_PARALLEL_SCAN_SIZE records are serial.
+        :param chunk_size: number of records read by threads at once (default is workers*4)
+        """
         domain = domain if domain else []
         limit = limit if (limit and limit >= 0) else None
+        offset = offset if (offset and offset > 0) else 0
+        order_by = self.parse_order(order) if order else []
 
-        # if empty domain return all records
-        if len(domain) == 0:
-            records = [Record(rid, self) for rid in self.record_ids[:limit]]
-
-        # filter record ids with domain
-        else:
+        # use indexes to get records that can match domain, compile the rest of domain
+        record_ids = self.record_ids
+        predicate, predicate_field_names = None, set()
+        if len(domain) > 0:
             validate_domain(domain, self.fields.keys())
-            records = []
-            for rid in self.record_ids:
-                record = Record(rid, self)
-
-                domain_processed = []
-                for dom in domain:
-                    # & or |
-                    if isinstance(dom, str):
-                        domain_processed.append(dom)
-                        continue
-
-                    # get sub-domain
-                    dom_field, dom_eq, dom_value = tuple(dom)
-
-                    # get field value
-                    if dom_field == 'id':
-                        field_value = rid
-                    else:
-                        field_value = record.read([dom_field, ])[dom_field]
-
-                    # filter record by sub-domain
-                    if dom_eq == '=':
-                        domain_processed.append(field_value == dom_value)
-                    elif dom_eq == '!=':
-                        domain_processed.append(field_value != dom_value)
-                    elif dom_eq == 'in':
-                        domain_processed.append(field_value in dom_value)
-                    elif dom_eq == 'not in':
-                        domain_processed.append(field_value not in dom_value)
-                    elif dom_eq == '>':
-                        domain_processed.append(field_value > dom_value)
-                    elif dom_eq == '>=':
-                        domain_processed.append(field_value >= dom_value)
-                    elif dom_eq == '<':
-                        domain_processed.append(field_value < dom_value)
-                    elif dom_eq == '<=':
-                        domain_processed.append(field_value <= dom_value)
-                    else:
-                        raise FsdbDomainError(domain)
-
-                # evaluate processed domain
-                result = evaluate_domain(domain_processed)
-
-                # evaluate result
-                if result:
-                    records.append(record)
-                    if limit is not None and len(records) >= limit:
-                        break
+            domain_tree = parse_domain(domain)
+            index_ids, index_exact = self.search_indexes(domain_tree)
+            if index_ids is not None:
+                record_ids = sorted(index_ids)
+            if not index_exact:
+                predicate, predicate_field_names = compile_domain_tree(domain_tree)
+
+        # parse cursor
+        cursor_id, cursor_key = self.parse_cursor(cursor, order_by) if cursor else (None, None)
+        if cursor is not None and not order_by:
+            record_ids = record_ids[bisect.bisect_right(record_ids, cursor_id):]
+        elif record_ids is self.record_ids:
+            record_ids = record_ids.tolist()  # table can be changed while records are yielded
+
+        # return records without reading them
+        if predicate is None and not order_by:
+            for rid in record_ids[offset:(offset + limit) if limit is not None else None]:
+                yield Record(rid, self)
+            return
+
+        # read values needed to evaluate domain and order records, filter records with domain
+        read_field_names = sorted((set(predicate_field_names) | {name for name, _ in order_by}) - {'id'})
+
+        def read_record(rid):
+            record = Record(rid, self)
+            values = record.read(list(read_field_names)) if read_field_names else {}
+            values['id'] = rid
+            return record, values, predicate is None or predicate(values)
+
+        if workers and workers > 1 and len(record_ids) >= self.MIN_PARALLEL_SCAN_SIZE:
+            scanned_records = iter_parallel(read_record, record_ids, workers, chunk_size)
+        else:
+            scanned_records = (read_record(rid) for rid in record_ids)
+
+        records_values = []
+        count = 0
+        try:
+            for record, values, matched in scanned_records:
+                if not matched:
+                    continue
+
+                # ordered records must be sorted before they are returned
+                if order_by:
+                    if cursor is None or self.is_after_cursor(values, order_by, cursor_id, cursor_key):
+                        records_values.append((record, values))
+                    continue
+
+                if offset > 0:
+                    offset -= 1
+                    continue
+                yield record
+                count += 1
+                if limit is not None and count >= limit:
+                    return
+        finally:
+            scanned_records.close()  # stop reading of records
 
         # sort records
-        if order:
-            validate_order(order)
-            for o in reversed(order.split(',')):
-                name = o.strip().split(' ')[0]
-                reverse = o.strip().split(' ')[-1].lower() == 'desc'
-                if name not in self.fields:
-                    raise FsdbOrderError('Invalid field name "{}"!'.format(name))
-
-                if self.fields[name].type == 'str':
-                    records.sort(key=lambda x: str(x.read([name])[name]).lower(), reverse=reverse)
-                else:
-                    records.sort(key=lambda x: x.read([name])[name], reverse=reverse)
-
-        # return records
-        return records
+        if order_by:
+            records_values = self.sort_records_values(
+                records_values, order_by, (limit + offset) if limit is not None else None)
+            for record, _ in records_values[offset:]:
+                yield record
+
+    # records - cursor
+
+    def get_cursor(self, record, order=None):
+        """
+        :param record: last record of page
+        :param order: order string that was used to search records
+        :return: token that can be used to continue search after record
+        """
+        order_by = self.parse_order(order) if order else []
+        order_field_names = [name for name, _ in order_by]
+        values = record.read([name for name in order_field_names if name != 'id'])
+        values['id'] = record.id
+
+        data = {
+            'id': record.id_str,
+            'order': [[name, reverse] for name, reverse in order_by],
+            'values': [self.fields[name].val2json(values[name]) for name in order_field_names],
+        }
+        return base64.urlsafe_b64encode(json.dumps(data).encode('utf-8')).decode('ascii')
+
+    def parse_cursor(self, cursor, order_by):
+        """
+        :param cursor: token returned by get_cursor()
+        :param order_by: parsed order of search
+        :return: (record id, order key) of cursor record
+        """
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+            cursor_id = self.str2ids(data['id'])
+            cursor_order_by = [(name, reverse) for name, reverse in data['order']]
+            values = {name: self.fields[name].json2val(value)
+                      for (name, _), value in zip(cursor_order_by, data['values'])}
+        except (ValueError, KeyError, TypeError, AttributeError):
+            raise FsdbError('Invalid cursor!')
+        if cursor_order_by != order_by:
+            raise FsdbError('Cursor was created for different order!')
+        return cursor_id, self.get_order_key(values, order_by)
+
+    def is_after_cursor(self, values, order_by, cursor_id, cursor_key):
+        key = self.get_order_key(values, order_by)
+        for value, cursor_value, (_, reverse) in zip(key, cursor_key, order_by):
+            if value == cursor_value:
+                continue
+            return value < cursor_value if reverse else value > cursor_value
+        return values['id'] > cursor_id  # records with same order key are ordered by ids
+
+    def parse_order(self, order):
+        """
+        :param order: order string, e.g. "name asc, create_datetime desc"
+        :return: [(field_name, reverse), ...]
+        """
+        validate_order(order)
+        order_by = []
+        for o in order.split(','):
+            name = o.strip().split(' ')[0]
+            reverse = o.strip().split(' ')[-1].lower() == 'desc'
+            if name not in self.fields:
+                raise FsdbOrderError('Invalid field name "{}"!'.format(name))
+            order_by.append((name, reverse))
+        return order_by
+
+    def get_order_key(self, values, order_by):
+        """
+        :param values: {field_name: value, ...}
+        :param order_by: parsed order
+        :return: tuple that can be compared with other keys (None values are lower then any other value)
+        """
+        key = []
+        for name, _ in order_by:
+            value = values[name]
+            if value is None:
+                key.append((0, ))
+            elif self.fields[name].type == 'str':
+                key.append((1, str(value).casefold()))
+            else:
+                key.append((1, value))
+        return tuple(key)
+
+    def sort_records_values(self, records_values, order_by, limit=None):
+        """
+        Sorts records with heap, if only top records are needed. Sort is stable.
+        :param records_values: [(record, values), ...] - values must contain all fields from order_by
+        :param order_by: parsed order
+        :param limit: number of top records to return
+        :return: sorted records_values
+        """
+        keys = [self.get_order_key(values, order_by) for _, values in records_values]
+        positions = range(len(records_values))
+
+        # same direction of all fields -> compare key tuples directly
+        reverse = order_by[0][1]
+        if all(r == reverse for _, r in order_by):
+            if limit is None:
+                positions = sorted(positions, key=keys.__getitem__, reverse=reverse)
+            elif reverse:
+                positions = heapq.nlargest(limit, positions, key=keys.__getitem__)
+            else:
+                positions = heapq.nsmallest(limit, positions, key=keys.__getitem__)
+
+        # mixed directions -> compare keys field by field
+        else:
+            reverses = [r for _, r in order_by]
+            key_func = lambda pos: OrderKey(keys[pos], reverses)
+            if limit is None:
+                positions = sorted(positions, key=key_func)
+            else:
+                positions = heapq.nsmallest(limit, positions, key=key_func)
+
+        return [records_values[pos] for pos in positions]
 
     # create/delete
 
     @classmethod
-    def create(cls, database, name, fields):
+    def create(cls, database, name, fields, cache_size=None, cache_size_limit=None, durability=None,
+               serializer=None):
         _logger.info('CREATE TABLE "{}" SET fields={}'.format(name, fields))
 
         # get valid table name
         table_name = sanitize_filename(name)
-        if table_name != name:
+        if table_name != name or table_name.startswith('.'):
             raise FsdbError('Name "{}" is not valid table name!'.format(name))
 
         # detect if table already exists
@@ -257,8 +927,18 @@ class Table(object):
         obj = cls(table_name, database)
         obj.fields = {}
         for field_data in fields:
-            obj.fields[field_data['name']] = Field.from_dict(obj, field_data)
+            field = obj.fields[field_data['name']] = Field.from_dict(obj, field_data)
+            if field.unique and field.type not in Field.INDEX_TYPES:
+                raise FsdbError('Field "{}" of table "{}" with type "{}" can\'t be unique!'.format(
+                    field.name, table_name, field.type))
         obj.validate()
+        obj.cache.set_cache_size(cache_size, cache_size_limit)
+        if durability is not None:
+            validate_durability(durability)
+        obj.durability = durability
+        if serializer is not None:
+            validate_serializer(serializer)
+        obj.serializer = serializer
 
         # create table folder and save data
         os.makedirs(obj.table_path)
@@ -267,6 +947,7 @@ class Table(object):
         # load data and record ids (should be instant, since it's a new table)
         obj.load_data()
         obj.load_record_ids()
+        obj.load_indexes()
 
         # add to database list of tables
         database.tables[obj.name] = obj
@@ -275,10 +956,60 @@ class Table(object):
 
     def delete(self):
         _logger.info('DELETE TABLE "{}"'.format(self.name))
-        # delete cached records
-        self.cache.clear()
+        # delete cached and buffered records
+        self.database.cache.del_partition(self.name)
+        if self.write_buffer is not None:
+            self.write_buffer.clear()
+        # remove from database list of tables
+        self.database.tables.pop(self.name, None)
         # delete data
         if os.path.exists(self.table_path):
             shutil.rmtree(self.table_path)
-        # mark object as deleted
-        self._deleted = True
+        # mark table, fields and records as deleted
+        self.invalidate(mark_deleted)
+
+    def close(self):
+        """
+        Marks table, fields and records as closed, buffered data must be flushed before.
+        """
+        self.invalidate(mark_closed)
+
+    # live objects
+
+    def add_live_record(self, record):
+        with self.records_lock:
+            records = self.records.get(record.id)
+            if records is None:
+                if len(self.records) >= self.records_prune_size:
+                    self.records = {rid: records for rid, records in self.records.items() if records}
+                    self.records_prune_size = max(self.MIN_RECORDS_PRUNE_SIZE, len(self.records) * 2)
+                records = self.records[record.id] = weakref.WeakSet()
+            records.add(record)
+
+    def get_live_records(self, ids=None):
+        """
+        :param ids: record ids, None for all records
+        :return: list of Record objects of this table that are still referenced
+        """
+        with self.records_lock:
+            if ids is None:
+                return [record for records in self.records.values() for record in records]
+            return [record for rid in ids for record in self.records.get(rid, ())]
+
+    def mark_records_deleted(self, ids):
+        """
+        Marks all live objects of records as deleted.
+        """
+        for record in self.get_live_records(ids):
+            if not is_invalidated(record):
+                mark_deleted(record)
+
+    def invalidate(self, mark):
+        """
+        :param mark: mark_deleted or mark_closed
+        """
+        for record in self.get_live_records():
+            mark(record)
+        for field in self.fields.values():
+            mark(field)
+        mark(self)
@@ -1,10 +1,16 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
-from .exceptions import FsdbOrderError, FsdbDomainError
+from .exceptions import FsdbError, FsdbOrderError, FsdbDomainError, FsdbObjectDeleted, FsdbDatabaseClosed
 
+import os
 import re
 import copy
+import hashlib
+import threading
+import itertools
 import mimetypes
+import collections
+import concurrent.futures
 
 
 def sanitize_filename(filename):
@@ -20,6 +26,235 @@ def guess_mimetype(path):
     return mime
 
 
+# classes of invalidated objects: (class, exception class) -> subclass that raises on attribute access
+_invalid_classes = {}
+_invalid_classes_lock = threading.Lock()
+
+
+def _get_invalid_class(cls, exception_cls, message):
+    with _invalid_classes_lock:
+        key = (cls, exception_cls)
+        if key not in _invalid_classes:
+            def __getattribute__(self, name):
+                raise exception_cls(message)
+
+            _invalid_classes[key] = type(cls.__name__, (cls, ), {
+                '__slots__': (),  # same memory layout as cls, needed for __class__ assignment
+                '__module__': cls.__module__,
+                '__getattribute__': __getattribute__,
+            })
+        return _invalid_classes[key]
+
+
+def is_invalidated(obj):
+    return type(obj) in _invalid_classes.values()
+
+
+def invalidate(obj, exception_cls, message=None):
+    """
+    Makes every following attribute access of object raise exception. This is done by changing class of object to
+    subclass that overrides __getattribute__, so that access to valid objects doesn't have any overhead.
+    Objects that are already invalidated are not changed (first reason is kept).
+    """
+    if is_invalidated(obj):
+        return
+    obj.__class__ = _get_invalid_class(type(obj), exception_cls, message)
+
+
+def mark_deleted(obj):
+    invalidate(obj, FsdbObjectDeleted, 'Can\'t access deleted {} objects!'.format(type(obj).__name__.lower()))
+
+
+def mark_closed(obj):
+    invalidate(obj, FsdbDatabaseClosed)
+
+
+DURABILITY_NONE = 'none'  # file is replaced atomically, but it's not synced to disk
+DURABILITY_FSYNC = 'fsync'  # file is synced to disk before it replaces old file
+DURABILITY_FSYNC_DIR = 'fsync_dir'  # file and directory entry are synced to disk
+DURABILITY_MODES = [DURABILITY_NONE, DURABILITY_FSYNC, DURABILITY_FSYNC_DIR]
+
+
+def validate_durability(durability):
+    if durability not in DURABILITY_MODES:
+        raise FsdbError('Invalid durability "{}", valid values are: {}'.format(durability, DURABILITY_MODES))
+
+
+def fsync_dir(dir_path):
+    fd = os.open(dir_path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+FILE_CHUNK_SIZE = 1024 * 1024
+
+
+def is_file_data(data):
+    """
+    :return: True if data can be written to file field (see iter_chunks)
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)) or hasattr(data, 'read'):
+        return True
+    return hasattr(data, '__iter__') and not isinstance(data, (str, dict))
+
+
+def iter_chunks(data, chunk_size=FILE_CHUNK_SIZE):
+    """
+    Yields data in chunks, so that it doesn't have to be in memory at once.
+    :param data: bytes-like object, file-like object opened in binary mode or iterable of bytes-like chunks
+    :param chunk_size: size of chunks read from file-like objects
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        yield data
+    elif hasattr(data, 'read'):
+        while True:
+            chunk = data.read(chunk_size)
+            if not chunk:
+                break
+            if not isinstance(chunk, (bytes, bytearray, memoryview)):
+                raise FsdbError('File object must be opened in binary mode!')
+            yield chunk
+    else:
+        for chunk in data:
+            if not isinstance(chunk, (bytes, bytearray, memoryview)):
+                raise FsdbError('File data chunks must be bytes type!')
+            yield chunk
+
+
+class HashedData(object):
+    """
+    Iterable of chunks of file data, that computes sha256 hash of data while they are iterated (written).
+    """
+
+    def __init__(self, data):
+        """
+        :param data: any data accepted by iter_chunks
+        """
+        self.data = data
+        self.hash = hashlib.sha256()
+
+    def __iter__(self):
+        for chunk in iter_chunks(self.data):
+            self.hash.update(chunk)
+            yield chunk
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+
+def file_digest(path, chunk_size=FILE_CHUNK_SIZE):
+    """
+    :return: sha256 digest of file content
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.digest()
+
+
+# temporary files are created next to replaced files, e.g. ".file.txt.123-456.tmp"
+TMP_FILENAME_RE = re.compile(r'^\..+\.\d+-\d+\.(tmp|rename)$')
+
+
+def get_tmp_path(path, suffix='tmp'):
+    """
+    :return: path of temporary file for path, unique for current process and thread
+    """
+    dir_path, filename = os.path.split(path)
+    return os.path.join(dir_path, '.{}.{}-{}.{}'.format(filename, os.getpid(), threading.get_ident(), suffix))
+
+
+def is_tmp_filename(filename):
+    return TMP_FILENAME_RE.match(filename) is not None
+
+
+def write_file(path, data, durability=DURABILITY_NONE):
+    """
+    Writes data to temporary file that then replaces file at path, so that file has either old or new content if
+    process crashes.
+    :param path: file path
+    :param data: str, bytes or any other data accepted by iter_chunks (written in streaming way)
+    :param durability: one of DURABILITY_MODES
+    """
+    dir_path = os.path.dirname(path)
+    tmp_path = get_tmp_path(path)
+    try:
+        with open(tmp_path, 'w' if isinstance(data, str) else 'wb') as f:
+            if isinstance(data, (str, bytes)):
+                f.write(data)
+            else:
+                for chunk in iter_chunks(data):
+                    f.write(chunk)
+            if durability != DURABILITY_NONE:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if durability == DURABILITY_FSYNC_DIR:
+        fsync_dir(dir_path or '.')
+
+
+def append_file(path, data, durability=DURABILITY_NONE):
+    """
+    Appends data to end of file, file is created if it doesn't exist. Unlike write_file, this isn't atomic, process
+    crash can leave only part of data in file.
+    :param path: file path
+    :param data: str or bytes
+    :param durability: one of DURABILITY_MODES
+    """
+    created = not os.path.exists(path)
+    with open(path, 'a' if isinstance(data, str) else 'ab') as f:
+        f.write(data)
+        if durability != DURABILITY_NONE:
+            f.flush()
+            os.fsync(f.fileno())
+    if created and durability == DURABILITY_FSYNC_DIR:
+        fsync_dir(os.path.dirname(path) or '.')
+
+
+def iter_parallel(func, items, workers, chunk_size=None):
+    """
+    Yields func(item) for every item, in order of items. Items are processed by thread pool, one chunk at a time,
+    while next chunk is already being processed. Remaining items are not processed if generator is closed.
+    Threads are faster than serial loop only if func mostly waits for I/O, CPU-bound work is serialized by GIL.
+    :param func: function to run
+    :param items: iterable of items
+    :param workers: number of threads
+    :param chunk_size: number of items submitted at once (smaller = faster first results, bigger = better throughput)
+    """
+    chunk_size = chunk_size if (chunk_size and chunk_size > 0) else workers * 4
+    items = iter(items)
+    pending = collections.deque()  # lists of futures
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    try:
+        def submit_chunk():
+            chunk = list(itertools.islice(items, chunk_size))
+            if chunk:
+                pending.append([executor.submit(func, item) for item in chunk])
+
+        submit_chunk()
+        while pending:
+            futures = pending.popleft()
+            submit_chunk()
+            for future in futures:
+                yield future.result()
+    finally:
+        for futures in pending:
+            for future in futures:
+                future.cancel()
+        executor.shutdown(wait=True)
+
+
 def validate_order(order):
     if not isinstance(order, str):
         raise FsdbOrderError('Order must be string!')
@@ -76,6 +311,142 @@ def validate_domain(domain, valid_fields):
         raise FsdbDomainError(domain)
 
 
+def is_domain_leaf(node):
+    return node[0] not in ['&', '|']
+
+
+def parse_domain(domain):
+    """
+    Converts domain into tree, using the same rules as evaluate_domain.
+    :param domain: validated domain
+    :return: tree of domain or None if domain is empty. Leafs are (field, operator, value) tuples and nodes are
+        ('&', left, right) or ('|', left, right) tuples.
+    """
+    # operators stay strings, everything else is converted to tuples
+    domain = [dom if isinstance(dom, str) else tuple(dom) for dom in domain]
+    if len(domain) == 0:
+        return None
+
+    domain_changed = True
+    while domain_changed:
+        domain_changed = False
+
+        # [expr, expr, ...] -> [(expr and expr), ...]
+        if len(domain) >= 2 and isinstance(domain[0], tuple) and isinstance(domain[1], tuple):
+            domain[0] = ('&', domain[0], domain[1])
+            domain.pop(1)
+            domain_changed = True
+
+        # expr, expr, expr -> expr, (expr and expr)
+        for i in range(len(domain)):
+            if len(domain) <= i+2:
+                continue
+
+            val1 = domain[i]
+            val2 = domain[i+1]
+            val3 = domain[i+2]
+
+            if isinstance(val1, tuple) and isinstance(val2, tuple) and isinstance(val3, tuple):
+                domain[i+1] = ('&', val2, val3)
+                domain.pop(i+2)
+                domain_changed = True
+                break
+
+        # op, expr, expr -> (expr op expr)
+        for i in range(len(domain)):
+            if len(domain) <= i+2:
+                continue
+
+            val1 = domain[i]
+            val2 = domain[i+1]
+            val3 = domain[i+2]
+
+            if isinstance(val1, str) and isinstance(val2, tuple) and isinstance(val3, tuple):
+                if val1 not in ['&', '|']:
+                    raise FsdbDomainError(domain)
+                domain[i] = (val1, val2, val3)
+                domain.pop(i+2)
+                domain.pop(i+1)
+                domain_changed = True
+                break
+
+    if len(domain) != 1 or not isinstance(domain[0], tuple):
+        raise FsdbDomainError(domain)
+
+    return domain[0]
+
+
+def _compile_domain_leaf(dom_field, dom_eq, dom_value):
+    if dom_eq in ['in', 'not in']:
+        try:
+            dom_set = frozenset(dom_value)
+        except TypeError:
+            dom_set = dom_value  # unhashable values, use list
+
+        def contains(value):
+            try:
+                return value in dom_set
+            except TypeError:
+                return value in dom_value  # unhashable field value
+
+        if dom_eq == 'in':
+            return lambda values: contains(values[dom_field])
+        else:
+            return lambda values: not contains(values[dom_field])
+
+    if dom_eq == '=':
+        return lambda values: values[dom_field] == dom_value
+    elif dom_eq == '!=':
+        return lambda values: values[dom_field] != dom_value
+    elif dom_eq == '>':
+        return lambda values: values[dom_field] > dom_value
+    elif dom_eq == '>=':
+        return lambda values: values[dom_field] >= dom_value
+    elif dom_eq == '<':
+        return lambda values: values[dom_field] < dom_value
+    elif dom_eq == '<=':
+        return lambda values: values[dom_field] <= dom_value
+    else:
+        raise FsdbDomainError([(dom_field, dom_eq, dom_value)], 'Invalid domain operator!')
+
+
+def _compile_domain_tree(node, field_names):
+    if is_domain_leaf(node):
+        field_names.add(node[0])
+        return _compile_domain_leaf(*node)
+
+    op, left, right = node
+    left = _compile_domain_tree(left, field_names)
+    right = _compile_domain_tree(right, field_names)
+    if op == '&':
+        return lambda values: left(values) and right(values)
+    else:
+        return lambda values: left(values) or right(values)
+
+
+def compile_domain_tree(domain_tree):
+    """
+    Compiles parsed domain into function that evaluates it.
+    :param domain_tree: domain parsed with parse_domain
+    :return: (predicate, field_names) - predicate is function that takes {field_name: value, ...} dict and returns
+        boolean, field_names is set of names of fields that predicate needs
+    """
+    if domain_tree is None:
+        return (lambda values: True), set()
+
+    field_names = set()
+    predicate = _compile_domain_tree(domain_tree, field_names)
+    return predicate, field_names
+
+
+def compile_domain(domain):
+    """
+    :param domain: validated domain
+    :return: (predicate, field_names), see compile_domain_tree
+    """
+    return compile_domain_tree(parse_domain(domain))
+
+
 def evaluate_domain(domain):
     """
     :param domain: processed domain
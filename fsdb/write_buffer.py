@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import copy
+import logging
+import threading
+from collections import OrderedDict
+
+_logger = logging.getLogger(__name__)
+
+
+class WriteBuffer(object):
+    """
+    Write-behind buffer of record data files of one table. Written data values are kept in memory (repeated writes
+    of the same record replace each other) and written to disk together, when number of buffered records reaches
+    max_records, max_delay seconds after the first buffered write, on explicit flush() or when database is closed.
+    Buffered changes are lost if process crashes before they are flushed.
+
+    Changes of table indexes are saved by flush, after data files. If process crashes in between, indexes are
+    rebuilt when table is loaded.
+    """
+
+    def __init__(self, table, max_records=1000, max_delay=1.0):
+        """
+        :param table: Table
+        :param max_records: max number of buffered records, None for no limit
+        :param max_delay: max number of seconds before buffered data are written, None for no limit
+        """
+        self.table = table
+        self.max_records = max_records
+        self.max_delay = max_delay
+
+        self.lock = threading.RLock()
+        self.dirty = OrderedDict()  # record id -> (Record, data values)
+        self.timer = None
+
+    def __len__(self):
+        return len(self.dirty)
+
+    def get(self, rid):
+        """
+        :return: copy of buffered data values of record or None
+        """
+        with self.lock:
+            if rid not in self.dirty:
+                return None
+            return copy.deepcopy(self.dirty[rid][1])
+
+    def put(self, record, data_values):
+        with self.lock:
+            self.dirty[record.id] = (record, data_values)
+
+            if self.max_records is not None and len(self.dirty) >= self.max_records:
+                self.flush()
+            elif self.max_delay is not None and self.timer is None:
+                self.timer = threading.Timer(self.max_delay, self._flush_timer)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def discard(self, ids):
+        """
+        Removes buffered data of records, used when records are deleted.
+        """
+        with self.lock:
+            for rid in ids:
+                self.dirty.pop(rid, None)
+
+    def flush(self):
+        """
+        Writes all buffered data to disk.
+        :return: number of written records
+        """
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+            count = len(self.dirty)
+            if count == 0:
+                return 0
+            _logger.info('FLUSH {} RECORDS IN TABLE "{}"'.format(count, self.table.name))
+
+            # records are removed from buffer only after they are written, so that failed flush can be retried
+            index_changes = self.table.has_index_changes()
+            if index_changes:
+                self.table.set_indexes_dirty(True)
+            while self.dirty:
+                rid, (record, data_values) = next(iter(self.dirty.items()))
+                record.write_data_file(data_values)
+                del(self.dirty[rid])
+            if index_changes:
+                self.table.flush_indexes()
+                self.table.set_indexes_dirty(False)
+            return count
+
+    def _flush_timer(self):
+        try:
+            self.flush()
+        except Exception:
+            _logger.exception('Flush of write buffer of table "{}" failed!'.format(self.table.name))
+
+    def clear(self):
+        """
+        Drops all buffered data without writing them.
+        """
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            self.dirty = OrderedDict()
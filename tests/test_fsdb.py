@@ -2,15 +2,22 @@
 # -*- coding: utf-8 -*-
 
 import unittest
+import unittest.mock
 import sys
 import os
 import tempfile
 import shutil
 import datetime
+import io
+import json
+import hashlib
+import asyncio
+import lzma
+import threading
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 import fsdb
-from fsdb.exceptions import FsdbDatabaseClosed, FsdbObjectDeleted
+from fsdb.exceptions import FsdbError, FsdbDatabaseClosed, FsdbObjectDeleted
 
 
 class TestFSDB(unittest.TestCase):
@@ -124,7 +131,8 @@ class TestFSDB(unittest.TestCase):
                         {'name': 'id', 'type': 'int', },
                     ],
                     'records': [
-                        {'id': 0, }
+                        {'id': 0, },
+                        {'id': 1, },
                     ],
                 },
             ],
@@ -134,6 +142,10 @@ class TestFSDB(unittest.TestCase):
         db = self.fsdb.database
         tbl = self.fsdb.database.tables[list(self.fsdb.database.tables.keys())[0]]
         rec = self.fsdb.search_records('test_table')[0]
+        deleted_rec = self.fsdb.browse_records('test_table', 1)
+        deleted_rec.delete()
+        field = tbl.fields['id']
+        self.assertFalse(hasattr(rec, '__dict__'))
 
         # close db
         self.fsdb.close_database()
@@ -142,6 +154,14 @@ class TestFSDB(unittest.TestCase):
         self.assertRaises(FsdbDatabaseClosed, lambda: db.name)
         self.assertRaises(FsdbDatabaseClosed, lambda: tbl.name)
         self.assertRaises(FsdbDatabaseClosed, lambda: rec.name)
+        self.assertRaises(FsdbDatabaseClosed, lambda: rec.read())
+        self.assertRaises(FsdbDatabaseClosed, lambda: field.name)
+        self.assertRaises(FsdbObjectDeleted, lambda: deleted_rec.name)
+        self.assertIsInstance(rec, fsdb.Record)
+
+        # objects of reopened database are valid
+        self.fsdb.open_database('test_db')
+        self.assertEqual(self.fsdb.search_records('test_table')[0].read()['id'], 0)
 
     def test_deleted_access(self):
         self.fsdb.init_from_config([{
@@ -164,9 +184,11 @@ class TestFSDB(unittest.TestCase):
         tbl = self.fsdb.database.tables[list(self.fsdb.database.tables.keys())[0]]
         rec = self.fsdb.search_records('test_table')[0]
 
-        # test record
+        # test record, all objects of deleted record are marked
+        rec_copy = self.fsdb.browse_records('test_table', 0)
         rec.delete()
         self.assertRaises(FsdbObjectDeleted, lambda: rec.name)
+        self.assertRaises(FsdbObjectDeleted, lambda: rec_copy.read())
 
         # test table
         tbl.delete()
@@ -176,6 +198,1079 @@ class TestFSDB(unittest.TestCase):
         db.delete()
         self.assertRaises(FsdbObjectDeleted, lambda: db.name)
 
+    def test_compile_domain(self):
+        predicate, field_names = fsdb.tools.compile_domain([
+            '&',
+            ('a', '!=', 1),
+            '|',
+            ('b', 'in', [1, 2]),
+            ('c', '>', 5),
+        ])
+        self.assertEqual(field_names, {'a', 'b', 'c'})
+        self.assertTrue(predicate({'a': 0, 'b': 2, 'c': 0}))
+        self.assertTrue(predicate({'a': 0, 'b': 3, 'c': 6}))
+        self.assertFalse(predicate({'a': 0, 'b': 3, 'c': 5}))
+        self.assertFalse(predicate({'a': 1, 'b': [], 'c': None}))  # short-circuit, other values are not compared
+
+        # implicit "&" between domain parts
+        predicate, field_names = fsdb.tools.compile_domain([('a', 'not in', [[1], [2]]), ('b', '<=', 2)])
+        self.assertTrue(predicate({'a': [3], 'b': 2}))
+        self.assertFalse(predicate({'a': [1], 'b': 2}))
+
+        self.assertRaises(fsdb.exceptions.FsdbDomainError, lambda: fsdb.tools.compile_domain([('a', 'like', 1)]))
+
+    def test_cache(self):
+        cache = fsdb.Cache()
+        value_size = fsdb.cache.get_deep_size({'val': 'x'*1000})
+        cache.set_cache_size(value_size*3, value_size*4)
+
+        # fill cache
+        for i in range(4):
+            cache.to_cache(i, {'val': str(i)*1000})
+        self.assertEqual(cache.size, value_size*4)
+
+        # access first item, so that second one is least recently used
+        self.assertIsNotNone(cache.from_cache(0))
+
+        # go over cache size limit and test that least recently used items were removed
+        cache.to_cache(4, {'val': '4'*1000})
+        self.assertLessEqual(cache.size, value_size*3)
+        self.assertIsNotNone(cache.from_cache(0))
+        self.assertIsNone(cache.from_cache(1))
+        self.assertIsNone(cache.from_cache(2))
+        self.assertIsNotNone(cache.from_cache(4))
+
+        # size is updated on delete and replace
+        cache.del_cache(4)
+        cache.to_cache(0, {'val': '0'*10})
+        self.assertEqual(cache.size, value_size + fsdb.cache.get_deep_size({'val': '0'*10}))
+
+        # values larger then cache size are not cached
+        cache.to_cache(5, {'val': '5'*value_size*3})
+        self.assertIsNone(cache.from_cache(5))
+
+    def test_cache_stats(self):
+        self.fsdb.init_from_config([{
+            'name': 'test_db',
+            'tables': [
+                {
+                    'name': 'test-table',
+                    'fields': [
+                        {'name': 'id', 'type': 'int', },
+                        {'name': 'val', 'type': 'str', },
+                    ],
+                    'records': [
+                        {'id': 1, 'val': 'a'},
+                        {'id': 2, 'val': 'b'},
+                    ],
+                },
+            ],
+        }])
+        self.fsdb.open_database('test_db')
+        self.fsdb.reset_cache_stats()
+
+        rec = self.fsdb.browse_records('test-table', 1)
+        rec.read()  # miss
+        rec.read()  # hit
+        self.fsdb.browse_records('test-table', 2).read()  # miss
+
+        stats = self.fsdb.get_cache_stats()
+        table_stats = stats['tables']['test-table']
+        self.assertEqual(table_stats['hits'], 1)
+        self.assertEqual(table_stats['misses'], 2)
+        self.assertEqual(table_stats['entries'], 2)
+        self.assertGreater(table_stats['size'], 0)
+        self.assertEqual(table_stats['avg_entry_size'], table_stats['size'] / 2)
+        self.assertEqual(stats['total']['hits'], 1)
+        self.assertEqual(stats['total']['size'], table_stats['size'])
+
+        # reset keeps size and entries
+        self.fsdb.reset_cache_stats()
+        table_stats = self.fsdb.get_cache_stats()['tables']['test-table']
+        self.assertEqual(table_stats['hits'], 0)
+        self.assertEqual(table_stats['misses'], 0)
+        self.assertEqual(table_stats['entries'], 2)
+
+    def test_cache_partitions(self):
+        self.fsdb.init_from_config([{
+            'name': 'test_db',
+            'tables': [
+                {
+                    'name': 'users',
+                    'fields': [
+                        {'name': 'id', 'type': 'int', },
+                        {'name': 'login', 'type': 'str', },
+                    ],
+                    'records': [{'id': i, 'login': 'user{}'.format(i)} for i in range(1, 4)],
+                },
+                {
+                    'name': 'blog_posts',
+                    'cache_size': 10*1024,
+                    'cache_size_limit': 12*1024,
+                    'fields': [
+                        {'name': 'id', 'type': 'int', },
+                        {'name': 'data', 'type': 'dict', },
+                    ],
+                    'records': [{'id': i, 'data': {'text': 'x'*2000}} for i in range(1, 21)],
+                },
+            ],
+        }])
+        self.fsdb.open_database('test_db')
+
+        # table cache size is saved in table data
+        self.assertEqual(self.fsdb.get_table('blog_posts').cache.get_cache_size(), (10*1024, 12*1024))
+        self.assertIsNone(self.fsdb.get_table('users').cache.cache_size)
+
+        # scan of large table does not remove records of other tables from cache
+        for rec in self.fsdb.search_records('users'):
+            rec.read()
+        for rec in self.fsdb.search_records('blog_posts'):
+            rec.read()
+        stats = self.fsdb.get_cache_stats()
+        self.assertEqual(stats['tables']['users']['entries'], 3)
+        self.assertEqual(stats['tables']['users']['evictions'], 0)
+        self.assertLessEqual(stats['tables']['blog_posts']['size'], 12*1024)
+        self.assertGreater(stats['tables']['blog_posts']['evictions'], 0)
+
+        # global ceiling evicts from the largest partition first
+        self.fsdb.database.cache.set_cache_size(stats['total']['size'] - 1)
+        stats = self.fsdb.get_cache_stats()
+        self.assertEqual(stats['tables']['users']['entries'], 3)
+        self.assertLess(stats['total']['size'], stats['total']['cache_size'])
+
+    def test_index(self):
+        self.fsdb.init_from_config([{
+            'name': 'test_db',
+            'tables': [
+                {
+                    'name': 'test_table',
+                    'fields': [
+                        {'name': 'id', 'type': 'int', },
+                        {'name': 'name', 'type': 'str', 'index': True},
+                        {'name': 'num', 'type': 'int', 'index': True},
+                        {'name': 'note', 'type': 'str', },
+                    ],
+                    'records': [
+                        {'id': i, 'name': 'name{}'.format(i % 3), 'num': i, 'note': 'note{}'.format(i % 2)}
+                        for i in range(1, 11)
+                    ],
+                },
+            ],
+        }])
+
+        # remove index file, so that it has to be rebuilt on open
+        table_path = os.path.join(self.root_path, 'test_db', 'test_table')
+        os.remove(os.path.join(table_path, 'num.index.json'))
+        self.fsdb.open_database('test_db')
+        self.fsdb.get_table('test_table')  # tables are loaded on first access
+        self.assertTrue(os.path.exists(os.path.join(table_path, 'num.index.json')))
+
+        def search_ids(domain, **kwargs):
+            return [rec.id for rec in self.fsdb.search_records('test_table', domain, **kwargs)]
+
+        # fully indexed domains don't read records
+        self.fsdb.get_table('test_table').cache.clear()
+        self.fsdb.reset_cache_stats()
+        self.assertEqual(search_ids([('name', '=', 'name1')]), [1, 4, 7, 10])
+        self.assertEqual(search_ids([('name', '!=', 'name1'), ('num', '>', 5)]), [6, 8, 9])
+        self.assertEqual(search_ids(['|', ('num', '<', 2), ('num', '>=', 9)]), [1, 9, 10])
+        self.assertEqual(search_ids([('name', 'in', ['name0', 'name2']), ('num', '<=', 5)]), [2, 3, 5])
+        self.assertEqual(search_ids([('num', 'not in', [1, 2, 3])], limit=2), [4, 5])
+        self.assertEqual(self.fsdb.get_cache_stats()['tables']['test_table']['misses'], 0)
+
+        # partially indexed domain reads only records selected by index
+        self.assertEqual(search_ids([('num', '>', 7), ('note', '=', 'note0')]), [8, 10])
+        self.assertEqual(self.fsdb.get_cache_stats()['tables']['test_table']['misses'], 3)
+        self.assertEqual(search_ids(['|', ('num', '>', 8), ('note', '=', 'note0')]), [2, 4, 6, 8, 9, 10])
+
+        # indexes are updated on create/write/delete, changes are appended to journal
+        with open(os.path.join(table_path, 'name.index.json'), 'r') as f:
+            index_data = f.read()
+        self.fsdb.create_record('test_table', {'name': 'name1', 'num': 11})
+        self.fsdb.browse_records('test_table', 1).write({'name': 'name2'})
+        self.fsdb.browse_records('test_table', 4).delete()
+        self.assertEqual(search_ids([('name', '=', 'name1')]), [7, 10, 11])
+        with open(os.path.join(table_path, 'name.index.json'), 'r') as f:
+            self.assertEqual(f.read(), index_data)
+        with open(os.path.join(table_path, 'name.index.journal'), 'r') as f:
+            self.assertEqual(len(f.read().splitlines()), 4)  # generation, create, write, delete
+
+        # manifest is touched only by dirty mark of indexes when journal already exists, unchanged values aren't
+        # logged, writes of fields that are not indexed don't mark indexes
+        table = self.fsdb.get_table('test_table')
+        with unittest.mock.patch.object(table.id_manifest, 'touch') as touch:
+            self.fsdb.browse_records('test_table', 3).write({'name': 'name0'})
+            self.fsdb.browse_records('test_table', 3).write({'note': 'note2'})
+        self.assertEqual(touch.call_count, 2)  # mark and unmark
+        self.assertFalse(os.path.exists(os.path.join(table_path, 'indexes.dirty')))
+        self.assertEqual(table.indexes['name'].journal_size, 3)
+
+        # journal is used if database wasn't closed, and it's merged into index file on load
+        manager = fsdb.Manager(self.root_path)
+        manager.open_database('test_db')
+        self.assertEqual([rec.id for rec in manager.search_records('test_table', [('name', '=', 'name1')])],
+                         [7, 10, 11])
+        self.assertFalse(os.path.exists(os.path.join(table_path, 'name.index.journal')))
+        manager.close_database()
+        self.fsdb.close_database()
+        self.fsdb.open_database('test_db')
+
+        # journal is merged when it has more changes than index has records
+        with unittest.mock.patch.object(fsdb.index.BaseIndex, 'MIN_COMPACT_SIZE', 0):
+            for i in range(10):
+                self.fsdb.browse_records('test_table', 2).write({'name': 'name{}'.format(i)})
+            self.assertTrue(os.path.exists(os.path.join(table_path, 'name.index.journal')))
+            self.fsdb.browse_records('test_table', 2).write({'name': 'name10'})
+            self.assertFalse(os.path.exists(os.path.join(table_path, 'name.index.journal')))
+        self.assertEqual(search_ids([('name', '=', 'name10')]), [2])
+
+        self.fsdb.close_database()
+        self.fsdb.open_database('test_db')
+        self.assertEqual(search_ids([('name', '=', 'name1')]), [7, 10, 11])
+
+        # values that can't be indexed are rejected before anything is written
+        self.assertRaises(FsdbError, lambda: self.fsdb.create_record('test_table', {'id': 20, 'num': 'abc'}))
+        self.assertRaises(FsdbError, lambda: self.fsdb.browse_records('test_table', 7).write({'name': 5}))
+        self.assertFalse(os.path.exists(os.path.join(table_path, '20')))
+        self.assertEqual(search_ids([('num', '>', 10)]), [11])
+
+        # records with such values (e.g. written by older version) don't prevent table from loading
+        record_path = os.path.join(table_path, '7', 'data.json')
+        with open(record_path, 'r') as f:
+            data = json.load(f)
+        with open(record_path, 'w') as f:
+            json.dump(dict(data, num='abc'), f)
+        self.fsdb.close_database()
+        os.remove(os.path.join(table_path, 'num.index.json'))
+        self.fsdb.open_database('test_db')
+        self.assertEqual(search_ids([('num', '>', 8)]), [9, 10, 11])
+
+        # index with such values is complete, it's not rebuilt again
+        self.fsdb.close_database()
+        with unittest.mock.patch.object(fsdb.index.BaseIndex, 'rebuild') as rebuild:
+            self.fsdb.open_database('test_db')
+            self.fsdb.get_table('test_table')
+        self.assertEqual(rebuild.call_count, 0)
+
+        # indexes are rebuilt if process crashed after data file was written, before index changes were saved
+        table = self.fsdb.get_table('test_table')
+        with unittest.mock.patch.object(table, 'index_records', side_effect=OSError('crash')):
+            self.assertRaises(OSError, lambda: self.fsdb.browse_records('test_table', 9).write({'num': 90}))
+            self.assertRaises(OSError, lambda: self.fsdb.write_records('test_table', {'name': 'crash'},
+                                                                       [('id', '=', 10)]))
+        self.assertTrue(os.path.exists(os.path.join(table_path, 'indexes.dirty')))
+        manager = fsdb.Manager(self.root_path)
+        manager.open_database('test_db')
+        self.assertEqual(manager.browse_records('test_table', 9).read()['num'], 90)
+        self.assertEqual([rec.id for rec in manager.search_records('test_table', [('num', '=', 90)])], [9])
+        self.assertEqual([rec.id for rec in manager.search_records('test_table', [('num', '=', 9)])], [])
+        self.assertEqual([rec.id for rec in manager.search_records('test_table', [('name', '=', 'crash')])], [10])
+        self.assertFalse(os.path.exists(os.path.join(table_path, 'indexes.dirty')))
+        manager.close_database()
+
+    def test_search_ids(self):
+        self.fsdb.init_from_config([{
+            'name': 'test_db',
+            'tables': [
+                {
+                    'name': 'test_table',
+                    'fields': [
+                        {'name': 'id', 'type': 'int', },
+                        {'name': 'val', 'type': 'int', },
+                    ],
+                    'records': [{'id': i, 'val': i % 2} for i in [5, 3, 1, 2, 4]],
+                },
+            ],
+        }])
+        self.fsdb.open_database('test_db')
+        self.fsdb.create_record('test_table', {'id': 0, 'val': 0})  # custom id keeps record ids sorted
+
+        def search_ids(domain):
+            return [rec.id for rec in self.fsdb.search_records('test_table', domain)]
+
+        # id domains don't read records
+        self.fsdb.get_table('test_table').cache.clear()
+        self.fsdb.reset_cache_stats()
+        self.assertEqual(search_ids([('id', '>', 1), ('id', '<=', 4)]), [2, 3, 4])
+        self.assertEqual(search_ids(['|', ('id', 'in', [1, 3, 10]), ('id', '=', 5)]), [1, 3, 5])
+        self.assertEqual(search_ids([('id', 'not in', [1, 3]), ('id', '!=', 0)]), [2, 4, 5])
+        self.assertEqual(self.fsdb.get_cache_stats()['tables']['test_table']['misses'], 0)
+
+        # other fields are evaluated only on records selected by ids
+        self.assertEqual(search_ids([('id', '>=', 3), ('val', '=', 1)]), [3, 5])
+        self.assertEqual(self.fsdb.get_cache_stats()['tables']['test_table']['misses'], 3)
+
+    def test_search_order(self):
+        self.fsdb.init_from_config([{
+            'name': 'test_db',
+            'tables': [
+                {
+                    'name': 'test_table',
+                    'fields': [
+                        {'name': 'id', 'type': 'int', },
+                        {'name': 'name', 'type': 'str', },
+                        {'name': 'num', 'type': 'int', },
+                    ],
+                    'records': [
+                        {'id': 1, 'name': 'b', 'num': 3},
+                        {'id': 2, 'name': 'A', 'num': 1},
+                        {'id': 3, 'name': 'c', 'num': None},
+                        {'id': 4, 'name': 'a', 'num': 2},
+                        {'id': 5, 'name': 'B', 'num': 5},
+                    ],
+                },
+            ],
+        }])
+        self.fsdb.open_database('test_db')
+
+        def search_ids(domain=None, **kwargs):
+            return [rec.id for rec in self.fsdb.search_records('test_table', domain, **kwargs)]
+
+        # limit is applied after order
+        self.assertEqual(search_ids(order='num desc', limit=2), [5, 1])
+        self.assertEqual(search_ids(order='num asc', limit=2), [3, 2])
+        self.assertEqual(search_ids([('id', '!=', 5)], order='num desc', limit=1), [1])
+
+        # str fields are ordered case-insensitive, ties keep order of ids
+        self.assertEqual(search_ids(order='name asc'), [2, 4, 1, 5, 3])
+        self.assertEqual(search_ids(order='name desc'), [3, 1, 5, 2, 4])
+
+        # mixed directions
+        self.assertEqual(search_ids(order='name asc, id desc'), [4, 2, 5, 1, 3])
+        self.assertEqual(search_ids(order='name desc, id desc', limit=3), [3, 5, 1])
+
+        # each record is read once
+        self.fsdb.get_table('test_table').cache.clear()
+        self.fsdb.reset_cache_stats()
+        search_ids(order='name asc, num desc', limit=2)
+        stats = self.fsdb.get_cache_stats()['tables']['test_table']
+        self.assertEqual(stats['hits'] + stats['misses'], 5)
+
+        # top records and cursor pages are stable with ties, for mixed directions too
+        self.fsdb.create_records('test_table', [{'name': 'n{}'.format(i % 2), 'num': i % 3} for i in range(45)])
+        for order in ['num asc, name asc', 'num asc, name desc']:
+            expected_ids = search_ids(order=order)
+            for limit in [1, 8, 20]:
+                self.assertEqual(search_ids(order=order, limit=limit), expected_ids[:limit])
+            ids = []
+            cursor = None
+            while True:
+                page = self.fsdb.search_records('test_table', order=order, limit=7, cursor=cursor)
+                if not page:
+                    break
+                ids += [rec.id for rec in page]
+                cursor = self.fsdb.get_cursor('test_table', page[-1], order=order)
+            self.assertEqual(ids, expected_ids)
+
+    def test_iter_records(self):
+        self.fsdb.init_from_config([{
+            'name': 'test_db',
+            'tables': [
+                {
+                    'name': 'test_table',
+                    'fields': [
+                        {'name': 'id', 'type': 'int', },
+                        {'name': 'num', 'type': 'int', },
+                        {'name': 'date', 'type': 'datetime', },
+                    ],
+                    'records': [
+                        {'id': i, 'num': i % 3, 'date': datetime.datetime(2000, 1, 1 + i % 4)} for i in range(1, 11)
+                    ],
+                },
+            ],
+        }])
+        self.fsdb.open_database('test_db')
+
+        # records are read lazily
+        self.fsdb.get_table('test_table').cache.clear()
+        self.fsdb.reset_cache_stats()
+        records = self.fsdb.iter_records('test_table', [('num', '=', 1)])
+        self.assertEqual(next(records).id, 1)
+        self.assertEqual(next(records).id, 4)
+        self.assertEqual(self.fsdb.get_cache_stats()['tables']['test_table']['misses'], 4)
+
+        # offset
+        ids = [rec.id for rec in self.fsdb.iter_records('test_table', [('num', '!=', 0)], offset=2, limit=3)]
+        self.assertEqual(ids, [4, 5, 7])
+
+        # pages with cursor
+        for domain, order in [([], None), ([('num', '!=', 2)], 'date desc, num asc')]:
+            expected_ids = [rec.id for rec in self.fsdb.search_records('test_table', domain, order=order)]
+            ids = []
+            cursor = None
+            while True:
+                page = list(self.fsdb.iter_records('test_table', domain, order=order, limit=3, cursor=cursor))
+                if not page:
+                    break
+                ids += [rec.id for rec in page]
+                cursor = self.fsdb.get_cursor('test_table', page[-1], order=order)
+            self.assertEqual(ids, expected_ids)
+
+        # cursor must match order
+        cursor = self.fsdb.get_cursor('test_table', self.fsdb.browse_records('test_table', 1), order='num asc')
+        self.assertRaises(FsdbError, lambda: self.fsdb.search_records('test_table', order='num desc', cursor=cursor))
+        self.assertRaises(FsdbError, lambda: self.fsdb.search_records('test_table', cursor='invalid'))
+
+    def test_parallel_search(self):
+        self.fsdb.init_from_config([{
+            'name': 'test_db',
+            'tables': [
+                {
+                    'name': 'test_table',
+                    'fields': [
+                        {'name': 'id', 'type': 'int', },
+                        {'name': 'num', 'type': 'int', },
+                    ],
+                    'records': [{'id': i, 'num': i % 7} for i in range(1, 101)],
+                },
+            ],
+        }])
+        self.fsdb.open_database('test_db')
+
+        # small scans are serial
+        with unittest.mock.patch('fsdb.table.iter_parallel', side_effect=AssertionError('scan is parallel')):
+            self.assertEqual(len(self.fsdb.search_records('test_table', [('num', '=', 1)], workers=4)), 15)
+        self.fsdb.get_table('test_table').MIN_PARALLEL_SCAN_SIZE = 0
+
+        for kwargs in [{}, {'limit': 5}, {'limit': 5, 'offset': 3}, {'order': 'num desc', 'limit': 10}]:
+            expected_ids = [rec.id for rec in self.fsdb.search_records('test_table', [('num', '<', 3)], **kwargs)]
+            self.fsdb.get_table('test_table').cache.clear()
+            ids = [rec.id for rec in self.fsdb.search_records(
+                'test_table', [('num', '<', 3)], workers=4, chunk_size=8, **kwargs)]
+            self.assertEqual(ids, expected_ids)
+
+        # stopping iteration stops reading
+        self.fsdb.get_table('test_table').cache.clear()
+        self.fsdb.reset_cache_stats()
+        records = self.fsdb.iter_records('test_table', [('num', '=', 1)], workers=2, chunk_size=4)
+        self.assertEqual(next(records).id, 1)
+        records.close()
+        self.assertLessEqual(self.fsdb.get_cache_stats()['tables']['test_table']['misses'], 8)
+
+    def test_required_unique(self):
+        self.fsdb.init_from_config([{
+            'name': 'test_db',
+            'tables': [
+                {
+                    'name': 'users',
+                    'fields': [
+                        {'name': 'id', 'type': 'int', },
+                        {'name': 'login', 'type': 'str', 'required': True, 'unique': True},
+                        {'name': 'email', 'type': 'str', 'unique': True},
+                    ],
+                    'records': [
+                        {'id': 1, 'login': 'user1', 'email': None},
+                    ],
+                },
+            ],
+        }])
+        self.fsdb.open_database('test_db')
+
+        # required
+        self.assertRaises(FsdbError, lambda: self.fsdb.create_record('users', {'email': 'a@b.c'}))
+        self.assertRaises(FsdbError, lambda: self.fsdb.browse_records('users', 1).write({'login': None}))
+
+        # unique
+        self.assertRaises(FsdbError, lambda: self.fsdb.create_record('users', {'login': 'user1'}))
+        rec2 = self.fsdb.create_record('users', {'login': 'user2', 'email': None})
+        self.assertRaises(FsdbError, lambda: rec2.write({'login': 'user1'}))
+        rec2.write({'login': 'user2', 'email': 'user2@example.com'})  # writing own value is fine
+        self.assertEqual(len(self.fsdb.search_records('users')), 2)
+
+        # values are released on write and delete
+        self.fsdb.browse_records('users', 1).write({'login': 'user1_renamed'})
+        rec3 = self.fsdb.create_record('users', {'login': 'user1'})
+        rec3.delete()
+
+        # unique index file isn't rewritten by writes, changes are in its journal even if database isn't closed
+        table_path = os.path.join(self.root_path, 'test_db', 'users')
+        with open(os.path.join(table_path, 'login.unique.json'), 'r') as f:
+            self.assertNotIn('user2', f.read())
+        manager = fsdb.Manager(self.root_path)
+        manager.open_database('test_db')
+        self.assertRaises(FsdbError, lambda: manager.create_record('users', {'login': 'user1_renamed'}))
+        manager.close_database()
+
+        # unique index is persisted
+        self.fsdb.close_database()
+        self.fsdb.open_database('test_db')
+        self.assertRaises(FsdbError, lambda: self.fsdb.create_record('users', {'login': 'user2'}))
+        self.fsdb.create_record('users', {'login': 'user1'})
+
+        # only fields of types that can be indexed can be unique
+        self.assertRaises(FsdbError, lambda: self.fsdb.create_table('tags', [
+            {'name': 'id', 'type': 'int'}, {'name': 'tags', 'type': 'list', 'unique': True}]))
+        self.assertFalse(os.path.exists(os.path.join(self.root_path, 'test_db', 'tags')))
+
+        # table with such field written by older version is opened, uniqueness of field is not checked
+        self.fsdb.create_table('tags', [{'name': 'id', 'type': 'int'}, {'name': 'tags', 'type': 'list'}])
+        self.fsdb.close_database()
+        data_path = os.path.join(self.root_path, 'test_db', 'tags', 'data.json')
+        with open(data_path, 'r') as f:
+            data = json.load(f)
+        for field_data in data['fields']:
+            if field_data['name'] == 'tags':
+                field_data['unique'] = True
+        with open(data_path, 'w') as f:
+            json.dump(data, f)
+        self.fsdb.open_database('test_db')
+        with self.assertLogs('fsdb.table', 'WARNING'):
+            self.assertTrue(self.fsdb.get_table('tags').fields['tags'].unique)
+        self.fsdb.create_records('tags', [{'tags': ['a']}, {'tags': ['a']}])
+        self.assertEqual(len(self.fsdb.search_records('tags')), 2)
+
+    def test_id_manifest(self):
+        self.fsdb.init_from_config([{
+            'name': 'test_db',
+            'tables': [
+                {
+                    'name': 'test_table',
+                    'fields': [
+                        {'name': 'id', 'type': 'int', },
+                        {'name': 'num', 'type': 'int', 'index': True},
+                    ],
+                    'records': [{'id': i, 'num': i} for i in [5, 1, 3]],
+                },
+                {
+                    'name': 'test_table_datetime',
+                    'fields': [
+                        {'name': 'id', 'type': 'datetime', },
+                    ],
+                },
+            ],
+        }])
+        self.fsdb.open_database('test_db')
+        self.fsdb.browse_records('test_table', 3).delete()
+        self.fsdb.create_record('test_table', {'num': 6})
+        dt_ids = [self.fsdb.create_record('test_table_datetime', {}).id for _ in range(3)]
+        self.fsdb.browse_records('test_table_datetime', dt_ids.pop(1)).delete()
+
+        # removed ids are appended to manifest as tombstones, manifest isn't rewritten
+        table = self.fsdb.get_table('test_table')
+        with unittest.mock.patch.object(table.id_manifest, 'save') as save:
+            self.fsdb.browse_records('test_table', 5).delete()
+            self.fsdb.create_record('test_table', {'id': 5, 'num': 5})
+        self.assertEqual(save.call_count, 0)
+        self.assertEqual(table.id_manifest.removed, 2)
+
+        # ids are loaded from valid manifest, without scanning record folders
+        self.fsdb.close_database()
+        scan_record_ids = fsdb.Table.scan_record_ids
+        try:
+            fsdb.Table.scan_record_ids = lambda table: self.fail('Record folders were scanned!')
+            self.fsdb.open_database('test_db')
+            self.assertEqual(self.fsdb.get_table('test_table').record_ids.tolist(), [1, 5, 6])
+            self.assertEqual(self.fsdb.get_table('test_table_datetime').record_ids.tolist(), dt_ids)
+        finally:
+            fsdb.Table.scan_record_ids = scan_record_ids
+
+        # changes of table folder made outside of table make manifest stale
+        table_path = self.fsdb.get_table('test_table').table_path
+        self.fsdb.close_database()
+        shutil.copytree(os.path.join(table_path, '1'), os.path.join(table_path, '10'))
+        os.makedirs(os.path.join(table_path, '11'))  # invalid record folder
+        self.fsdb.open_database('test_db')
+        self.assertEqual(self.fsdb.get_table('test_table').record_ids.tolist(), [1, 5, 6, 10])
+        self.assertFalse(os.path.exists(os.path.join(table_path, '11')))
+
+        # ids must fit into 64-bit integers, lowest one is reserved for tombstones
+        self.assertRaises(FsdbError, lambda: self.fsdb.create_record('test_table', {'id': 2**63, 'num': 0}))
+        self.assertRaises(FsdbError, lambda: self.fsdb.create_record('test_table', {'id': -2**63, 'num': 0}))
+        self.assertRaises(FsdbError, lambda: self.fsdb.create_records('test_table', [{'id': -2**64, 'num': 0}]))
+        self.fsdb.create_records('test_table', [{'id': -2**63 + 1, 'num': 0}, {'id': 2**63 - 1, 'num': 0}])
+        self.fsdb.browse_records('test_table', 2**63 - 1).delete()
+        self.fsdb.close_database()
+        self.fsdb.open_database('test_db')
+        self.assertEqual(self.fsdb.get_table('test_table').record_ids.tolist(), [-2**63 + 1, 1, 5, 6, 10])
+        self.assertEqual(self.fsdb.get_table('test_table').record_ids.last_id, 2**63 - 1)
+
+        # table with ids out of range (created by older versions) has no manifest, its folder is scanned
+        self.fsdb.close_database()
+        shutil.copytree(os.path.join(table_path, '1'), os.path.join(table_path, str(-2**63)))
+        shutil.copytree(os.path.join(table_path, '1'), os.path.join(table_path, str(2**64)))
+        self.fsdb.open_database('test_db')
+        table = self.fsdb.get_table('test_table')
+        self.assertEqual(table.record_ids.tolist(), [-2**63, -2**63 + 1, 1, 5, 6, 10, 2**64])
+        self.assertFalse(os.path.exists(table.id_manifest.manifest_path))
+        self.fsdb.browse_records('test_table', -2**63).delete()
+        self.fsdb.browse_records('test_table', 2**64).delete()
+        self.fsdb.close_database()
+        self.fsdb.open_database('test_db')
+        self.assertEqual(self.fsdb.get_table('test_table').record_ids.tolist(), [-2**63 + 1, 1, 5, 6, 10])
+
+    def test_record_ids(self):
+        ids = fsdb.record_ids.RecordIds([5, 1, 3])
+        self.assertEqual(ids.tolist(), [1, 3, 5])
+        self.assertTrue(ids.add(2))
+        self.assertFalse(ids.add(2))
+        self.assertTrue(ids.add(7))
+        self.assertEqual(ids.update([0, 7, 8]), [0, 8])
+        self.assertTrue(ids.remove(8))
+        self.assertFalse(ids.remove(8))
+        self.assertEqual(ids.tolist(), [0, 1, 2, 3, 5, 7])
+        self.assertEqual(ids[ids.bisect_right(3):], [5, 7])
+        self.assertIn(5, ids)
+        self.assertEqual(ids.last_id, 8)
+
+        # ids of deleted records are not reused, even after reopen
+        self.fsdb.init_from_config([{
+            'name': 'test_db',
+            'tables': [
+                {
+                    'name': 'test_table',
+                    'fields': [
+                        {'name': 'id', 'type': 'int', },
+                    ],
+                    'records': [{'id': 10}, {'id': 2}],
+                },
+            ],
+        }])
+        self.fsdb.open_database('test_db')
+        self.fsdb.browse_records('test_table', 10).delete()
+        self.assertEqual(self.fsdb.create_record('test_table', {}).id, 11)
+        self.fsdb.browse_records('test_table', 11).delete()
+        self.fsdb.close_database()
+        self.fsdb.open_database('test_db')
+        self.assertEqual(self.fsdb.create_record('test_table', {}).id, 12)
+        self.assertEqual([rec.id for rec in self.fsdb.browse_records('test_table', [12, 11, 2])], [12, 2])
+
+        # ... also if manifest is stale and ids are loaded from record folders
+        table_path = self.fsdb.get_table('test_table').table_path
+        self.fsdb.browse_records('test_table', 12).delete()
+        self.fsdb.close_database()
+        os.makedirs(os.path.join(table_path, '20'))  # invalid record folder, makes manifest stale
+        with unittest.mock.patch.object(fsdb.Table, 'scan_record_ids', autospec=True,
+                                        side_effect=fsdb.Table.scan_record_ids) as scan_record_ids:
+            self.fsdb.open_database('test_db')
+            self.assertEqual(self.fsdb.get_table('test_table').record_ids.tolist(), [2])
+        self.assertEqual(scan_record_ids.call_count, 1)
+        self.assertEqual(self.fsdb.create_record('test_table', {}).id, 13)
+
+    def test_create_records(self):
+        self.fsdb.init_from_config([{
+            'name': 'test_db',
+            'tables': [
+                {
+                    'name': 'test_table',
+                    'fields': [
+                        {'name': 'id', 'type': 'int', },
+                        {'name': 'num', 'type': 'int', 'index': True},
+                        {'name': 'code', 'type': 'str', 'unique': True},
+                    ],
+                    'records': [{'id': 1, 'num': 0, 'code': 'a'}],
+                },
+                {
+                    'name': 'test_table_datetime',
+                    'fields': [
+                        {'name': 'id', 'type': 'datetime', },
+                    ],
+                },
+            ],
+        }])
+        self.fsdb.open_database('test_db')
+
+        ids = self.fsdb.create_records('test_table', [{'num': 1}, {'id': 10, 'num': 2}, {'num': 1}], return_ids=True)
+        self.assertEqual(ids, [11, 10, 12])
+        records = self.fsdb.create_records('test_table', [{'num': i % 3} for i in range(20)], workers=4)
+        self.assertEqual([rec.id for rec in records], list(range(13, 33)))
+        self.assertEqual(records[5].read(['num'])['num'], 2)
+        self.assertEqual(len(self.fsdb.search_records('test_table', [('num', '=', 1)])), 2 + 7)
+
+        # whole batch is validated before anything is written
+        for values_list in [[{'code': 'b'}, {'code': 'b'}], [{'code': 'c'}, {'code': 'a'}], [{}, {'id': 1}]]:
+            self.assertRaises(FsdbError, lambda: self.fsdb.create_records('test_table', values_list))
+        self.assertEqual(len(self.fsdb.search_records('test_table')), 24)
+
+        # generated datetime ids are unique
+        ids = self.fsdb.create_records('test_table_datetime', [{} for _ in range(50)], return_ids=True)
+        self.assertEqual(len(set(ids)), 50)
+
+        self.fsdb.close_database()
+        self.fsdb.open_database('test_db')
+        self.assertEqual(len(self.fsdb.search_records('test_table', [('num', '=', 1)])), 2 + 7)
+        self.assertEqual(len(self.fsdb.search_records('test_table_datetime')), 50)
+
+    def test_write_delete_records(self):
+        self.fsdb.init_from_config([{
+            'name': 'test_db',
+            'tables': [
+                {
+                    'name': 'test_table',
+                    'fields': [
+                        {'name': 'id', 'type': 'int', },
+                        {'name': 'num', 'type': 'int', 'index': True},
+                        {'name': 'code', 'type': 'str', 'unique': True},
+                    ],
+                    'records': [{'id': i, 'num': i % 4} for i in range(1, 21)],
+                },
+            ],
+        }])
+        self.fsdb.open_database('test_db')
+        cached_record = self.fsdb.browse_records('test_table', 1)
+        self.assertEqual(cached_record.read()['num'], 1)
+
+        # write
+        self.assertEqual(self.fsdb.write_records('test_table', {'num': 10}, [('num', '=', 1)]), 5)
+        self.assertEqual(self.fsdb.write_records('test_table', {'num': 20}, [('num', '=', 2)], workers=4), 5)
+        self.assertEqual(self.fsdb.write_records('test_table', {'num': 30}, [('num', '=', 100)]), 0)
+        self.assertEqual(cached_record.read()['num'], 10)
+        self.assertEqual(len(self.fsdb.search_records('test_table', [('num', '=', 10)])), 5)
+        self.assertEqual(len(self.fsdb.search_records('test_table', [('num', '=', 20)])), 5)
+
+        # unique value can be written only to one record
+        self.assertRaises(FsdbError, lambda: self.fsdb.write_records('test_table', {'code': 'a'}, [('num', '=', 10)]))
+        self.assertEqual(self.fsdb.write_records('test_table', {'code': 'a'}, [('id', '=', 1)]), 1)
+        self.assertEqual(self.fsdb.write_records('test_table', {'code': None}, [('num', '=', 10)]), 5)
+
+        # indexes are updated for records that were written before write of other record failed
+        save_values = fsdb.Record.save_values
+
+        def failing_save_values(record, values):
+            if record.id == 7:
+                raise OSError('disk full')
+            save_values(record, values)
+
+        for workers, failed_ids in [(None, [7, 11, 15, 19]), (4, [7])]:
+            with unittest.mock.patch.object(fsdb.Record, 'save_values', failing_save_values):
+                self.assertRaises(OSError, self.fsdb.write_records, 'test_table', {'num': 30}, [('num', '=', 3)],
+                                  workers=workers)
+            self.assertEqual([rec.id for rec in self.fsdb.search_records('test_table', [('num', '=', 3)])],
+                             failed_ids)
+        self.assertEqual([rec.id for rec in self.fsdb.search_records('test_table', [('num', '=', 30)])],
+                         [3, 11, 15, 19])
+
+        # delete
+        self.assertEqual(self.fsdb.delete_records('test_table', [('num', '=', 10)]), 5)
+        self.assertEqual(self.fsdb.delete_records('test_table', [('num', 'in', [0, 20])], workers=4), 10)
+        self.assertIsNone(self.fsdb.browse_records('test_table', 1))
+        self.assertRaises(FsdbObjectDeleted, lambda: cached_record.id)
+        self.assertEqual([rec.id for rec in self.fsdb.search_records('test_table')], [3, 7, 11, 15, 19])
+
+        # records whose folders weren't removed stay in record ids and indexes
+        rmtree = shutil.rmtree
+
+        def failing_rmtree(path):
+            if os.path.basename(path) == '11':
+                raise OSError('permission denied')
+            rmtree(path)
+
+        with unittest.mock.patch('fsdb.table.shutil.rmtree', failing_rmtree):
+            self.assertRaises(OSError, self.fsdb.delete_records, 'test_table', [('num', '=', 30)])
+        self.assertEqual([rec.id for rec in self.fsdb.search_records('test_table', [('num', '=', 30)])], [11, 15, 19])
+
+        self.fsdb.close_database()
+        self.fsdb.open_database('test_db')
+        self.assertEqual(self.fsdb.get_table('test_table').record_ids.tolist(), [7, 11, 15, 19])
+        self.assertEqual(self.fsdb.delete_records('test_table'), 4)
+        self.assertEqual(self.fsdb.search_records('test_table'), [])
+
+        # all live objects of deleted record are invalidated, ids without live objects are pruned
+        rec = self.fsdb.create_record('test_table', {})
+        other_rec = self.fsdb.browse_records('test_table', rec.id)
+        rec.delete()
+        self.assertRaises(FsdbObjectDeleted, lambda: other_rec.id)
+        table = self.fsdb.get_table('test_table')
+        table.records_prune_size = 10
+        with unittest.mock.patch.object(fsdb.table.Table, 'MIN_RECORDS_PRUNE_SIZE', 10):
+            for rid in range(100):
+                fsdb.Record(rid, table)
+        self.assertLessEqual(len(table.records), 10)
+
+    def test_write_behind(self):
+        self.fsdb.init_from_config([{
+            'name': 'test_db',
+            'tables': [
+                {
+                    'name': 'test_table',
+                    'fields': [
+                        {'name': 'id', 'type': 'int', },
+                        {'name': 'num', 'type': 'int', 'index': True},
+                    ],
+                    'records': [{'id': i, 'num': 0} for i in range(1, 6)],
+                },
+            ],
+        }])
+        self.fsdb.open_database('test_db')
+        table = self.fsdb.get_table('test_table')
+        self.fsdb.set_write_behind('test_table', max_records=3, max_delay=None)
+
+        table_path = table.table_path
+
+        def read_file_num(rid):
+            with open(os.path.join(table_path, str(rid), 'data.json'), 'r') as f:
+                return json.loads(f.read())['num']
+
+        # repeated writes are buffered and coalesced, reads see buffered values, nothing is written to table folder
+        rec = self.fsdb.browse_records('test_table', 1)
+        with unittest.mock.patch('fsdb.record.write_file') as write_file, \
+                unittest.mock.patch('fsdb.index.append_file') as append_file, \
+                unittest.mock.patch.object(table.id_manifest, 'touch') as touch:
+            for i in range(10):
+                rec.write({'num': i})
+        self.assertEqual((write_file.call_count, append_file.call_count, touch.call_count), (0, 0, 0))
+        table.cache.clear()
+        self.assertEqual(rec.read()['num'], 9)
+        self.assertEqual(read_file_num(1), 0)
+        self.assertEqual(len(self.fsdb.search_records('test_table', [('num', '=', 9)])), 1)
+
+        # explicit flush
+        self.assertEqual(self.fsdb.flush(), 1)
+        self.assertEqual(read_file_num(1), 9)
+
+        # flush on size threshold
+        self.fsdb.write_records('test_table', {'num': 1}, [('id', 'in', [2, 3, 4])])
+        self.assertEqual(len(table.write_buffer), 0)
+        self.assertEqual(read_file_num(4), 1)
+
+        # flush on time threshold
+        self.fsdb.set_write_behind('test_table', max_records=None, max_delay=0.05)
+        self.fsdb.browse_records('test_table', 2).write({'num': 2})
+        self.assertEqual(read_file_num(2), 1)
+        table.write_buffer.timer.join()
+        self.assertEqual(read_file_num(2), 2)
+
+        # flush on close, deleted records are not written
+        self.fsdb.browse_records('test_table', 3).write({'num': 3})
+        self.fsdb.browse_records('test_table', 4).write({'num': 4})
+        self.fsdb.browse_records('test_table', 4).delete()
+        self.fsdb.close_database()
+        self.assertEqual(read_file_num(3), 3)
+        self.assertFalse(os.path.exists(os.path.join(table_path, '4')))
+
+        def search_ids(manager, num):
+            return [rec.id for rec in manager.search_records('test_table', [('num', '=', num)])]
+
+        # index changes are saved after buffered data, indexes of crashed process match data files
+        self.fsdb.open_database('test_db')
+        table = self.fsdb.get_table('test_table')
+        self.fsdb.set_write_behind('test_table', max_records=None, max_delay=None)
+        self.fsdb.browse_records('test_table', 5).write({'num': 5})
+        self.assertEqual(search_ids(self.fsdb, 5), [5])
+        manager = fsdb.Manager(self.root_path)
+        manager.open_database('test_db')
+        self.assertEqual((search_ids(manager, 5), search_ids(manager, 0)), ([], [5]))
+        manager.close_database()
+
+        # indexes are rebuilt if process crashed while write buffer was being flushed
+        with unittest.mock.patch.object(table, 'flush_indexes', side_effect=OSError('crash')):
+            self.assertRaises(OSError, self.fsdb.flush)
+        self.assertEqual(read_file_num(5), 5)
+        manager = fsdb.Manager(self.root_path)
+        manager.open_database('test_db')
+        self.assertEqual((search_ids(manager, 5), search_ids(manager, 0)), ([5], []))
+        self.assertFalse(os.path.exists(os.path.join(table_path, 'indexes.dirty')))
+        manager.close_database()
+
+    def test_durability(self):
+        self.fsdb.init_from_config([{
+            'name': 'test_db',
+            'durability': 'fsync',
+            'tables': [
+                {
+                    'name': 'test_table',
+                    'fields': [
+                        {'name': 'id', 'type': 'int', },
+                        {'name': 'num', 'type': 'int', 'index': True},
+                    ],
+                    'records': [{'id': 1, 'num': 1}],
+                },
+                {
+                    'name': 'test_table_safe',
+                    'durability': 'fsync_dir',
+                    'fields': [
+                        {'name': 'id', 'type': 'int', },
+                    ],
+                    'records': [{'id': 1}],
+                },
+            ],
+        }])
+        self.fsdb.open_database('test_db')
+        self.assertEqual(self.fsdb.get_table('test_table').get_durability(), 'fsync')
+        self.assertEqual(self.fsdb.get_table('test_table_safe').get_durability(), 'fsync_dir')
+        self.assertRaises(FsdbError, lambda: self.fsdb.set_durability('invalid'))
+
+        # table folder is synced after record folders are created or removed, only in fsync_dir mode
+        safe_path = self.fsdb.get_table('test_table_safe').table_path
+        with unittest.mock.patch('fsdb.table.fsync_dir') as fsync_dir:
+            self.fsdb.create_record('test_table', {'num': 2}).delete()
+            self.assertEqual(fsync_dir.call_count, 0)
+            self.fsdb.create_record('test_table_safe', {'id': 2})
+            self.assertEqual(fsync_dir.call_args_list, [unittest.mock.call(safe_path)])
+            self.fsdb.browse_records('test_table_safe', 2).delete()
+            self.assertEqual(fsync_dir.call_count, 2)
+            self.fsdb.create_records('test_table_safe', [{'id': 2}, {'id': 3}])
+            self.assertEqual(fsync_dir.call_count, 4)
+            self.fsdb.delete_records('test_table_safe', [('id', 'in', [2, 3])])
+            self.assertEqual(fsync_dir.call_count, 5)
+        self.assertTrue(all(call == unittest.mock.call(safe_path) for call in fsync_dir.call_args_list))
+
+        self.fsdb.set_durability('none')
+        self.fsdb.set_durability(None, 'test_table_safe')
+        self.fsdb.close_database()
+        self.fsdb.open_database('test_db')
+        self.assertEqual(self.fsdb.get_table('test_table_safe').get_durability(), 'none')
+
+        # failed write leaves old content and no temporary files
+        rec = self.fsdb.browse_records('test_table', 1)
+        replace = os.replace
+        try:
+            def failing_replace(*args):
+                raise OSError('Simulated crash')
+            os.replace = failing_replace
+            self.assertRaises(OSError, lambda: rec.write({'num': 2}))
+        finally:
+            os.replace = replace
+        with open(rec.data_path, 'r') as f:
+            self.assertEqual(json.loads(f.read())['num'], 1)
+        self.assertEqual(os.listdir(rec.record_path), ['data.json'])
+
+        # id manifest stays valid after index files are replaced
+        rec.write({'num': 3})
+        self.fsdb.close_database()
+        self.fsdb.open_database('test_db')
+        table = self.fsdb.get_table('test_table')
+        self.assertIsNotNone(table.id_manifest.load())
+
+    def test_serializers(self):
+        data = {'a': None, 'b': [True, False, 1, -2**63, 2**70, 1.5, 'text ž'], 'c': {'d': {}, 'e': []}}
+        for name, serializer in fsdb.serializers.SERIALIZERS.items():
+            self.assertEqual(fsdb.serializers.loads(serializer.dumps(data)), data)
+        self.assertEqual(fsdb.serializers.loads(fsdb.serializers.get_serializer('binary').dumps({1: (1, 2)})),
+                         {'1': [1, 2]})
+        self.assertRaises(FsdbError, lambda: fsdb.serializers.get_serializer('pickle'))
+
+        self.fsdb.init_from_config([{
+            'name': 'test_db',
+            'serializer': 'compact_json',
+            'tables': [
+                {
+                    'name': 'test_table',
+                    'serializer': 'binary',
+                    'fields': [
+                        {'name': 'id', 'type': 'int', },
+                        {'name': 'val', 'type': 'dict', },
+                    ],
+                    'records': [{'id': 1, 'val': {'x': [1, 2]}}],
+                },
+            ],
+        }])
+        self.fsdb.open_database('test_db')
+        table = self.fsdb.get_table('test_table')
+        self.assertEqual(table.get_serializer(), 'binary')
+        rec1 = self.fsdb.browse_records('test_table', 1)
+        with open(rec1.data_path, 'rb') as f:
+            self.assertTrue(f.read().startswith(fsdb.serializers.BinarySerializer.MAGIC))
+
+        # records in different formats can be mixed in one table
+        self.fsdb.set_serializer(None, 'test_table')
+        rec2 = self.fsdb.create_record('test_table', {'val': {'y': 'z'}})
+        with open(rec2.data_path, 'rb') as f:
+            self.assertEqual(json.loads(f.read()), rec2.read_data_file())
+        self.fsdb.close_database()
+        self.fsdb.open_database('test_db')
+        self.assertEqual([rec.read()['val'] for rec in self.fsdb.search_records('test_table')],
+                         [{'x': [1, 2]}, {'y': 'z'}])
+
+    def test_lazy_tables(self):
+        self.fsdb.init_from_config([{
+            'name': 'test_db',
+            'tables': [
+                {
+                    'name': 'table{}'.format(i),
+                    'fields': [
+                        {'name': 'id', 'type': 'int', },
+                    ],
+                    'records': [{'id': 1}],
+                } for i in range(3)
+            ],
+        }])
+
+        # tables are registered on open and loaded on first access
+        self.fsdb.open_database('test_db')
+        tables = self.fsdb.database.tables
+        self.assertEqual(sorted(tables.keys()), ['table0', 'table1', 'table2'])
+        self.assertFalse(any(tables.is_loaded(name) for name in tables))
+        self.assertTrue(self.fsdb.is_table('table0'))
+        self.assertEqual(self.fsdb.get_table('table0').record_ids.tolist(), [1])
+        self.assertTrue(tables.is_loaded('table0'))
+        self.assertFalse(tables.is_loaded('table1'))
+
+        # warm-up loads tables in background
+        self.fsdb.database.warm_up(['table1']).join()
+        self.assertTrue(tables.is_loaded('table1'))
+        self.assertFalse(tables.is_loaded('table2'))
+
+        # unloaded table is deleted without loading it
+        with unittest.mock.patch('fsdb.database.Table', side_effect=AssertionError):
+            self.fsdb.delete_table('table2')
+        self.assertFalse(self.fsdb.is_table('table2'))
+        self.assertFalse(os.path.exists(os.path.join(self.root_path, 'test_db', 'table2')))
+
+        # tables aren't loaded (by warm-up thread) after database is closed
+        self.fsdb.open_database('test_db')
+        tables = self.fsdb.database.tables
+        self.fsdb.close_database()
+        with self.assertRaises(FsdbDatabaseClosed):
+            tables['table1']
+        self.assertFalse(tables.is_loaded('table1'))
+
+        self.fsdb.open_database('test_db', warm_up=True)
+        self.assertEqual(len(self.fsdb.search_records('table1')), 1)
+
+    def test_async_manager(self):
+        async def run():
+            async with fsdb.AsyncManager(self.root_path, max_workers=2) as afsdb:
+                await afsdb.create_database('test_db')
+                await afsdb.open_database('test_db')
+                for name in ['table1', 'table2']:
+                    await afsdb.create_table(name, [{'name': 'id', 'type': 'int'}, {'name': 'num', 'type': 'int'}])
+
+                # concurrent writes to different tables
+                await asyncio.gather(*[
+                    afsdb.create_record(name, {'num': i}) for i in range(10) for name in ['table1', 'table2']])
+
+                # concurrent reads
+                results = await asyncio.gather(
+                    afsdb.search_records('table1', [('num', '<', 5)]),
+                    afsdb.search_records('table2', [('num', '>=', 5)], order='num desc'),
+                )
+                self.assertEqual(len(results[0]), 5)
+                self.assertEqual([(await afsdb.read_record(rec, ['num']))['num'] for rec in results[1]],
+                                 [9, 8, 7, 6, 5])
+
+                records = [rec async for rec in afsdb.iter_records('table1', order='num asc', limit=4, batch_size=3)]
+                self.assertEqual([rec.id for rec in records], [1, 2, 3, 4])
+                records = [rec async for rec in afsdb.iter_records('table1', [('num', '>=', 5)], workers=2,
+                                                                   chunk_size=2, batch_size=3)]
+                self.assertEqual([rec.id for rec in records], [6, 7, 8, 9, 10])
+
+                # cancelled operation doesn't leave table locked
+                task = asyncio.ensure_future(afsdb.search_records('table1'))
+                await asyncio.sleep(0)
+                task.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await task
+                await afsdb.write_record(records[0], {'num': 100})
+                self.assertEqual(len(await afsdb.search_records('table1', [('num', '=', 100)])), 1)
+
+                # cancelled operation that is waiting for thread pool is not run
+                release = threading.Event()
+                blockers = [afsdb.executor.submit(release.wait) for _ in range(afsdb.max_workers)]
+                task = asyncio.ensure_future(afsdb.write_record(records[0], {'num': 200}))
+                await asyncio.sleep(0.01)
+                task.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await task
+                release.set()
+                await asyncio.wrap_future(blockers[0])
+                self.assertEqual(len(await afsdb.search_records('table1', [('num', '=', 100)])), 1)
+
+                await afsdb.delete_record(records[0])
+                self.assertEqual(await afsdb.search_records('table1', [('num', '=', 100)]), [])
+            self.assertIsNone(afsdb.database)
+
+        asyncio.run(run())
+
     def _assertFileEqual(self, file, file_read):
         if file is None or file_read is None:
             self.assertEqual(file, file_read)
@@ -268,6 +1363,459 @@ class TestFSDB(unittest.TestCase):
         rec.write({'files': None})
         self._assertFileListEqual(None, rec.read()['files'])
 
+    def test_file_streaming(self):
+        self.fsdb.init_from_config([{
+            'name': 'test_db',
+            'tables': [
+                {
+                    'name': 'test_table',
+                    'fields': [
+                        {'name': 'id', 'type': 'int', },
+                        {'name': 'file', 'type': 'file', },
+                        {'name': 'files', 'type': 'file_list', },
+                    ],
+                },
+            ],
+        }])
+        self.fsdb.open_database('test_db')
+        data = bytes(range(256)) * 1000
+
+        # write from file-like object and from iterator of chunks
+        rec = self.fsdb.create_record('test_table', {
+            'file': {'name': 'f1.bin', 'data': io.BytesIO(data)},
+            'files': [{'name': 'f2.bin', 'data': (data[i:i + 1000] for i in range(0, len(data), 1000))}],
+        })
+        self._assertFileEqual({'name': 'f1.bin', 'data': data}, rec.read()['file'])
+        self._assertFileListEqual([{'name': 'f2.bin', 'data': data}], rec.read()['files'])
+        self.assertRaises(FsdbError, lambda: rec.write({'file': {'name': 'f3.txt', 'data': 'text'}}))
+        self.assertRaises(FsdbError, lambda: rec.write({'file': {'name': 'f3.txt', 'data': ['text']}}))
+
+        # lazy handles are added only on request and aren't cached
+        self.assertNotIn('handle', rec.read()['file'])
+        values = rec.read(['file', 'files'], file_handles=True)
+        self.assertNotIn('handle', rec.read()['file'])
+
+        with values['file']['handle'] as handle:
+            self.assertEqual(handle.name, 'f1.bin')
+            self.assertEqual(handle.size, len(data))
+            self.assertEqual(b''.join(handle.iter_chunks(4096)), data)
+            view = handle.memoryview()
+            self.assertEqual(view[1000:1010], data[1000:1010])
+            view.release()
+
+            out_path = os.path.join(self.root_path, 'out.bin')
+            with open(out_path, 'wb') as f:
+                self.assertEqual(handle.sendfile(f, offset=10, count=100), 100)
+            with open(out_path, 'rb') as f:
+                self.assertEqual(f.read(), data[10:110])
+
+        # handle can be used to copy file to other record
+        copy_value = {'name': 'copy.bin', 'data': values['files'][0]['handle']}
+        rec2 = self.fsdb.create_record('test_table', {'file': copy_value})
+        values['files'][0]['handle'].close()
+        self._assertFileEqual({'name': 'copy.bin', 'data': data}, rec2.read()['file'])
+
+        # streams can be read only once, they can't be written to multiple records, bytes and lists of chunks can
+        domain = [('id', 'in', [rec.id, rec2.id])]
+        for value in [{'file': {'name': 'f.bin', 'data': io.BytesIO(data)}},
+                      {'files': [('add', {'name': 'f.bin', 'data': iter([data])})]}]:
+            self.assertRaises(FsdbError, lambda: self.fsdb.write_records('test_table', value, domain, workers=2))
+        self.assertEqual(os.path.getsize(rec2.read()['file']['path']), len(data))
+        self.assertEqual(self.fsdb.write_records('test_table', {'file': {'name': 'f.bin', 'data': data}}, domain), 2)
+        chunks_value = {'files': [{'name': 'f.bin', 'data': [data[:10], data[10:]]}]}
+        self.assertEqual(self.fsdb.write_records('test_table', chunks_value, domain, workers=2), 2)
+        for record in [rec, rec2]:
+            self._assertFileEqual({'name': 'f.bin', 'data': data}, record.read()['file'])
+            self._assertFileListEqual([{'name': 'f.bin', 'data': data}], record.read()['files'])
+        self.assertEqual(self.fsdb.write_records('test_table', {'file': {'name': 'g.bin', 'data': io.BytesIO(data)}},
+                                                 [('id', '=', rec.id)]), 1)
+        self._assertFileEqual({'name': 'g.bin', 'data': data}, rec.read()['file'])
+
+    def test_file_list_commands(self):
+        self.fsdb.init_from_config([{
+            'name': 'test_db',
+            'tables': [
+                {
+                    'name': 'test_table',
+                    'fields': [
+                        {'name': 'id', 'type': 'int', },
+                        {'name': 'files', 'type': 'file_list', },
+                    ],
+                },
+            ],
+        }])
+        self.fsdb.open_database('test_db')
+
+        def read_files(record):
+            files = {}
+            for f in record.read(file_handles=True)['files']:
+                with f['handle'] as handle:
+                    files[f['name']] = handle.read()
+            return files
+
+        def get_inode(record, filename):
+            return os.stat(os.path.join(record.record_path, 'files', filename)).st_ino
+
+        rec = self.fsdb.create_record('test_table', {'files': [{'name': 'a.txt', 'data': b'A'}]})
+
+        # incremental commands
+        rec.write({'files': [('add', {'name': 'b.txt', 'data': b'B'}), ('add', {'name': 'c.txt', 'data': b'C'})]})
+        self.assertEqual(read_files(rec), {'a.txt': b'A', 'b.txt': b'B', 'c.txt': b'C'})
+        a_inode = get_inode(rec, 'a.txt')
+        rec.write({'files': [('replace', {'name': 'b.txt', 'data': b'BB'}), ('remove', 'c.txt')]})
+        self.assertEqual(read_files(rec), {'a.txt': b'A', 'b.txt': b'BB'})
+        rec.write({'files': [('rename', 'a.txt', 'tmp'), ('rename', 'b.txt', 'a.txt'), ('rename', 'tmp', 'b.txt')]})
+        self.assertEqual(read_files(rec), {'a.txt': b'BB', 'b.txt': b'A'})
+        self.assertEqual(get_inode(rec, 'b.txt'), a_inode)
+        rec.write({'files': [
+            ('remove', 'a.txt'), ('rename', 'b.txt', 'a.txt'), ('add', {'name': 'b.txt', 'data': b'B'})]})
+        self.assertEqual(read_files(rec), {'a.txt': b'A', 'b.txt': b'B'})
+        rec.write({'files': [('rename', 'a.txt', 'c.txt'), ('rename', 'c.txt', 'a.txt')]})
+        self.assertEqual(read_files(rec), {'a.txt': b'A', 'b.txt': b'B'})
+        self.assertEqual([f['name'] for f in rec.read()['files']], ['a.txt', 'b.txt'])
+
+        # invalid commands don't change anything
+        for commands in [
+            [('add', {'name': 'a.txt', 'data': b'X'})],
+            [('replace', {'name': 'x.txt', 'data': b'X'})],
+            [('remove', 'b.txt'), ('remove', 'b.txt')],
+            [('rename', 'a.txt', 'b.txt')],
+            [('rename', 'a.txt', 'a/b')],
+            [('copy', 'a.txt', 'b.txt')],
+        ]:
+            self.assertRaises(FsdbError, lambda: rec.write({'files': commands}))
+            self.assertEqual(read_files(rec), {'a.txt': b'A', 'b.txt': b'B'})
+
+        # full write only writes changed files
+        a_inode, b_inode = get_inode(rec, 'a.txt'), get_inode(rec, 'b.txt')
+        rec.write({'files': [{'name': 'a.txt', 'data': b'A'}, {'name': 'b.txt', 'data': b'X'}]})
+        self.assertEqual(read_files(rec), {'a.txt': b'A', 'b.txt': b'X'})
+        self.assertEqual(get_inode(rec, 'a.txt'), a_inode)
+        self.assertNotEqual(get_inode(rec, 'b.txt'), b_inode)
+
+        # writing back read value with file handles doesn't change files
+        a_inode = get_inode(rec, 'a.txt')
+        files = rec.read(file_handles=True)['files']
+        rec.write({'files': [{'name': f['name'], 'data': f['handle']} for f in files if f['name'] == 'a.txt']})
+        self.assertEqual(read_files(rec), {'a.txt': b'A'})
+        files[0]['handle'].close()
+        self.assertEqual(get_inode(rec, 'a.txt'), a_inode)
+
+    def test_file_metadata(self):
+        self.fsdb.init_from_config([{
+            'name': 'test_db',
+            'tables': [
+                {
+                    'name': 'test_table',
+                    'fields': [
+                        {'name': 'id', 'type': 'int', },
+                        {'name': 'file', 'type': 'file', },
+                        {'name': 'files', 'type': 'file_list', },
+                        {'name': 'verified_files', 'type': 'file_list', 'verify_files': True},
+                    ],
+                },
+            ],
+        }])
+        self.assertRaises(FsdbError, lambda: self.fsdb.create_table('bad_table', [
+            {'name': 'id', 'type': 'int'}, {'name': 'file', 'type': 'file', 'verify_files': True}]))
+        self.fsdb.open_database('test_db')
+        table = self.fsdb.get_table('test_table')
+        rec = self.fsdb.create_record('test_table', {
+            'file': {'name': 'a.txt', 'data': b'A'},
+            'files': [{'name': 'b.png', 'data': b'BB'}, {'name': 'c.txt', 'data': b'CCC'}],
+            'verified_files': [{'name': 'c.txt', 'data': b'CCC'}],
+        })
+
+        # metadata are saved in data file and used without scanning directory
+        data_values = rec.read_data_file()
+        self.assertEqual(data_values['file']['size'], 1)
+        self.assertEqual([f['name'] for f in data_values['files']['files']], ['b.png', 'c.txt'])
+        table.cache.clear()
+        with unittest.mock.patch('os.scandir', side_effect=AssertionError('directory was scanned')), \
+                unittest.mock.patch('fsdb.field.os.stat', side_effect=os.stat) as stat:
+            values = rec.read(['file', 'files'])
+        self.assertEqual(stat.call_count, 2)  # file and directory of file_list, files in directory aren't checked
+        self.assertEqual((values['file']['size'], values['file']['mime']), (1, 'text/plain'))
+        self.assertEqual([(f['name'], f['size'], f['mime']) for f in values['files']],
+                         [('b.png', 2, 'image/png'), ('c.txt', 3, 'text/plain')])
+
+        # files modified in place don't change mtime of directory, they are detected by their own mtime and size only
+        # if field verifies files
+        for name in ['files', 'verified_files']:
+            with open(os.path.join(rec.record_path, name, 'c.txt'), 'ab') as f:
+                f.write(b'CC')
+        table.cache.clear()
+        with unittest.mock.patch('os.scandir', side_effect=AssertionError('directory was scanned')):
+            values = rec.read()
+        self.assertEqual([(f['name'], f['size']) for f in values['files']], [('b.png', 2), ('c.txt', 3)])
+        self.assertEqual([(f['name'], f['size']) for f in values['verified_files']], [('c.txt', 5)])
+
+        # changes outside of database are detected
+        with open(os.path.join(rec.record_path, 'a.txt'), 'ab') as f:
+            f.write(b'AA')
+        for name in ['d.txt', '.e.txt.123-456.tmp', '.b.png.123-456.rename']:  # + leftovers of crashed writes
+            with open(os.path.join(rec.record_path, 'files', name), 'wb') as f:
+                f.write(b'D')
+        os.utime(os.path.join(rec.record_path, 'files'), ns=(0, 0))  # mtime could be in same tick as last write
+        table.cache.clear()
+        values = rec.read()
+        self.assertEqual(values['file']['size'], 3)
+        self.assertEqual([f['name'] for f in values['files']], ['b.png', 'c.txt', 'd.txt'])
+
+        # values written by older versions (only filename of file field)
+        data_values['file'] = 'a.txt'
+        data_values['files'] = None
+        rec.write_data_file(data_values)
+        table.cache.clear()
+        values = rec.read()
+        self.assertEqual(values['file']['size'], 3)
+        self.assertEqual([f['name'] for f in values['files']], ['b.png', 'c.txt', 'd.txt'])
+        rec.write({'file': {'name': 'e.txt', 'data': b'E'}, 'files': [('remove', 'd.txt')]})
+        self.assertFalse(os.path.exists(os.path.join(rec.record_path, 'a.txt')))
+        self.assertEqual([f['name'] for f in rec.read()['files']], ['b.png', 'c.txt'])
+
+        # unchanged files are detected by hash saved in metadata (after first check of scanned file), files
+        # modified in place are hashed again
+        rec.write({'files': [('replace', {'name': 'b.png', 'data': b'BB'})]})
+        self.assertEqual(rec.read_data_file()['files']['files'][0]['sha256'], hashlib.sha256(b'BB').hexdigest())
+        with unittest.mock.patch('fsdb.field.file_content_digest', side_effect=AssertionError('file was hashed')):
+            rec.write({'files': [('replace', {'name': 'b.png', 'data': b'BB'})]})
+        c_path = os.path.join(rec.record_path, 'files', 'c.txt')
+        rec.write({'files': [('replace', {'name': 'c.txt', 'data': b'CCC'})]})
+        with open(c_path, 'r+b') as f:
+            f.write(b'XXX')
+        os.utime(c_path, ns=(0, 0))
+        rec.write({'files': [('replace', {'name': 'c.txt', 'data': b'CCC'})]})
+        with open(c_path, 'rb') as f:
+            self.assertEqual(f.read(), b'CCC')
+
+    def test_blob_store(self):
+        self.fsdb.init_from_config([{
+            'name': 'test_db',
+            'blob_store': True,
+            'tables': [
+                {
+                    'name': 'test_table',
+                    'fields': [
+                        {'name': 'id', 'type': 'int', },
+                        {'name': 'logo', 'type': 'file', },
+                        {'name': 'files', 'type': 'file_list', },
+                    ],
+                },
+            ],
+        }])
+        self.fsdb.open_database('test_db')
+        blob_store = self.fsdb.database.blob_store
+        logo = b'LOGO' * 100
+        digest = hashlib.sha256(logo).hexdigest()
+
+        def get_inode(record, *path):
+            return os.stat(os.path.join(record.record_path, *path)).st_ino
+
+        # same content is stored once, from bytes or stream
+        rec1 = self.fsdb.create_record('test_table', {'logo': {'name': 'logo.png', 'data': logo}})
+        rec2 = self.fsdb.create_record('test_table', {'logo': {'name': 'a.png', 'data': io.BytesIO(logo)},
+                                                      'files': [{'name': 'b.png', 'data': [logo[:10], logo[10:]]}]})
+        rec3 = self.fsdb.create_record('test_table', {'logo': {'name': 'logo.png', 'data': logo}})
+        self.assertEqual(blob_store.get_ref_count(digest), 4)
+        self.assertEqual(get_inode(rec1, 'logo.png'), get_inode(rec2, 'files', 'b.png'))
+        self._assertFileEqual({'name': 'a.png', 'data': logo}, rec2.read()['logo'])
+        self.assertEqual(rec1.read_data_file()['logo']['blob'], digest)
+        self.assertEqual(rec2.read_data_file()['files']['files'][0]['sha256'], digest)
+
+        # references are released by writes and deletes, blob is removed with its last reference
+        rec2.write({'logo': None, 'files': [('remove', 'b.png')]})
+        self.assertEqual(blob_store.get_ref_count(digest), 2)
+        rec3.delete()
+        self.assertEqual(blob_store.get_ref_count(digest), 1)
+        rec1.write({'logo': {'name': 'logo.png', 'data': b'NEW'}})
+        self.assertIsNone(blob_store.get_ref_count(digest))
+        self._assertFileEqual({'name': 'logo.png', 'data': b'NEW'}, rec1.read()['logo'])
+
+        # failed batch create releases blobs of saved records and of record that failed
+        write_data_file = fsdb.record.Record.write_data_file
+
+        def failing_write_data_file(record, data_values):
+            if data_values['logo']['name'] == 'y.png':
+                raise OSError('disk full')
+            write_data_file(record, data_values)
+
+        with unittest.mock.patch.object(fsdb.record.Record, 'write_data_file', failing_write_data_file):
+            self.assertRaises(OSError, lambda: self.fsdb.create_records('test_table', [
+                {'logo': {'name': 'x.png', 'data': b'X'}}, {'logo': {'name': 'y.png', 'data': b'Y'}}]))
+        self.assertIsNone(blob_store.get_ref_count(hashlib.sha256(b'X').hexdigest()))
+        self.assertIsNone(blob_store.get_ref_count(hashlib.sha256(b'Y').hexdigest()))
+
+        # blob of file overwritten by rename is released
+        rec = self.fsdb.create_record('test_table', {'files': [{'name': 'a.txt', 'data': b'RA'},
+                                                               {'name': 'b.txt', 'data': b'RB'}]})
+        rec.write({'files': [('remove', 'b.txt'), ('rename', 'a.txt', 'b.txt')]})
+        self.assertIsNone(blob_store.get_ref_count(hashlib.sha256(b'RB').hexdigest()))
+        self.assertEqual(blob_store.get_ref_count(hashlib.sha256(b'RA').hexdigest()), 1)
+        rec.delete()
+
+        # blob of buffered file write is released when record is deleted before flush
+        self.fsdb.set_write_behind('test_table', max_records=100, max_delay=60)
+        rec = self.fsdb.create_record('test_table', {})
+        rec.write({'logo': {'name': 'z.png', 'data': b'Z'}})
+        self.assertEqual(blob_store.get_ref_count(hashlib.sha256(b'Z').hexdigest()), 1)
+        rec.delete()
+        self.assertIsNone(blob_store.get_ref_count(hashlib.sha256(b'Z').hexdigest()))
+        self.fsdb.set_write_behind('test_table', enabled=False)
+
+        # blob store isn't table, unreferenced blobs (4 new + rec1 logo) are removed by incremental gc
+        self.fsdb.close_database()
+        self.fsdb.open_database('test_db')
+        self.assertEqual(list(self.fsdb.database.tables.keys()), ['test_table'])
+        self.assertRaises(FsdbError, lambda: self.fsdb.create_table('.blobs', [{'name': 'id', 'type': 'int'}]))
+        table_path = self.fsdb.get_table('test_table').table_path
+        self.fsdb.create_records('test_table', [{'logo': {'name': 'f.txt', 'data': str(i).encode()}} for i in range(4)])
+        for name in os.listdir(table_path):
+            if os.path.isdir(os.path.join(table_path, name)):
+                shutil.rmtree(os.path.join(table_path, name))
+        self.assertEqual(self.fsdb.gc_blobs(limit=2), 2)
+        self.assertEqual(self.fsdb.gc_blobs(limit=2), 2)
+        self.assertEqual(self.fsdb.gc_blobs(), 1)
+        self.assertEqual(self.fsdb.gc_blobs(), 0)
+
+        # blobs of deleted tables are removed, also if table isn't loaded, blobs of other tables are kept
+        self.fsdb.delete_table('test_table')
+        fields = [{'name': 'id', 'type': 'int'}, {'name': 'logo', 'type': 'file'}]
+        self.fsdb.create_table('test_table', list(fields))
+        self.fsdb.create_table('other_table', list(fields))
+        self.fsdb.create_records('test_table', [{'logo': {'name': 'a.png', 'data': logo}}] * 2)
+        self.fsdb.create_record('test_table', {'logo': {'name': 'b.png', 'data': b'DELETED'}})
+        self.fsdb.create_record('other_table', {'logo': {'name': 'a.png', 'data': logo}})
+        self.fsdb.delete_table('test_table')
+        self.assertEqual(blob_store.get_ref_count(digest), 1)
+        self.assertIsNone(blob_store.get_ref_count(hashlib.sha256(b'DELETED').hexdigest()))
+        self.fsdb.close_database()
+        self.fsdb.open_database('test_db')
+        self.fsdb.delete_table('other_table')
+        self.assertIsNone(blob_store.get_ref_count(digest))
+
+        # blobs of deduplicated files are released and collected also when blob store is disabled
+        self.fsdb.create_table('test_table', list(fields))
+        rec1 = self.fsdb.create_record('test_table', {'logo': {'name': 'a.png', 'data': logo}})
+        rec2_path = self.fsdb.create_record('test_table', {'logo': {'name': 'a.png', 'data': logo}}).record_path
+        self.fsdb.set_blob_store(False)
+        rec1.delete()
+        self.assertEqual(blob_store.get_ref_count(digest), 1)
+        self.fsdb.close_database()
+        self.fsdb.open_database('test_db')
+        os.remove(os.path.join(rec2_path, 'a.png'))
+        self.assertEqual(self.fsdb.gc_blobs(), 1)
+        self.assertIsNone(blob_store.get_ref_count(digest))
+        self.fsdb.set_blob_store(True)
+        blob_store = self.fsdb.database.blob_store
+        self.fsdb.delete_table('test_table')
+
+        # files are copied if hardlinks aren't supported
+        self.fsdb.create_table('test_table', [{'name': 'id', 'type': 'int'}, {'name': 'logo', 'type': 'file'}])
+        with unittest.mock.patch('os.link', side_effect=OSError('not supported')):
+            rec = self.fsdb.create_record('test_table', {'logo': {'name': 'logo.png', 'data': logo}})
+        self.assertEqual(blob_store.get_ref_count(digest), 0)
+        self._assertFileEqual({'name': 'logo.png', 'data': logo}, rec.read()['logo'])
+
+    def test_compression(self):
+        self.fsdb.init_from_config([{
+            'name': 'test_db',
+            'tables': [
+                {
+                    'name': 'test_table',
+                    'fields': [
+                        {'name': 'id', 'type': 'int', },
+                        {'name': 'text', 'type': 'str', 'compression': 'zlib', 'compression_threshold': 100, },
+                        {'name': 'attrs', 'type': 'dict', 'compression': 'lzma', },
+                        {'name': 'file', 'type': 'file', 'compression': 'zlib', 'compression_threshold': 100, },
+                        {'name': 'files', 'type': 'file_list', 'compression': 'lzma', },
+                    ],
+                },
+            ],
+        }])
+        self.assertRaises(FsdbError, lambda: self.fsdb.create_table('bad_table', [
+            {'name': 'id', 'type': 'int'}, {'name': 'num', 'type': 'int', 'compression': 'zlib'}]))
+        self.assertRaises(FsdbError, lambda: self.fsdb.create_table('bad_table', [
+            {'name': 'id', 'type': 'int'}, {'name': 'text', 'type': 'str', 'compression': 'zip'}]))
+
+        self.fsdb.open_database('test_db')
+        table = self.fsdb.get_table('test_table')
+        self.assertEqual(table.fields['file'].compression_threshold, 100)
+        text = 'lorem ipsum ' * 100
+        attrs = {'key{}'.format(i): 'value' for i in range(200)}
+        big, small = b'0123456789' * 1000, b'small'
+        rec = self.fsdb.create_record('test_table', {
+            'text': text, 'attrs': attrs,
+            'file': {'name': 'a.txt', 'data': big},
+            'files': [{'name': 'b.txt', 'data': big}, {'name': 'c.txt', 'data': small}],
+        })
+
+        # large values and files are stored compressed, small ones aren't
+        data_values = rec.read_data_file()
+        self.assertEqual(data_values['text']['__fsdb_compressed__'], 'zlib')
+        self.assertEqual(data_values['attrs']['__fsdb_compressed__'], 'lzma')
+        with open(os.path.join(rec.record_path, 'a.txt'), 'rb') as f:
+            self.assertEqual(f.read(2), b'\x1f\x8b')
+        with open(os.path.join(rec.record_path, 'files', 'b.txt'), 'rb') as f:
+            self.assertEqual(f.read(6), b'\xfd7zXZ\x00')
+        with open(os.path.join(rec.record_path, 'files', 'c.txt'), 'rb') as f:
+            self.assertEqual(f.read(), small)
+        rec.write({'text': 'short'})
+        self.assertEqual(rec.read_data_file()['text'], 'short')
+
+        # reads return original content
+        table.cache.clear()
+        values = rec.read(file_handles=True)
+        self.assertEqual(values['attrs'], attrs)
+        self.assertEqual((values['file']['size'], values['file']['compression']), (len(big), 'zlib'))
+        with values['file']['handle'] as handle:
+            self.assertEqual(handle.read(), big)
+            self.assertLess(os.fstat(handle.fileno()).st_size, len(big))
+        for file, data in zip(values['files'], [big, small]):
+            with file['handle'] as handle:
+                self.assertEqual((file['size'], b''.join(handle.iter_chunks())), (len(data), data))
+
+        # compressed files have no path, their content is read with handle, uncompressed files keep path
+        self.assertIsNone(values['file']['path'])
+        self.assertEqual(values['file']['stored_path'], os.path.join(rec.record_path, 'a.txt'))
+        with open(values['files'][1]['path'], 'rb') as f:
+            self.assertEqual(f.read(), small)
+
+        # dicts that contain reserved key are not taken as compressed values
+        user_attrs = {'__fsdb_compressed__': 'zlib', 'data': 'abc'}
+        rec.write({'attrs': user_attrs})
+        self.fsdb.create_table('plain_table', [{'name': 'id', 'type': 'int'}, {'name': 'attrs', 'type': 'dict'}])
+        rec3 = self.fsdb.create_record('plain_table', {'attrs': user_attrs})
+        table.cache.clear()
+        self.fsdb.get_table('plain_table').cache.clear()
+        self.assertEqual((rec.read()['attrs'], rec3.read()['attrs']), (user_attrs, user_attrs))
+        rec.write({'attrs': attrs})
+
+        # unchanged files are not rewritten, compressed files can be copied between records
+        mtime = os.stat(os.path.join(rec.record_path, 'files', 'b.txt')).st_mtime_ns
+        with unittest.mock.patch('fsdb.field.file_content_digest', side_effect=AssertionError('file was hashed')):
+            rec.write({'files': [{'name': 'b.txt', 'data': big}, {'name': 'c.txt', 'data': small}]})
+        self.assertEqual(os.stat(os.path.join(rec.record_path, 'files', 'b.txt')).st_mtime_ns, mtime)
+        values = rec.read(file_handles=True)
+        with values['file']['handle'] as handle, values['files'][0]['handle'] as handle2:
+            rec2 = self.fsdb.create_record('test_table', {
+                'file': {'name': 'a.txt', 'data': handle2}, 'files': [{'name': 'b.txt', 'data': handle}]})
+        values = rec2.read(file_handles=True)
+        for file, compression in [(values['file'], 'zlib'), (values['files'][0], 'lzma')]:
+            with file['handle'] as handle:
+                self.assertEqual((file['compression'], handle.read()), (compression, big))
+
+        # compressed files added outside of database are detected, raw .xz file below threshold stays uncompressed
+        raw_xz = lzma.compress(b'RAW')
+        rec.write({'files': [('add', {'name': 'raw.xz', 'data': raw_xz})]})
+        with open(os.path.join(rec.record_path, 'files', 'd.txt'), 'wb') as f:
+            f.write(lzma.compress(big))
+        os.utime(os.path.join(rec.record_path, 'files'), ns=(0, 0))
+        table.cache.clear()
+        files = rec.read()['files']
+        self.assertEqual((files[2]['name'], files[2]['size'], files[2]['compression']), ('d.txt', len(big), 'lzma'))
+        self.assertEqual((files[3]['name'], files[3]['size'], files[3]['compression']), ('raw.xz', len(raw_xz), None))
+
 
 if __name__ == '__main__':
     unittest.main()